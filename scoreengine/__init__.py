@@ -1,32 +1,92 @@
-import logging
+"""The Score Engine.
 
-from celery import Celery
-from sqlalchemy import engine_from_config
-from sqlalchemy.orm import sessionmaker
-import yaml
+The configuration, the Celery app and the database engine are only set up when
+first used (e.g. ``from scoreengine import celery_app``), so that commands only
+pay for what they use.
+"""
+from collections.abc import Mapping
+import logging
+import threading
 
 
 def _load_config_from_yaml(file_name: str='config.yml'):
+    import yaml
+
     with open(file_name) as file:
         return yaml.full_load(file)
 
 
-config = _load_config_from_yaml()
+class _LazyConfig(Mapping):
+    """The configuration, which is loaded from ``config.yml`` when first read."""
+
+    def __init__(self):
+        self._config = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        if self._config is None:
+            with self._lock:
+                if self._config is None:
+                    config = _load_config_from_yaml()
+                    logging.basicConfig(format=config['logging']['format'])
+                    self._config = config
+        return self._config
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __repr__(self):
+        return repr(self._load())
+
+
+config = _LazyConfig()
+
+
+def _create_celery_app():
+    from celery import Celery
+
+    return Celery(
+        __name__,
+        backend=(
+            None
+            if config['celery']['backend'] is None
+            else 'db+{}'.format(config['celery']['backend'])
+        ),
+        broker=config['celery']['broker'],
+    )
+
+
+def _create_db_engine():
+    from sqlalchemy import engine_from_config
+
+    return engine_from_config(config['database'], prefix='')
+
+
+def _create_session():
+    from sqlalchemy.orm import sessionmaker
 
+    return sessionmaker(bind=__getattr__('db_engine'))
 
-celery_app = Celery(
-    __name__,
-    backend=(
-        None
-        if config['celery']['backend'] is None
-        else 'db+{}'.format(config['celery']['backend'])
-    ),
-    broker=config['celery']['broker'],
-)
 
+_lazy_attributes = {
+    'celery_app': _create_celery_app,
+    'db_engine': _create_db_engine,
+    'Session': _create_session,
+}
+_lazy_attributes_lock = threading.RLock()
 
-logging.basicConfig(format=config['logging']['format'])
 
+def __getattr__(name):
+    if name not in _lazy_attributes:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
-db_engine = engine_from_config(config['database'], prefix='')
-Session = sessionmaker(bind=db_engine)
+    with _lazy_attributes_lock:
+        if name not in globals():
+            globals()[name] = _lazy_attributes[name]()
+    return globals()[name]
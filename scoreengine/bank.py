@@ -0,0 +1,221 @@
+"""Payouts to the Bank API.
+
+Passed checks queue a :class:`models.Payout` (see :mod:`persistence`), which a
+:class:`PayoutSender` sends to the Bank API in the background, so a slow or
+unavailable bank neither delays rounds nor loses payouts.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import logging
+import threading
+import time
+from typing import NamedTuple, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import or_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql import func
+
+from . import config, metrics, models, utils
+
+
+# DEFAULTS
+bank_config = {
+    'concurrency': 4,
+    'batch_size': 100,
+    'poll_interval': 1,
+    'timeout': 10,
+    'max_attempts': 10,
+    'retry_delay': 1,
+    'max_retry_delay': 300,
+}
+# /DEFAULTS
+
+# CONFIG
+bank_config.update(config['bank'])
+# /CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class QueueStatus(NamedTuple):
+    pending: int
+    failed: int
+    oldest: Optional[datetime]
+
+
+class PayoutSender:
+    """Send queued payouts to the Bank API.
+
+    Due payouts are sent in batches of ``batch_size``, up to ``concurrency``
+    at once over a pool of persistent connections. A payout that fails is
+    retried after a delay that doubles with each attempt (from
+    ``retry_delay`` up to ``max_retry_delay`` seconds), and given up on after
+    ``max_attempts`` attempts.
+    """
+
+    def __init__(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=bank_config['concurrency'],
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=bank_config['concurrency'])
+        self._stopped = threading.Event()
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        """Send payouts as they become due until stopped."""
+        while not self._stopped.is_set():
+            try:
+                sent = self.send_due()
+            except SQLAlchemyError as e:
+                logger.error('Unable to send payouts: %s', e)
+                sent = 0
+
+            if not sent:
+                self._stopped.wait(bank_config['poll_interval'])
+
+    def send_due(self) -> int:
+        """Send a batch of payouts that are due.
+
+        :return: The number of payouts that were attempted.
+        """
+        now = datetime.utcnow()
+        with utils.session_scope() as session:
+            payouts = (session
+                .query(
+                    models.Payout.id,
+                    models.Payout.team_id,
+                    models.Payout.created,
+                    models.Payout.attempts,
+                )
+                .filter(
+                    models.Payout.sent.is_(None),
+                    models.Payout.attempts < bank_config['max_attempts'],
+                    or_(
+                        models.Payout.next_attempt.is_(None),
+                        models.Payout.next_attempt <= now,
+                    ),
+                )
+                .order_by(models.Payout.id)
+                .limit(bank_config['batch_size'])
+                .all()
+            )
+        if not payouts:
+            return 0
+
+        outcomes = list(self._executor.map(self._send, payouts))
+
+        sent_at = datetime.utcnow()
+        updates = []
+        for payout, (error, _) in zip(payouts, outcomes):
+            attempts = payout.attempts + 1
+            if error is None:
+                updates.append(dict(
+                    id=payout.id,
+                    attempts=attempts,
+                    sent=sent_at,
+                    last_error=None,
+                ))
+                continue
+
+            retry_delay = min(
+                bank_config['retry_delay'] * 2 ** (attempts - 1),
+                bank_config['max_retry_delay'],
+            )
+            updates.append(dict(
+                id=payout.id,
+                attempts=attempts,
+                next_attempt=sent_at + timedelta(seconds=retry_delay),
+                last_error=error,
+            ))
+            if attempts >= bank_config['max_attempts']:
+                logger.error(
+                    'Giving up on payout %d to team ID %d after %d attempts: %s',
+                    payout.id, payout.team_id, attempts, error)
+            else:
+                logger.warning(
+                    'Payout %d to team ID %d failed (retrying in %g seconds): %s',
+                    payout.id, payout.team_id, retry_delay, error)
+
+        with utils.session_scope() as session:
+            session.bulk_update_mappings(models.Payout, updates)
+
+        self._report(payouts, outcomes, sent_at)
+        return len(payouts)
+
+    def _send(self, payout) -> tuple:
+        start = time.perf_counter()
+        try:
+            response = self.session.post(
+                bank_config['url'],
+                data={
+                    'username': bank_config['username'],
+                    'password': bank_config['password'],
+                    'team': payout.team_id,
+                },
+                timeout=bank_config['timeout'],
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            error = str(e)
+        else:
+            error = None
+
+        latency = time.perf_counter() - start
+        metrics.PAYOUT_DURATION.observe(latency)
+        metrics.PAYOUTS.labels(result='failed' if error else 'sent').inc()
+        return error, latency
+
+    def _report(self, payouts, outcomes, sent_at: datetime):
+        latencies = [latency for _, latency in outcomes]
+        delays = [
+            (sent_at - payout.created).total_seconds()
+            for payout, (error, _) in zip(payouts, outcomes)
+            if error is None and payout.created is not None
+        ]
+        status = get_queue_status()
+        metrics.PAYOUT_QUEUE_DEPTH.set(status.pending)
+        logger.info(
+            'Sent %d of %d payouts (requests took %.3f seconds on average, %.3f at most; '
+            'queued for up to %.1f seconds); %d still queued',
+            len(delays),
+            len(payouts),
+            sum(latencies) / len(latencies),
+            max(latencies),
+            max(delays, default=0),
+            status.pending,
+        )
+
+
+def get_queue_status() -> QueueStatus:
+    """Count the payouts still to be sent and those that were given up on."""
+    with utils.session_scope() as session:
+        pending, oldest = (session
+            .query(func.count(models.Payout.id), func.min(models.Payout.created))
+            .filter(
+                models.Payout.sent.is_(None),
+                models.Payout.attempts < bank_config['max_attempts'],
+            )
+            .one()
+        )
+        failed = (session
+            .query(models.Payout)
+            .filter(
+                models.Payout.sent.is_(None),
+                models.Payout.attempts >= bank_config['max_attempts'],
+            )
+            .count()
+        )
+    return QueueStatus(pending, failed, oldest)
@@ -0,0 +1,843 @@
+"""Benchmarks for the hot paths of the score engine."""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+import http.server
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Iterable, Optional
+
+from sqlalchemy import and_, create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import func
+
+from scoreengine import metrics, models, persistence, utils
+
+
+@contextmanager
+def _timer(timings: list):
+    start = time.perf_counter()
+    yield
+    timings.append(time.perf_counter() - start)
+
+
+def _populate_round_setup_db(session, number_of_teams: int, number_of_services: int,
+                             data_per_service: int):
+    teams = [
+        models.Team('Team {}'.format(team_num))
+        for team_num in range(1, number_of_teams + 1)
+    ]
+    services = [
+        models.Service('Service {}'.format(service_num), 'example', 'check_example')
+        for service_num in range(1, number_of_services + 1)
+    ]
+    session.add_all(teams)
+    session.add_all(services)
+    session.flush()
+
+    session.bulk_insert_mappings(models.TeamService, [
+        dict(
+            team_id=team.id,
+            service_id=service.id,
+            key='USERPASS' if order == 0 else 'KEY{}'.format(order),
+            value='user{}||password'.format(team.id) if order == 0 else str(order),
+            order=order,
+        )
+        for team in teams
+        for service in services
+        for order in range(data_per_service)
+    ])
+    session.commit()
+
+
+def round_setup(team_counts: Iterable[int], service_counts: Iterable[int],
+                data_per_service: int = 4, repeat: int = 3,
+                database_url: str = 'sqlite://'):
+    """Compare serializing a round's checks one pair at a time against in bulk.
+
+    :return: Rows of (teams, services, per-pair seconds, bulk seconds), using
+             the best time out of ``repeat`` runs.
+    """
+    rows = []
+    for number_of_teams in team_counts:
+        for number_of_services in service_counts:
+            engine = create_engine(database_url)
+            models.Base.metadata.drop_all(engine)
+            models.Base.metadata.create_all(engine)
+            session = sessionmaker(bind=engine)()
+            try:
+                _populate_round_setup_db(
+                    session, number_of_teams, number_of_services, data_per_service)
+
+                teams = session.query(models.Team).all()
+                services = session.query(models.Service).all()
+
+                per_pair_timings = []
+                bulk_timings = []
+                for _ in range(repeat):
+                    with _timer(per_pair_timings):
+                        [
+                            utils.serialize_check(session, team, service, 1)
+                            for team in teams
+                            for service in services
+                        ]
+                    with _timer(bulk_timings):
+                        utils.serialize_checks(session, teams, services, 1)
+            finally:
+                session.close()
+                models.Base.metadata.drop_all(engine)
+                engine.dispose()
+
+            rows.append((
+                number_of_teams,
+                number_of_services,
+                min(per_pair_timings),
+                min(bulk_timings),
+            ))
+    return rows
+
+
+# Statements whose time to run in a fresh interpreter is measured
+IMPORT_TIME_TARGETS = [
+    ('import scoreengine', 'import scoreengine'),
+    ('import scoreengine.cli', 'import scoreengine.cli'),
+    ('scoreengine2 --help', "from scoreengine.cli import cli; cli(['--help'], standalone_mode=False)"),
+    ('import scoreengine.utils', 'import scoreengine.utils'),
+    ('import scoreengine.tasks', 'import scoreengine.tasks'),
+    ('import scoreengine.runner', 'import scoreengine.runner'),
+]
+
+# Dependencies that are only worth loading when they are used
+HEAVY_MODULES = ('celery', 'fake_useragent', 'paramiko', 'requests', 'sqlalchemy', 'winrm', 'yaml')
+
+_IMPORT_TIME_SCRIPT = """
+import contextlib, io, json, sys, time
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    exec({statement!r})
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, sorted(name for name in {heavy_modules!r} if name in sys.modules)]))
+"""
+
+
+def import_time(repeat: int = 5):
+    """Time running each of :data:`IMPORT_TIME_TARGETS` in a fresh interpreter.
+
+    :return: Rows of (target, seconds, heavy modules that were loaded), using
+             the best time out of ``repeat`` runs.
+    """
+    rows = []
+    for name, statement in IMPORT_TIME_TARGETS:
+        script = _IMPORT_TIME_SCRIPT.format(statement=statement, heavy_modules=HEAVY_MODULES)
+        timings = []
+        for _ in range(repeat):
+            output = subprocess.run(
+                [sys.executable, '-c', script],
+                check=True,
+                stdout=subprocess.PIPE,
+                universal_newlines=True,
+            ).stdout
+            elapsed, loaded_modules = json.loads(output.splitlines()[-1])
+            timings.append(elapsed)
+        rows.append((name, min(timings), loaded_modules))
+    return rows
+
+
+def _populate_scoreboard_db(engine, number_of_teams: int, number_of_services: int,
+                            number_of_rounds: int):
+    with engine.begin() as connection:
+        connection.execute(models.Team.__table__.insert(), [
+            dict(id=team_id, name='Team {}'.format(team_id))
+            for team_id in range(1, number_of_teams + 1)
+        ])
+        connection.execute(models.Service.__table__.insert(), [
+            dict(id=service_id, name='Service {}'.format(service_id),
+                 group='example', check='check_example')
+            for service_id in range(1, number_of_services + 1)
+        ])
+
+    for round_number in range(1, number_of_rounds + 1):
+        with engine.begin() as connection:
+            connection.execute(models.Check.__table__.insert(), [
+                dict(
+                    team_id=team_id,
+                    service_id=service_id,
+                    round=round_number,
+                    passed=random.random() < 0.9,
+                    output='Check successful!',
+                )
+                for team_id in range(1, number_of_teams + 1)
+                for service_id in range(1, number_of_services + 1)
+            ])
+
+
+def _uptime_from_checks(session):
+    return (session
+        .query(
+            models.Check.team_id,
+            models.Check.service_id,
+            func.count(models.Check.id),
+            func.sum(models.Check.passed),
+        )
+        .group_by(models.Check.team_id, models.Check.service_id)
+        .all()
+    )
+
+
+def _status_from_checks(session):
+    last_round = session.query(func.max(models.Check.round)).scalar()
+    return (session
+        .query(models.Check.team_id, models.Check.service_id, models.Check.passed)
+        .filter(models.Check.round == last_round)
+        .all()
+    )
+
+
+def _team_history_from_checks(session):
+    return (session
+        .query(models.Check.round, models.Check.passed)
+        .filter(and_(models.Check.team_id == 1, models.Check.service_id == 1))
+        .order_by(models.Check.round.desc())
+        .limit(100)
+        .all()
+    )
+
+
+def _uptime_from_summaries(session):
+    return (session
+        .query(
+            models.CheckSummary.team_id,
+            models.CheckSummary.service_id,
+            models.CheckSummary.passes + models.CheckSummary.failures,
+            models.CheckSummary.passes,
+        )
+        .all()
+    )
+
+
+def _status_from_summaries(session):
+    return (session
+        .query(
+            models.CheckSummary.team_id,
+            models.CheckSummary.service_id,
+            models.CheckSummary.last_passed,
+        )
+        .all()
+    )
+
+
+SCOREBOARD_QUERIES = [
+    ('uptime', _uptime_from_checks, _uptime_from_summaries),
+    ('status', _status_from_checks, _status_from_summaries),
+    ('team history', _team_history_from_checks, None),
+]
+
+
+def scoreboard(number_of_teams: int = 40, number_of_services: int = 25,
+               number_of_rounds: int = 1000, repeat: int = 3,
+               database_url: str = 'sqlite://'):
+    """Time scoreboard queries without indexes, with indexes, and on summaries.
+
+    :return: Rows of (query, unindexed seconds, indexed seconds, summary
+             seconds or None), using the best time out of ``repeat`` runs, and
+             the number of checks that were queried.
+    """
+    engine = create_engine(database_url)
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    check_indexes = list(models.Check.__table__.indexes)
+    session = sessionmaker(bind=engine)()
+    try:
+        for index in check_indexes:
+            index.drop(engine)
+        _populate_scoreboard_db(engine, number_of_teams, number_of_services, number_of_rounds)
+
+        timings = {}
+        for name, from_checks, _ in SCOREBOARD_QUERIES:
+            timings[name] = [[], [], []]
+            for _ in range(repeat):
+                with _timer(timings[name][0]):
+                    from_checks(session)
+
+        for index in check_indexes:
+            index.create(engine)
+        persistence.rebuild_check_summaries(session)
+        session.commit()
+
+        for name, from_checks, from_summaries in SCOREBOARD_QUERIES:
+            for _ in range(repeat):
+                with _timer(timings[name][1]):
+                    from_checks(session)
+                if from_summaries is not None:
+                    with _timer(timings[name][2]):
+                        from_summaries(session)
+
+        number_of_checks = session.query(models.Check).count()
+    finally:
+        session.close()
+        models.Base.metadata.drop_all(engine)
+        engine.dispose()
+
+    rows = [
+        (name, min(unindexed), min(indexed), min(summary) if summary else None)
+        for name, (unindexed, indexed, summary) in timings.items()
+    ]
+    return rows, number_of_checks
+
+
+class _StandInWebsiteHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, unless asked to close
+    disable_nagle_algorithm = True  # or responses on kept-alive connections lag
+
+    def do_GET(self):
+        body = b'<html><body>Welcome!</body></html>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def http_checks(number_of_checks: int = 2000, concurrency: int = 10,
+                number_of_targets: int = 10):
+    """Time HTTP checks against local stand-in websites, with and without pooling.
+
+    :return: Rows of (connection pooling, seconds, checks per second, mean
+             latency, median latency, 95th percentile latency).
+    """
+    from scoreengine.checks import http as http_checks_module
+    from scoreengine.tasks import CheckData
+
+    servers = []
+    for _ in range(number_of_targets):
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _StandInWebsiteHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+
+    def perform_check(index):
+        server = servers[index % number_of_targets]
+        data = utils._build_task_description(
+            index % number_of_targets, 'Team', 1, 'Bench', 'http', 'check_http',
+            [('HOST', '127.0.0.1'), ('PORT', server.server_address[1])],
+        )
+        start = time.perf_counter()
+        http_checks_module.check_http(CheckData(data))
+        latency = time.perf_counter() - start
+        if not data['passed']:
+            raise RuntimeError('\n'.join(data['output']))
+        return latency
+
+    original_pooling = http_checks_module.http_config['connection_pooling']
+    rows = []
+    try:
+        for pooling in (False, True):
+            http_checks_module.http_config['connection_pooling'] = pooling
+            http_checks_module._get_http_headers.cache_clear()
+            http_checks_module._get_pooled_adapter.cache_clear()
+
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                start = time.perf_counter()
+                latencies = sorted(executor.map(perform_check, range(number_of_checks)))
+                elapsed = time.perf_counter() - start
+
+            rows.append((
+                pooling,
+                elapsed,
+                number_of_checks / elapsed,
+                statistics.mean(latencies),
+                statistics.median(latencies),
+                latencies[int(len(latencies) * 0.95)],
+            ))
+    finally:
+        http_checks_module.http_config['connection_pooling'] = original_pooling
+        http_checks_module._get_http_headers.cache_clear()
+        http_checks_module._get_pooled_adapter.cache_clear()
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+    return rows
+
+
+PIPELINE_MODES = ('threads', 'asyncio', 'celery')
+
+
+def _populate_pipeline_db(engine, number_of_teams: int, number_of_services: int,
+                          latency: float, max_latency: Optional[float], failure_rate: float):
+    check_config = [('LATENCY', latency), ('FAILURE_RATE', failure_rate)]
+    if max_latency is not None:
+        check_config.append(('MAX_LATENCY', max_latency))
+
+    with engine.begin() as connection:
+        connection.execute(models.Team.__table__.insert(), [
+            dict(id=team_id, name='Team {}'.format(team_id))
+            for team_id in range(1, number_of_teams + 1)
+        ])
+        connection.execute(models.Service.__table__.insert(), [
+            dict(id=service_id, name='Service {}'.format(service_id),
+                 group='example', check='check_synthetic')
+            for service_id in range(1, number_of_services + 1)
+        ])
+        connection.execute(models.TeamService.__table__.insert(), [
+            dict(team_id=team_id, service_id=service_id, key=key, value=str(value), order=order)
+            for team_id in range(1, number_of_teams + 1)
+            for service_id in range(1, number_of_services + 1)
+            for order, (key, value) in enumerate(check_config)
+        ])
+
+
+@contextmanager
+def _local_celery_worker(concurrency: int):
+    """Run a Celery worker on threads of this process, with an in-memory broker."""
+    from celery.contrib.testing.worker import start_worker
+
+    from scoreengine import celery_app, tasks  # noqa: F401 (registers the tasks)
+
+    # Only takes effect if the app has not connected to its broker yet
+    celery_app.conf.update(
+        broker_url='memory://',
+        # Poll for tasks as often as a real broker would deliver them
+        broker_transport_options={'polling_interval': 0.01},
+        result_backend='cache+memory://',
+        # The in-memory transport only checks for more tasks every couple of
+        # seconds once the worker has reserved as many as it may
+        worker_prefetch_multiplier=0,
+    )
+    with start_worker(celery_app, pool='threads', concurrency=concurrency,
+                      perform_ping_check=False, loglevel='WARNING'):
+        yield
+
+
+@contextmanager
+def _bound_session(engine):
+    """Have the score engine use another database."""
+    import scoreengine
+
+    scoreengine.Session.configure(bind=engine)
+    try:
+        yield
+    finally:
+        scoreengine.Session.configure(bind=scoreengine.db_engine)
+
+
+def _run_pipeline_rounds(mode: str, number_of_rounds: int, trace_memory: bool):
+    from scoreengine import runner
+
+    round_starts = []
+    round_timings = []
+    written_before = metrics.CHECKS_WRITTEN.value()
+    _, write_time_before = metrics.DB_WRITE_DURATION.totals()
+
+    original_engine = runner.runner_config['engine']
+    if mode != 'celery':
+        runner.runner_config['engine'] = mode
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        for round_number in range(1, number_of_rounds + 1):
+            round_starts.append(datetime.utcnow())
+            with _timer(round_timings):
+                runner.perform_round_checks(round_number, use_task_queue=(mode == 'celery'))
+        peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+        runner.runner_config['engine'] = original_engine
+
+    _, write_time_after = metrics.DB_WRITE_DURATION.totals()
+    return (
+        round_starts,
+        round_timings,
+        metrics.CHECKS_WRITTEN.value() - written_before,
+        write_time_after - write_time_before,
+        peak_memory,
+    )
+
+
+def pipeline(number_of_teams: int = 10, number_of_services: int = 10,
+             number_of_rounds: int = 3, modes: Iterable[str] = ('threads', 'celery'),
+             latency: float = 0.05, max_latency: Optional[float] = None,
+             failure_rate: float = 0.1, trace_memory: bool = True,
+             database_url: Optional[str] = None):
+    """Run full rounds of synthetic checks (see ``example.check_synthetic``).
+
+    Each mode performs checks the way ``scoreengine2 run`` would: ``threads``
+    and ``asyncio`` with the corresponding ``runner.engine``, and ``celery``
+    through a worker that runs in this process (with an in-memory broker).
+    The timings come from what the checks recorded (see :mod:`persistence`).
+    Tracing memory allocations slows rounds down noticeably.
+
+    :return: Rows of (mode, checks, mean round seconds, mean setup seconds,
+             checks dispatched per second, completion latency percentiles
+             (from dispatched to finished), checks written per second of
+             database writes, peak traced memory in bytes or None).
+    """
+    from scoreengine import config
+
+    if database_url is None:
+        database_file = tempfile.NamedTemporaryFile(prefix='scoreengine_bench_', suffix='.db')
+        database_url = 'sqlite:///{}'.format(database_file.name)
+    engine = create_engine(database_url)
+    concurrency = config['celery']['worker']['concurrency']
+
+    rows = []
+    try:
+        for mode in modes:
+            models.Base.metadata.drop_all(engine)
+            models.Base.metadata.create_all(engine)
+            _populate_pipeline_db(
+                engine, number_of_teams, number_of_services,
+                latency, max_latency, failure_rate)
+
+            with _bound_session(engine), ExitStack() as stack:
+                if mode == 'celery':
+                    stack.enter_context(_local_celery_worker(concurrency))
+                (round_starts, round_timings, checks_written, write_time,
+                 peak_memory) = _run_pipeline_rounds(mode, number_of_rounds, trace_memory)
+
+                with utils.session_scope() as session:
+                    checks = (session
+                        .query(
+                            models.Check.round,
+                            models.Check.queued_at,
+                            models.Check.finished_at,
+                        )
+                        .all()
+                    )
+
+            setup_timings = []
+            dispatch_timings = []
+            latencies = []
+            for round_number, round_start in enumerate(round_starts, start=1):
+                queued = [check.queued_at for check in checks if check.round == round_number]
+                setup_timings.append((min(queued) - round_start).total_seconds())
+                dispatch_timings.append((max(queued) - min(queued)).total_seconds())
+            for check in checks:
+                latencies.append((check.finished_at - check.queued_at).total_seconds())
+
+            rows.append((
+                mode,
+                len(checks),
+                statistics.mean(round_timings),
+                statistics.mean(setup_timings),
+                len(checks) / sum(dispatch_timings) if sum(dispatch_timings) else math.inf,
+                persistence._percentiles(latencies),
+                checks_written / write_time if write_time else math.inf,
+                peak_memory,
+            ))
+    finally:
+        models.Base.metadata.drop_all(engine)
+        engine.dispose()
+    return rows
+
+
+def _serve_ssh_stand_ins(number_of_targets: int, connection):
+    """Serve stand-in SSH servers (which only answer ``whoami``) until killed.
+
+    Run in a process of its own, so that the servers' share of the key
+    exchanges does not compete with the checks for the interpreter.
+    """
+    import paramiko
+
+    class StandInServer(paramiko.ServerInterface):
+        def __init__(self):
+            self.username = None
+            self.exec_requested = threading.Event()
+
+        def get_allowed_auths(self, username):
+            return 'password'
+
+        def check_auth_password(self, username, password):
+            self.username = username
+            return paramiko.AUTH_SUCCESSFUL
+
+        def check_channel_request(self, kind, chanid):
+            return paramiko.OPEN_SUCCEEDED
+
+        def check_channel_exec_request(self, channel, command):
+            self.exec_requested.set()
+            return True
+
+    def handle(sock):
+        transport = paramiko.Transport(sock)
+        transport.add_server_key(host_key)
+        server = StandInServer()
+        try:
+            transport.start_server(server=server)
+            channel = transport.accept(30)
+            if channel is not None and server.exec_requested.wait(30):
+                channel.sendall('{}\n'.format(server.username).encode())
+                channel.send_exit_status(0)
+                channel.close()
+            while transport.is_active():
+                time.sleep(0.01)
+        except (EOFError, OSError, paramiko.SSHException):
+            pass
+        finally:
+            transport.close()
+
+    def accept(listener):
+        while True:
+            sock, _ = listener.accept()
+            threading.Thread(target=handle, args=(sock,), daemon=True).start()
+
+    # Clients closing their connections are not worth reporting
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+
+    host_key = paramiko.RSAKey.generate(2048)
+    ports = []
+    for _ in range(number_of_targets):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(16)
+        ports.append(listener.getsockname()[1])
+        threading.Thread(target=accept, args=(listener,), daemon=True).start()
+    connection.send(ports)
+    threading.Event().wait()
+
+
+@contextmanager
+def _ssh_stand_ins(number_of_targets: int):
+    """Start stand-in SSH servers across processes, and yield their ports."""
+    context = multiprocessing.get_context('spawn')
+    number_of_processes = min(os.cpu_count() or 1, number_of_targets)
+    processes = []
+    ports = []
+    try:
+        for index in range(number_of_processes):
+            parent_connection, child_connection = context.Pipe()
+            process = context.Process(
+                target=_serve_ssh_stand_ins,
+                args=(len(range(index, number_of_targets, number_of_processes)), child_connection),
+                daemon=True,
+            )
+            process.start()
+            processes.append(process)
+            ports.extend(parent_connection.recv())
+        yield ports
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+def ssh_checks(number_of_targets: int = 50, number_of_rounds: int = 3,
+               concurrency: int = 20, processes: Optional[int] = None):
+    """Time rounds of SSH checks against local stand-ins, on threads and on processes.
+
+    Each round performs one check per target. With processes, the checks run
+    in a :class:`executors.ProcessPools` of ``processes`` processes (by default
+    one per CPU), the way ``runner.process_pools`` has them run; the processes
+    are started before the first round.
+
+    :return: Rows of (mode, mean round seconds, checks per second).
+    """
+    from scoreengine import executors, tasks
+
+    processes = processes or os.cpu_count() or 1
+    modes = [
+        ('threads', {}, None),
+        ('processes', {'ssh': processes}, executors.ProcessPools({'ssh': processes})),
+    ]
+
+    rows = []
+    with _ssh_stand_ins(number_of_targets) as ports:
+        def perform_round(pool_sizes, process_pools):
+            executor = executors.DeadlineExecutor(
+                max_workers=concurrency, deadline=60, pool_sizes=pool_sizes)
+            with executor:
+                futures = []
+                for team_id, port in enumerate(ports, start=1):
+                    data = utils._build_task_description(
+                        team_id, 'Team', 1, 'Bench', 'ssh', 'check_connect',
+                        [('HOST', '127.0.0.1'), ('PORT', port), ('USERPASS', 'bench||bench')],
+                    )
+                    if process_pools is None:
+                        futures.append(executor.submit(tasks._perform_check, data, pool='ssh'))
+                    else:
+                        futures.append(executor.submit(
+                            tasks.perform_check_in_process, process_pools, data, 60,
+                            pool='ssh', timed=False))
+                for future in futures:
+                    result = future.result()
+                    if not result['passed']:
+                        raise RuntimeError('\n'.join(result['output']))
+
+        for mode, pool_sizes, process_pools in modes:
+            try:
+                # Warm up (connecting to the stand-ins, and starting processes)
+                perform_round(pool_sizes, process_pools)
+
+                round_timings = []
+                for _ in range(number_of_rounds):
+                    with _timer(round_timings):
+                        perform_round(pool_sizes, process_pools)
+            finally:
+                if process_pools is not None:
+                    process_pools.shutdown()
+
+            round_time = statistics.mean(round_timings)
+            rows.append((mode, round_time, number_of_targets / round_time))
+    return rows
+
+
+class _StandInDnsServer:
+    """A stand-in DNS server, on UDP and TCP, that answers every A query with
+    ``ADDRESS``. Names starting with ``big.`` get too many records for UDP, so
+    their responses over UDP are truncated (and have to be retried over TCP).
+    """
+
+    ADDRESS = '192.0.2.1'
+
+    def __init__(self):
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_socket.bind(('127.0.0.1', 0))
+        self.port = self.udp_socket.getsockname()[1]
+        self.tcp_socket = socket.socket()
+        self.tcp_socket.bind(('127.0.0.1', self.port))
+        self.tcp_socket.listen(16)
+        threading.Thread(target=self._serve_udp, daemon=True).start()
+        threading.Thread(target=self._serve_tcp, daemon=True).start()
+
+    def close(self):
+        self.udp_socket.close()
+        self.tcp_socket.close()
+
+    def _respond(self, query, max_size: int = 65535) -> bytes:
+        import dns.exception
+        import dns.flags
+        import dns.message
+        import dns.rdata
+        import dns.rdataclass
+        import dns.rdatatype
+
+        response = dns.message.make_response(query)
+        question = query.question[0]
+        addresses = [self.ADDRESS]
+        if question.name.labels[0] == b'big':
+            addresses += ['192.0.2.{}'.format(index) for index in range(2, 100)]
+        rrset = response.find_rrset(
+            response.answer, question.name, dns.rdataclass.IN, dns.rdatatype.A, create=True)
+        for address in addresses:
+            rrset.add(dns.rdata.from_text(dns.rdataclass.IN, dns.rdatatype.A, address), 60)
+        try:
+            return response.to_wire(max_size=max_size)
+        except dns.exception.TooBig:
+            response = dns.message.make_response(query)
+            response.flags |= dns.flags.TC
+            return response.to_wire()
+
+    def _serve_udp(self):
+        import dns.message
+
+        while True:
+            try:
+                wire, address = self.udp_socket.recvfrom(65535)
+            except OSError:
+                return
+            self.udp_socket.sendto(self._respond(dns.message.from_wire(wire), 512), address)
+
+    def _serve_tcp(self):
+        import dns.query
+
+        def handle(sock):
+            with sock:
+                query, _ = dns.query.receive_tcp(sock, time.time() + 10)
+                dns.query.send_tcp(sock, self._respond(query))
+
+        while True:
+            try:
+                sock, _ = self.tcp_socket.accept()
+            except OSError:
+                return
+            threading.Thread(target=handle, args=(sock,), daemon=True).start()
+
+
+DNS_ENGINES = ('threads', 'asyncio')
+
+
+def dns_checks(number_of_targets: int = 40, number_of_rounds: int = 3,
+               concurrency: int = 20, big_share: float = 0.1):
+    """Time rounds of DNS checks against local stand-in servers, with a
+    resolver per server and with all queries multiplexed on one socket.
+
+    Each round performs one check per target, on threads (``concurrency`` at
+    once) and on an event loop. A ``big_share`` of the checks look up a name
+    whose answer is truncated over UDP. Every check is expected to pass.
+
+    :return: Rows of (engine, multiplexed, mean round seconds, checks per second).
+    """
+    import asyncio
+
+    from scoreengine.checks import dns as dns_checks_module
+    from scoreengine.tasks import CheckData
+
+    servers = [_StandInDnsServer() for _ in range(number_of_targets)]
+    descriptions = []
+    for team_id, server in enumerate(servers, start=1):
+        lookup = 'big' if random.random() < big_share else 'www'
+        descriptions.append([
+            ('HOST', '127.0.0.1'),
+            ('PORT', server.port),
+            ('LOOKUP', '{}.team{}.example'.format(lookup, team_id)),
+            ('TYPE', 'A'),
+            ('EXPECTED', _StandInDnsServer.ADDRESS),
+        ])
+
+    def build_checks():
+        return [
+            CheckData(utils._build_task_description(
+                team_id, 'Team', 1, 'Bench', 'dns', 'check_dns', data))
+            for team_id, data in enumerate(descriptions, start=1)
+        ]
+
+    def perform_round(engine: str):
+        checks = build_checks()
+        if engine == 'asyncio':
+            async def perform_checks():
+                await asyncio.gather(*(
+                    dns_checks_module.check_dns_async(check) for check in checks))
+            asyncio.run(perform_checks())
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(dns_checks_module.check_dns, checks))
+
+        for check in checks:
+            if not check.passed:
+                raise RuntimeError('\n'.join(check.export()['output']))
+
+    original_multiplex = dns_checks_module.dns_config['multiplex']
+    rows = []
+    try:
+        for engine in DNS_ENGINES:
+            for multiplex in (False, True):
+                dns_checks_module.dns_config['multiplex'] = multiplex
+                # Warm up (creating the resolvers, or the socket)
+                perform_round(engine)
+
+                round_timings = []
+                for _ in range(number_of_rounds):
+                    with _timer(round_timings):
+                        perform_round(engine)
+
+                round_time = statistics.mean(round_timings)
+                rows.append((engine, multiplex, round_time, number_of_targets / round_time))
+    finally:
+        dns_checks_module.dns_config['multiplex'] = original_multiplex
+        for server in servers:
+            server.close()
+    return rows
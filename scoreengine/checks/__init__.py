@@ -1,27 +1,72 @@
+import asyncio
 from functools import wraps
-from typing import Callable
+from typing import Callable, Optional
 
 from scoreengine import config  # as a convenience for checks
 from scoreengine.tasks import CheckData
 
 
-def check_function(expectation: str):
+def check_function(expectation: str, port: Optional[int] = None,
+                   port_configurable: bool = False):
+    """Make a check out of a function.
+
+    :param expectation: What the check expects of the service.
+    :param port: The TCP port that the check connects to, if any, so that it
+                 can be probed beforehand.
+    :param port_configurable: Whether the check connects to the ``PORT`` of
+                              its config instead, when it has one.
+    """
     def decorator(actual_check_function: Callable):
+        if asyncio.iscoroutinefunction(actual_check_function):
+            @wraps(actual_check_function)
+            async def async_wrapper(check: CheckData):
+                _start_check(check, expectation)
+
+                try:
+                    result = await actual_check_function(check)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    _fail_check(check, e)
+                else:
+                    check.passed = bool(result)
+                _finish_check(check)
+            async_wrapper.check_expectation = expectation
+            async_wrapper.check_port = port
+            async_wrapper.check_port_configurable = port_configurable
+            return async_wrapper
+
         @wraps(actual_check_function)
         def wrapper(check: CheckData):
-            check.add_output('ScoreEngine: {} Check', check.service_name)
-            check.add_output('EXPECTED: {}', expectation)
-            check.add_output('OUTPUT:')
+            _start_check(check, expectation)
 
             # TODO: verify if this is the desired behavior
             try:
                 result = actual_check_function(check)
             except Exception as e:
-                check.passed = False
-                check.add_output("ERROR: {}: {}", type(e).__name__, e)
+                _fail_check(check, e)
             else:
                 check.passed = bool(result)
-            if check.passed:
-                check.add_output('Check successful!')
+            _finish_check(check)
+        wrapper.check_expectation = expectation
+        wrapper.check_port = port
+        wrapper.check_port_configurable = port_configurable
         return wrapper
     return decorator
+
+
+def _start_check(check: CheckData, expectation: str):
+    check.add_output('ScoreEngine: {} Check', check.service_name)
+    check.add_output('EXPECTED: {}', expectation)
+    check.add_output('OUTPUT:')
+
+
+def _fail_check(check: CheckData, exception: Exception):
+    check.passed = False
+    check.add_output("ERROR: {}: {}", type(exception).__name__, exception)
+
+
+def _finish_check(check: CheckData):
+    check.end_phase()
+    if check.passed:
+        check.add_output('Check successful!')
@@ -1,5 +1,10 @@
 import pymysql
 
+try:
+    import aiomysql
+except ImportError:  # the asyncio engine falls back to the pymysql checks
+    aiomysql = None
+
 from . import config, check_function
 
 
@@ -17,7 +22,8 @@ if 'database' in config['checks']:
 # /CONFIG
 
 
-@check_function('Login and query against a Wordpress database')
+@check_function('Login and query against a Wordpress database', port=3306,
+                port_configurable=True)
 def check_wordpress_mysql(check):
     # Connect to the db
     check.add_output('Connecting to {HOST}:{PORT}', **check.config)
@@ -51,7 +57,8 @@ def check_wordpress_mysql(check):
     return True
 
 
-@check_function('Successful login on the MySQL Database')
+@check_function('Successful login on the MySQL Database', port=3306,
+                port_configurable=True)
 def check_query_mysql(check):
     # Connect to the db
     check.add_output('Connecting to {HOST}:{PORT}', **check.config)
@@ -82,3 +89,41 @@ def check_query_mysql(check):
 
     # We're done
     return True
+
+
+if aiomysql is not None:
+    @check_function('Successful login on the MySQL Database', port=3306,
+                    port_configurable=True)
+    async def check_query_mysql_async(check):
+        # Connect to the db
+        check.add_output('Connecting to {HOST}:{PORT}', **check.config)
+        db = await aiomysql.connect(
+            host=check.config['HOST'],
+            port=int(check.config['PORT']),
+            user=check.config['USER'],
+            password=check.config['PASS'],
+            db=check.config['DB_LOOKUP'],
+            connect_timeout=mysql_config['timeout'])
+        check.add_output('Connected!')
+
+        try:
+            cur = await db.cursor()
+
+            # Attempt a show tables
+            check.add_output('Attempting to describe all tables...')
+            await cur.execute('SHOW tables;')
+        finally:
+            db.close()
+
+        # Verify tables
+        if cur.rowcount < mysql_config['min_tables_count']:
+            check.add_output('ERROR: The table count returned is incorrect.')
+            return False
+
+        if mysql_config['max_tables_count'] > 0:
+            if cur.rowcount > mysql_config['max_tables_count']:
+                check.add_output('ERROR: The table count returned is incorrect.')
+                return False
+
+        # We're done
+        return True
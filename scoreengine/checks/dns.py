@@ -1,4 +1,27 @@
-from dns.resolver import Resolver
+import asyncio
+import concurrent.futures
+import functools
+import ipaddress
+import os
+import socket
+import threading
+import time
+
+import dns.entropy
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.query
+import dns.rcode
+import dns.rdatatype
+from dns.resolver import NXDOMAIN, Answer, NoAnswer, NoNameservers, Resolver
+
+try:
+    import dns.asyncquery
+    from dns.asyncresolver import Resolver as AsyncResolver
+except ImportError:  # dnspython < 2.0; the asyncio engine falls back to check_dns
+    AsyncResolver = None
 
 from . import config, check_function
 
@@ -7,6 +30,8 @@ from . import config, check_function
 dns_config = {
     'timeout': 15,
     'lifetime': 15,
+
+    'multiplex': False,
 }
 # /DEFAULTS
 
@@ -15,29 +40,249 @@ if 'dns' in config['checks']:
     dns_config.update(config['checks']['dns'])
 # /CONFIG
 
+DEFAULT_PORT = 53
+
 
 @check_function('Successful and correct query against the DNS server')
 def check_dns(check):
-    # Setup the resolver
-    resolver = Resolver()
-    resolver.nameservers = [check.config['HOST']]
-    resolver.timeout = dns_config['timeout']
-    resolver.lifetime = dns_config['lifetime']
-    
     # Query resolver
     check.add_output('Querying {HOST} for "{LOOKUP}"...', **check.config)
-    lookup = resolver.query(check.config['LOOKUP'], check.config['TYPE'])
+    if dns_config['multiplex']:
+        request, nameserver, port = _make_request(check)
+        lookup = _get_answer(
+            request, _get_multiplexer().query(request, nameserver, port), nameserver, port)
+    else:
+        resolver = _get_resolver(check.config['HOST'], _get_port(check))
+        lookup = resolver.query(check.config['LOOKUP'], check.config['TYPE'])
+
+    return _verify_lookup(check, lookup)
+
+
+if AsyncResolver is not None:
+    @check_function('Successful and correct query against the DNS server')
+    async def check_dns_async(check):
+        # Query resolver
+        check.add_output('Querying {HOST} for "{LOOKUP}"...', **check.config)
+        if dns_config['multiplex']:
+            request, nameserver, port = _make_request(check)
+            response = await _get_multiplexer().query_async(request, nameserver, port)
+            lookup = _get_answer(request, response, nameserver, port)
+        else:
+            resolver = _get_async_resolver(check.config['HOST'], _get_port(check))
+            lookup = await resolver.resolve(check.config['LOOKUP'], check.config['TYPE'])
+
+        return _verify_lookup(check, lookup)
+
 
+    @functools.lru_cache(maxsize=None)
+    def _get_async_resolver(nameserver: str, port: int) -> AsyncResolver:
+        resolver = AsyncResolver(configure=False)
+        _configure_resolver(resolver, nameserver, port)
+        return resolver
+
+
+def _verify_lookup(check, lookup):
     found = False
     for ans in lookup:
         if str(ans) == check.config['EXPECTED']:
             found = True
         else:
-            check.addOutput('NOTICE: DNS Server returned {}', ans)
+            check.add_output('NOTICE: DNS Server returned {}', ans)
 
     if not found:
-        check.addOutput('ERROR: DNS Server did not respond with the correct IP')
+        check.add_output('ERROR: DNS Server did not respond with the correct IP')
         return False
 
     # We're good!
     return True
+
+
+def _get_port(check) -> int:
+    return int(check.config.get('PORT', DEFAULT_PORT))
+
+
+@functools.lru_cache(maxsize=None)
+def _get_resolver(nameserver: str, port: int) -> Resolver:
+    """Get a resolver that only queries ``nameserver``.
+
+    Resolvers are kept across checks, as creating one reads ``/etc/resolv.conf``
+    (which is not needed: the resolver is told its nameserver).
+    """
+    resolver = Resolver(configure=False)
+    _configure_resolver(resolver, nameserver, port)
+    return resolver
+
+
+def _configure_resolver(resolver, nameserver: str, port: int):
+    resolver.nameservers = [nameserver]
+    resolver.port = port
+    resolver.timeout = dns_config['timeout']
+    resolver.lifetime = dns_config['lifetime']
+
+
+def _make_request(check):
+    request = dns.message.make_query(
+        dns.name.from_text(check.config['LOOKUP']),
+        dns.rdatatype.from_text(check.config['TYPE']),
+    )
+    return request, check.config['HOST'], _get_port(check)
+
+
+def _get_answer(request, response, nameserver: str, port: int) -> Answer:
+    """Make an answer out of a response, or raise what a resolver would."""
+    question = request.question[0]
+    rcode = response.rcode()
+    if rcode == dns.rcode.NXDOMAIN:
+        raise NXDOMAIN(qnames=[question.name], responses={question.name: response})
+    if rcode != dns.rcode.NOERROR:
+        raise NoNameservers(
+            request=request,
+            errors=[(nameserver, False, port, dns.rcode.to_text(rcode), response)],
+        )
+
+    answer = Answer(question.name, question.rdtype, question.rdclass, response)
+    if answer.rrset is None:
+        raise NoAnswer(response=response)
+    return answer
+
+
+class QueryMultiplexer:
+    """Send the DNS queries of every check from a single UDP socket.
+
+    A resolver sends each query from a socket of its own. Instead, queries (to
+    any server) are all sent from one socket per address family, and a thread
+    receives every response and matches it to its query by the server's
+    address and port and the query ID. Queries are sent again every
+    ``timeout`` seconds until ``lifetime`` seconds have passed, and retried
+    over TCP when the response is truncated.
+    """
+
+    def __init__(self):
+        self._pid = os.getpid()
+        self._sockets = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def query(self, request, nameserver: str, port: int = DEFAULT_PORT):
+        """Send a query, and wait for the response."""
+        deadline = time.monotonic() + dns_config['lifetime']
+        while True:
+            key, future = self._send(request, nameserver, port)
+            remaining = deadline - time.monotonic()
+            try:
+                response = future.result(min(dns_config['timeout'], max(remaining, 0)))
+            except concurrent.futures.TimeoutError:
+                self._forget(key, future)
+                if time.monotonic() >= deadline:
+                    raise dns.exception.Timeout(timeout=dns_config['lifetime'])
+                continue
+
+            if response.flags & dns.flags.TC:
+                response = dns.query.tcp(
+                    request, nameserver,
+                    timeout=max(deadline - time.monotonic(), 0),
+                    port=port,
+                )
+            return response
+
+    async def query_async(self, request, nameserver: str, port: int = DEFAULT_PORT):
+        """Like :meth:`query`, on an event loop."""
+        deadline = time.monotonic() + dns_config['lifetime']
+        while True:
+            key, future = self._send(request, nameserver, port)
+            remaining = deadline - time.monotonic()
+            try:
+                response = await asyncio.wait_for(
+                    asyncio.wrap_future(future),
+                    min(dns_config['timeout'], max(remaining, 0)),
+                )
+            except asyncio.TimeoutError:
+                self._forget(key, future)
+                if time.monotonic() >= deadline:
+                    raise dns.exception.Timeout(timeout=dns_config['lifetime'])
+                continue
+
+            if response.flags & dns.flags.TC:
+                response = await dns.asyncquery.tcp(
+                    request, nameserver,
+                    timeout=max(deadline - time.monotonic(), 0),
+                    port=port,
+                )
+            return response
+
+    def _send(self, request, nameserver: str, port: int):
+        address = ipaddress.ip_address(nameserver)
+        future = concurrent.futures.Future()
+        with self._lock:
+            sock = self._get_socket(address.version)
+            # Query IDs only need to be unique per server
+            key = str(address), port, request.id
+            while key in self._pending:
+                request.id = dns.entropy.random_16()
+                key = str(address), port, request.id
+            self._pending[key] = request, future
+        try:
+            sock.sendto(request.to_wire(), (str(address), port))
+        except OSError as e:
+            self._forget(key, future)
+            future.set_exception(e)
+        return key, future
+
+    def _forget(self, key, future):
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None and pending[1] is future:
+                del self._pending[key]
+
+    def _get_socket(self, version: int) -> socket.socket:
+        if os.getpid() != self._pid:
+            # This process was forked, without the threads that receive responses
+            self._pid = os.getpid()
+            self._sockets = {}
+            self._pending = {}
+
+        sock = self._sockets.get(version)
+        if sock is None:
+            sock = socket.socket(
+                socket.AF_INET6 if version == 6 else socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+            except OSError:
+                pass
+            sock.bind(('::' if version == 6 else '0.0.0.0', 0))
+            threading.Thread(target=self._receive, args=(sock,), daemon=True).start()
+            self._sockets[version] = sock
+        return sock
+
+    def _receive(self, sock: socket.socket):
+        while True:
+            try:
+                wire, address = sock.recvfrom(65535)
+            except OSError:
+                return
+            if len(wire) < 2:
+                continue
+
+            key = address[0], address[1], int.from_bytes(wire[:2], 'big')
+            with self._lock:
+                pending = self._pending.get(key)
+            if pending is None:
+                continue
+            request, future = pending
+
+            try:
+                response = dns.message.from_wire(wire, ignore_trailing=True)
+            except dns.exception.DNSException:
+                # Not a response to the query, or a malformed one: wait for another
+                continue
+            if not request.is_response(response):
+                continue
+
+            self._forget(key, future)
+            if future.set_running_or_notify_cancel():
+                future.set_result(response)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_multiplexer() -> QueryMultiplexer:
+    return QueryMultiplexer()
@@ -1,6 +1,35 @@
+import asyncio
+import random
+import time
+
 from . import check_function
 
 
 @check_function('Example check that always passes')
 def check_example(check):
     return True
+
+
+def _synthetic_latency(check) -> float:
+    latency = float(check.config.get('LATENCY', 0))
+    if 'MAX_LATENCY' in check.config:
+        latency = random.uniform(latency, float(check.config['MAX_LATENCY']))
+    return latency
+
+
+def _synthetic_result(check) -> bool:
+    return random.random() >= float(check.config.get('FAILURE_RATE', 0))
+
+
+@check_function('Synthetic check (for benchmarks)')
+def check_synthetic(check):
+    """Wait ``LATENCY`` seconds (or between that and ``MAX_LATENCY``), then
+    fail at random ``FAILURE_RATE`` of the time."""
+    time.sleep(_synthetic_latency(check))
+    return _synthetic_result(check)
+
+
+@check_function('Synthetic check (for benchmarks)')
+async def check_synthetic_async(check):
+    await asyncio.sleep(_synthetic_latency(check))
+    return _synthetic_result(check)
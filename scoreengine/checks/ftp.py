@@ -1,7 +1,9 @@
+import asyncio
 import binascii
 import ftplib
 import os
 import random
+import string
 import tempfile
 
 from . import config, check_function
@@ -21,17 +23,21 @@ if 'ftp' in config['checks']:
 # /CONFIG
 
 
-@check_function('Successful connect, upload, and deletion of a file')
+@check_function('Successful connect, upload, and deletion of a file', port=21)
 def check_upload_download(check):
     check.add_output('Connecting to {HOST}...', **check.config)
+    check.start_phase('connect')
     with ftplib.FTP(check.config['HOST'], timeout=ftp_config['timeout']) as ftp:
         check.add_output('Connected!')
 
         # Log in
         check.add_output('Attempting to log in as {USER}', **check.config)
+        check.start_phase('auth')
         ftp.login(check.config['USER'], check.config['PASS'])
         check.add_output('Authentication successful!')
 
+        check.start_phase('verify')
+
         # Create a temporary file with random data for uploading
         check_file = tempfile.NamedTemporaryFile(prefix=ftp_config['prefix'])
         number_of_bytes = random.randint(1000, 9000)
@@ -66,3 +72,177 @@ def check_upload_download(check):
         check.add_output("Deleted!")
 
     return True
+
+
+@check_function('Successful connect, upload, and deletion of a file', port=21)
+async def check_upload_download_async(check):
+    check.add_output('Connecting to {HOST}...', **check.config)
+    ftp = _AsyncFTP(timeout=ftp_config['timeout'])
+    check.start_phase('connect')
+    await ftp.connect(check.config['HOST'])
+    try:
+        check.add_output('Connected!')
+
+        # Log in
+        check.add_output('Attempting to log in as {USER}', **check.config)
+        check.start_phase('auth')
+        await ftp.login(check.config['USER'], check.config['PASS'])
+        check.add_output('Authentication successful!')
+
+        check.start_phase('verify')
+
+        # Random data for uploading, named like the temporary file of check_upload_download
+        number_of_bytes = random.randint(1000, 9000)
+        binary_data = os.urandom(number_of_bytes)
+        ascii_data = binascii.hexlify(binary_data)  # twice the size of binary_data
+        check_file_name = ftp_config['directory'] + ftp_config['prefix'] + ''.join(
+            random.choices(string.ascii_lowercase + string.digits + '_', k=8))
+        check_file_size = len(ascii_data)
+
+        # Attempt to upload the file
+        await ftp.cwd(ftp_config['directory'])
+        check.add_output('Uploading file {} with {} bytes...', check_file_name, check_file_size)
+        await ftp.storbinary('STOR ' + check_file_name, ascii_data)
+        check.add_output('Uploaded!')
+
+        # Validate the uploaded file
+        check.add_output("Getting size of {}....".format(check_file_name))
+        actual_file_size = await ftp.size(check_file_name)
+        if actual_file_size != check_file_size:
+            check.add_output(
+                'File size is {}, not the same as source ({})! Failure!',
+                actual_file_size,
+                check_file_size,
+            )
+            return False
+        check.add_output('File size check passed!')
+
+        # Delete the uploaded file
+        check.add_output("Deleting file {}...".format(check_file_name))
+        await ftp.delete(check_file_name)
+        check.add_output("Deleted!")
+    finally:
+        await ftp.quit()
+
+    return True
+
+
+class _AsyncFTP:
+    """Just enough of :class:`ftplib.FTP` (in passive mode) for the asyncio engine.
+
+    Replies are handled (and errors raised) the same way as by ftplib.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.encoding = ftplib.FTP().encoding  # varies with the Python version
+        self._reader = self._writer = None
+        self._host = None
+
+    async def connect(self, host, port=21):
+        self._reader, self._writer = await self._wait(asyncio.open_connection(host, port))
+        self._host = self._writer.get_extra_info('peername')[0]
+        return await self.getresp()
+
+    async def login(self, user, passwd):
+        resp = await self.sendcmd('USER ' + user)
+        if resp[0] == '3':
+            resp = await self.sendcmd('PASS ' + passwd)
+        if resp[0] == '3':
+            resp = await self.sendcmd('ACCT ')
+        if resp[0] != '2':
+            raise ftplib.error_reply(resp)
+        return resp
+
+    async def cwd(self, dirname):
+        return await self.voidcmd('CWD ' + (dirname or '.'))
+
+    async def storbinary(self, cmd, data: bytes):
+        await self.voidcmd('TYPE I')
+
+        resp = await self.sendcmd('PASV')
+        if resp[:3] != '227':
+            raise ftplib.error_reply(resp)
+        # Like ftplib, ignore the host in the reply and use the control connection's
+        _, port = ftplib.parse227(resp)
+        _, data_writer = await self._wait(asyncio.open_connection(self._host, port))
+
+        try:
+            resp = await self.sendcmd(cmd)
+            if resp[0] == '2':
+                resp = await self.getresp()
+            if resp[0] != '1':
+                raise ftplib.error_reply(resp)
+
+            data_writer.write(data)
+            await self._wait(data_writer.drain())
+        finally:
+            data_writer.close()
+
+        return await self.voidresp()
+
+    async def size(self, filename):
+        resp = await self.sendcmd('SIZE ' + filename)
+        if resp[:3] == '213':
+            return int(resp[3:].strip())
+
+    async def delete(self, filename):
+        resp = await self.sendcmd('DELE ' + filename)
+        if resp[:3] in {'250', '200'}:
+            return resp
+        raise ftplib.error_reply(resp)
+
+    async def quit(self):
+        try:
+            await self.voidcmd('QUIT')
+        except (OSError, EOFError, asyncio.TimeoutError, ftplib.Error):
+            pass
+        finally:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    async def sendcmd(self, cmd):
+        self._writer.write((cmd + '\r\n').encode(self.encoding))
+        await self._wait(self._writer.drain())
+        return await self.getresp()
+
+    async def voidcmd(self, cmd):
+        resp = await self.sendcmd(cmd)
+        if resp[:1] != '2':
+            raise ftplib.error_reply(resp)
+        return resp
+
+    async def voidresp(self):
+        resp = await self.getresp()
+        if resp[:1] != '2':
+            raise ftplib.error_reply(resp)
+        return resp
+
+    async def getresp(self):
+        resp = await self._getline()
+        if resp[3:4] == '-':
+            # Multi-line reply, which ends with the same code (and a space)
+            code = resp[:3]
+            while True:
+                line = await self._getline()
+                resp += '\n' + line
+                if line[:3] == code and line[3:4] != '-':
+                    break
+
+        if resp[:1] in {'1', '2', '3'}:
+            return resp
+        if resp[:1] == '4':
+            raise ftplib.error_temp(resp)
+        if resp[:1] == '5':
+            raise ftplib.error_perm(resp)
+        raise ftplib.error_proto(resp)
+
+    async def _getline(self):
+        line = await self._wait(self._reader.readline())
+        if not line:
+            raise EOFError
+        return line.decode(self.encoding).rstrip('\r\n')
+
+    async def _wait(self, awaitable):
+        return await asyncio.wait_for(awaitable, self.timeout)
@@ -1,9 +1,15 @@
 # TODO: test check_wordpress
 
+import functools
 import re
 
-from fake_useragent import UserAgent
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp
+except ImportError:  # the asyncio engine falls back to check_http
+    aiohttp = None
 
 from . import config, check_function
 
@@ -12,6 +18,10 @@ from . import config, check_function
 http_config = {
     'timeout': 15,
 
+    'connection_pooling': False,
+    'pool_targets': 256,
+    'pool_connections_per_target': 4,
+
     'wordpress_login': 'wp-login.php',
     'wordpress_cookie': 'wordpress_logged_in_',
 
@@ -23,23 +33,54 @@ http_config = {
 # CONFIG
 if 'http' in config['checks']:
     http_config.update(config['checks']['http'])
+# /CONFIG
 
-FAKE_UA = UserAgent(fallback='Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)')
 
-http_headers = {
-    'Connection': 'close',
-    'User-Agent': FAKE_UA.random,
-}
-# /CONFIG
+@functools.lru_cache(maxsize=None)
+def _get_http_headers():
+    # fake_useragent may have to fetch its data, so only when a check needs it
+    from fake_useragent import UserAgent
+
+    fake_ua = UserAgent(fallback='Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)')
+    headers = {
+        'User-Agent': fake_ua.random,
+    }
+    if not http_config['connection_pooling']:
+        headers['Connection'] = 'close'
+    return headers
+
+
+@functools.lru_cache(maxsize=None)
+def _get_pooled_adapter():
+    # Keeps a pool of keep-alive connections for each target (scheme, host and port)
+    return HTTPAdapter(
+        pool_connections=http_config['pool_targets'],
+        pool_maxsize=http_config['pool_connections_per_target'],
+    )
+
 
+def _new_session():
+    """Get a session for a check.
 
-@check_function('Website is online')
+    Every check gets its own session, so that cookies are never shared between
+    checks. With connection pooling, sessions share the connections of a
+    process-wide adapter (so they must not be closed).
+    """
+    session = requests.Session()
+    if http_config['connection_pooling']:
+        adapter = _get_pooled_adapter()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+    return session
+
+
+@check_function('Website is online', port=80, port_configurable=True)
 def check_http(check):
     # Connect to the website
     check.add_output('Connecting to http://{HOST}:{PORT}', **check.config)
-    session = requests.Session()
+    session = _new_session()
     req = session.get('http://{HOST}:{PORT}'.format(**check.config),
-                      timeout=http_config['timeout'], headers=http_headers)
+                      timeout=http_config['timeout'], headers=_get_http_headers())
 
     if req.status_code != 200:
         check.add_output('ERROR: Page returned status code {}', req.status_code)
@@ -48,13 +89,30 @@ def check_http(check):
     return True
 
 
-@check_function('Ability to use the Wordpress website')
+if aiohttp is not None:
+    @check_function('Website is online', port=80, port_configurable=True)
+    async def check_http_async(check):
+        # Connect to the website
+        check.add_output('Connecting to http://{HOST}:{PORT}', **check.config)
+        timeout = aiohttp.ClientTimeout(total=http_config['timeout'])
+        async with aiohttp.ClientSession(timeout=timeout, headers=_get_http_headers()) as session:
+            async with session.get('http://{HOST}:{PORT}'.format(**check.config)) as req:
+                status_code = req.status
+
+        if status_code != 200:
+            check.add_output('ERROR: Page returned status code {}', status_code)
+            return False
+
+        return True
+
+
+@check_function('Ability to use the Wordpress website', port=80, port_configurable=True)
 def check_wordpress(check):
     # Connect to the website
     check.add_output('Connecting to http://{HOST}:{PORT}', **check.config)
-    session = requests.Session()
+    session = _new_session()
     req = session.get('http://{HOST}:{PORT}'.format(**check.config),
-                      timeout=http_config['timeout'], headers=http_headers)
+                      timeout=http_config['timeout'], headers=_get_http_headers())
 
     if req.status_code != 200:
         check.add_output('ERROR: Page returned status code {}', req.status_code)
@@ -71,7 +129,7 @@ def check_wordpress(check):
     }
 
     check.add_output('Loading login page')
-    req = session.get(login_url, timeout=http_config['timeout'], headers=http_headers)
+    req = session.get(login_url, timeout=http_config['timeout'], headers=_get_http_headers())
 
     if req.status_code != 200:
         check.add_output('ERROR: Page returned status code {}', req.status_code)
@@ -81,7 +139,7 @@ def check_wordpress(check):
 
     # Attempt to login
     check.add_output('Attempting to login')
-    req = session.post(login_url, data=login_payload, timeout=http_config['timeout'], headers=http_headers)
+    req = session.post(login_url, data=login_payload, timeout=http_config['timeout'], headers=_get_http_headers())
 
     if req.status_code != 200:
         check.add_output('ERROR: Page returned status code {}', req.status_code)
@@ -103,13 +161,13 @@ def check_wordpress(check):
     return True
 
 
-@check_function('Ability to use the gitlab website')
+@check_function('Ability to use the gitlab website', port=80, port_configurable=True)
 def check_gitlab(check):
     # Connect to the website
     check.add_output('Connecting to http://{HOST}:{PORT}', **check.config)
-    session = requests.Session()
+    session = _new_session()
     req = session.get('http://{HOST}:{PORT}'.format(**check.config),
-                      timeout=http_config['timeout'], headers=http_headers)
+                      timeout=http_config['timeout'], headers=_get_http_headers())
 
     if req.status_code != 200:
         check.add_output('ERROR: Page returned status code {}', req.status_code)
@@ -121,7 +179,7 @@ def check_gitlab(check):
     check.add_output('Loading login page')
     login_url = 'http://{HOST}:{PORT}/{login}'.format(
         login=http_config['gitlab_login'], **check.config)
-    req = session.get(login_url, timeout=http_config['timeout'], headers=http_headers)
+    req = session.get(login_url, timeout=http_config['timeout'], headers=_get_http_headers())
     matches = re.search('name="authenticity_token" value="([^"]+)"', req.content.decode())
 
     if not matches:
@@ -136,7 +194,7 @@ def check_gitlab(check):
     # }
 
     check.add_output('Attempting login')
-    req = session.get(login_url, timeout=http_config['timeout'], headers=http_headers)
+    req = session.get(login_url, timeout=http_config['timeout'], headers=_get_http_headers())
 
     if req.status_code != 200:
         check.add_output('ERROR: Page returned status code {}', req.status_code)
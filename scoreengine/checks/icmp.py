@@ -1,12 +1,24 @@
+import itertools
+import logging
+import os
+import random
+import socket
+import struct
 import subprocess
+import threading
+import time
+from typing import Iterable
 
 from . import config, check_function
 
 
+logger = logging.getLogger(__name__)
+
 # DEFAULTS
 icmp_config = {
     'timeout': 10,
     'command': 'ping',
+    'method': 'socket',
 }
 # /DEFAULTS
 
@@ -15,9 +27,54 @@ if 'icmp' in config['checks']:
     icmp_config.update(config['checks']['icmp'])
 # /CONFIG
 
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+PAYLOAD_SIZE = 56  # same as ping
+
 
 @check_function('1 packet received')
 def check_icmp(check):
+    prober = _get_prober() if icmp_config['method'] == 'socket' else None
+    if prober is None:
+        return _check_icmp_subprocess(check)
+
+    host = str(check.config['HOST'])
+    address = socket.gethostbyname(host)
+    try:
+        reply = prober.ping(address, icmp_config['timeout'])
+    except PermissionError as e:
+        # Such as when a firewall or a security policy forbids sending
+        _disable_prober(e)
+        return _check_icmp_subprocess(check)
+
+    check.add_output(_format_ping_output(host, address, reply))
+
+    return reply is not None
+
+
+def prepare_checks(task_descriptions):
+    """Send the echo requests of a round's checks all at once, so that each
+    check only waits for its reply (see :meth:`IcmpProber.send_all`)."""
+    if icmp_config['method'] != 'socket':
+        return
+    prober = _get_prober()
+    if prober is None:
+        return
+
+    addresses = set()
+    for data in task_descriptions:
+        try:
+            addresses.add(socket.gethostbyname(str(data['config']['HOST'])))
+        except (KeyError, OSError):
+            # Reported by the check
+            continue
+    try:
+        prober.send_all(addresses)
+    except PermissionError as e:
+        _disable_prober(e)
+
+
+def _check_icmp_subprocess(check):
     command = [
         icmp_config['command'],
         '-c', '1',
@@ -31,3 +88,205 @@ def check_icmp(check):
     check.add_output(output)
 
     return proc.returncode == 0
+
+
+def _format_ping_output(host, address, reply):
+    """Summarize an echo request and its reply (if any) like ping does."""
+    lines = ['PING {} ({}) {}({}) bytes of data.'.format(
+        host, address, PAYLOAD_SIZE, PAYLOAD_SIZE + 28)]
+    if reply is not None:
+        lines.append('{} bytes from {}: icmp_seq=1{} time={:.3f} ms'.format(
+            PAYLOAD_SIZE + 8,
+            address,
+            '' if reply.ttl is None else ' ttl={}'.format(reply.ttl),
+            reply.round_trip_time * 1000,
+        ))
+    lines.append('')
+    lines.append('--- {} ping statistics ---'.format(host))
+    lines.append('1 packets transmitted, {} received, {}% packet loss'.format(
+        0 if reply is None else 1,
+        100 if reply is None else 0,
+    ))
+    return '\n'.join(lines)
+
+
+_prober = None
+_prober_lock = threading.Lock()
+_prober_unavailable = False
+
+
+def _get_prober():
+    """Get the process-wide prober, or None when ICMP sockets cannot be opened."""
+    global _prober, _prober_unavailable
+
+    with _prober_lock:
+        if _prober_unavailable:
+            return None
+        if _prober is None or _prober.broken:
+            try:
+                _prober = IcmpProber()
+            except OSError as e:
+                logger.warning('Falling back to %r for ICMP checks: %s', icmp_config['command'], e)
+                _prober_unavailable = True
+                return None
+        return _prober
+
+
+def _disable_prober(error: OSError):
+    global _prober_unavailable
+
+    with _prober_lock:
+        if not _prober_unavailable:
+            logger.warning('Falling back to %r for ICMP checks: %s', icmp_config['command'], error)
+            _prober_unavailable = True
+
+
+class _EchoReply:
+    def __init__(self, address: str, sequence_number: int):
+        self.address = address
+        self.sequence_number = sequence_number
+        self.received = threading.Event()
+        self.sent_at = None
+        self.round_trip_time = None
+        self.ttl = None
+
+
+class IcmpProber:
+    """Send ICMP echo requests from one socket and match replies by sequence.
+
+    All ICMP checks in a process share the prober, so that no ping process is
+    forked per check. The echo requests of a round are sent all at once by
+    :meth:`send_all`, before its checks start, and each check then waits for
+    the reply to its request with :meth:`ping`. An unprivileged datagram ICMP
+    socket is preferred (see the Linux ``net.ipv4.ping_group_range`` sysctl),
+    with a raw socket as a fallback.
+    """
+
+    def __init__(self):
+        try:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            self._is_raw = False
+        except OSError:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+            self._is_raw = True
+
+        # The kernel replaces the identifier of datagram ICMP sockets with their
+        # port, and only delivers replies to them that have a matching one
+        self._identifier = random.getrandbits(16)
+        self._sequence_numbers = itertools.cycle(range(1, 0x10000))
+        self._pending = {}
+        self._sent = {}  # by address, for ping to wait for
+        self._lock = threading.Lock()
+        self.broken = False
+
+        receiver = threading.Thread(target=self._receive, daemon=True)
+        receiver.start()
+
+    def send_all(self, addresses: Iterable[str]):
+        """Send an echo request to each address, for :meth:`ping` to wait for."""
+        for address in addresses:
+            try:
+                reply = self._send(address)
+            except PermissionError:
+                raise
+            except OSError:
+                # Such as an unreachable network: the check reports it
+                continue
+            with self._lock:
+                previous = self._sent.pop(address, None)
+                self._sent[address] = reply
+            if previous is not None:
+                self._forget(previous)
+
+    def ping(self, address: str, timeout: float):
+        """Wait for the reply to an echo request to the address, sending one
+        unless :meth:`send_all` sent one less than ``timeout`` seconds ago.
+
+        :return: The reply, or None if there was none within the timeout.
+        """
+        with self._lock:
+            reply = self._sent.pop(address, None)
+        if reply is not None and time.perf_counter() - reply.sent_at >= timeout:
+            self._forget(reply)
+            reply = None
+        if reply is None:
+            reply = self._send(address)
+
+        try:
+            if not reply.received.wait(max(reply.sent_at + timeout - time.perf_counter(), 0)):
+                return None
+            return reply
+        finally:
+            self._forget(reply)
+
+    def _send(self, address: str) -> _EchoReply:
+        with self._lock:
+            sequence_number = next(self._sequence_numbers)
+            while sequence_number in self._pending:
+                sequence_number = next(self._sequence_numbers)
+            reply = _EchoReply(address, sequence_number)
+            self._pending[sequence_number] = reply
+
+        try:
+            packet = _echo_request(self._identifier, sequence_number, os.urandom(PAYLOAD_SIZE))
+            reply.sent_at = time.perf_counter()
+            self._socket.sendto(packet, (address, 0))
+        except OSError:
+            self._forget(reply)
+            raise
+        return reply
+
+    def _forget(self, reply: _EchoReply):
+        with self._lock:
+            if self._pending.get(reply.sequence_number) is reply:
+                del self._pending[reply.sequence_number]
+
+    def _receive(self):
+        while True:
+            try:
+                packet, (address, _) = self._socket.recvfrom(65535)
+            except OSError:
+                logger.exception('Unable to receive ICMP replies')
+                self.broken = True
+                return
+            received_at = time.perf_counter()
+
+            ttl = None
+            if self._is_raw:
+                # Raw sockets receive the IP header as well
+                header_length = (packet[0] & 0x0F) * 4
+                ttl = packet[8]
+                packet = packet[header_length:]
+
+            if len(packet) < 8:
+                continue
+            icmp_type, _, _, identifier, sequence_number = struct.unpack('!BBHHH', packet[:8])
+            if icmp_type != ICMP_ECHO_REPLY:
+                continue
+            if self._is_raw and identifier != self._identifier:
+                continue
+
+            with self._lock:
+                reply = self._pending.get(sequence_number)
+            if reply is None or reply.address != address or reply.received.is_set():
+                continue
+
+            reply.round_trip_time = received_at - reply.sent_at
+            reply.ttl = ttl
+            reply.received.set()
+
+
+def _echo_request(identifier: int, sequence_number: int, payload: bytes) -> bytes:
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, identifier, sequence_number)
+    checksum = _checksum(header + payload)
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, checksum, identifier, sequence_number)
+    return header + payload
+
+
+def _checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack('!{}H'.format(len(data) // 2), data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
@@ -1,5 +1,7 @@
+import asyncio
 import imaplib
 import socket
+import ssl
 
 from . import config, check_function
 
@@ -18,7 +20,8 @@ socket.setdefaulttimeout(imap_config['timeout'])
 # /CONFIG
 
 
-@check_function('Successful authentication against the email server')
+@check_function('Successful authentication against the email server', port=143,
+                port_configurable=True)
 def check_imap_login(check):
     check.add_output('Starting check...')
 
@@ -38,3 +41,59 @@ def check_imap_login(check):
     check.add_output('Logged in!')
 
     return True
+
+
+@check_function('Successful authentication against the email server', port=143,
+                port_configurable=True)
+async def check_imap_login_async(check):
+    check.add_output('Starting check...')
+
+    host = check.config['HOST']
+    port = int(check.config['PORT'])
+
+    check.add_output('Connecting to {host}:{port}...', host=host, port=port)
+
+    # Same choice (and certificate handling) as imaplib.IMAP4_SSL/IMAP4
+    ssl_context = ssl._create_stdlib_context() if port == 993 else None
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(host, port, ssl=ssl_context),
+        imap_config['timeout'],
+    )
+
+    try:
+        greeting = await _read_imap_line(reader)
+        if not greeting.startswith((b'* OK', b'* PREAUTH')):
+            raise imaplib.IMAP4.error(greeting.decode(errors='replace').rstrip())
+
+        check.add_output('Logging in as {USER}', **check.config)
+
+        writer.write(b'a001 LOGIN ' + _quote_imap_string(check.config['USER'])
+                     + b' ' + _quote_imap_string(check.config['PASS']) + b'\r\n')
+        await writer.drain()
+
+        response = await _read_imap_line(reader)
+        while not response.startswith(b'a001 '):
+            response = await _read_imap_line(reader)
+
+        _, typ, data = (response.rstrip(b'\r\n').split(b' ', 2) + [b''])[:3]
+        if typ != b'OK':
+            # Same message as imaplib
+            raise imaplib.IMAP4.error(
+                'LOGIN command error: {} {}'.format(typ.decode(), [data]))
+    finally:
+        writer.close()
+
+    check.add_output('Logged in!')
+
+    return True
+
+
+async def _read_imap_line(reader):
+    line = await asyncio.wait_for(reader.readline(), imap_config['timeout'])
+    if not line:
+        raise imaplib.IMAP4.abort('socket error: EOF')
+    return line
+
+
+def _quote_imap_string(value: str) -> bytes:
+    return '"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"')).encode()
@@ -17,7 +17,7 @@ if 'ldap' in config['checks']:
 # /CONFIG
 
 
-@check_function('Successful and correct query against the AD (LDAP) server')
+@check_function('Successful and correct query against the AD (LDAP) server', port=389)
 def check_ldap_lookup(check):
     check.add_output('Starting check...')
 
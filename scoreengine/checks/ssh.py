@@ -1,4 +1,5 @@
 import paramiko
+import socket
 import time
 
 from . import check_function, config
@@ -16,21 +17,32 @@ if 'ssh' in config['checks']:
 # /CONFIG
 
 
-@check_function('Establish an SSH connection and execute a basic command')
+@check_function('Establish an SSH connection and execute a basic command', port=22,
+                port_configurable=True)
 def check_connect(check):
     with paramiko.SSHClient() as client:
         # Allow connecting without known host keys
         client.set_missing_host_key_policy(paramiko.AutoAddPolicy)
 
         check.add_output('Connecting to {HOST!r} as {USER!r} ...', **check.config)
+        check.start_phase('connect')
+        port = int(check.config.get('PORT', 22))
+        sock = socket.create_connection(
+            (check.config['HOST'], port), timeout=ssh_config['timeout'])
+
+        # Key exchange and authentication
+        check.start_phase('auth')
         client.connect(
             hostname=check.config['HOST'],
+            port=port,
             username=check.config['USER'],
             password=check.config['PASS'],
             timeout=ssh_config['timeout'],
+            sock=sock,
         )
         check.add_output('... connected!')
 
+        check.start_phase('verify')
         check.add_output('Executing command whoami ...')
         stdin, stdout, stderr = client.exec_command('whoami')
         actual_user = next(stdout).rstrip()  # strip trailing new line
@@ -46,7 +58,8 @@ def check_connect(check):
     return True
 
 
-@check_function('Establish an SSH connection and execute a basic command')
+@check_function('Establish an SSH connection and execute a basic command', port=22,
+                port_configurable=True)
 def check_connect_ledger(check):
     with paramiko.SSHClient() as client:
     
@@ -55,6 +68,7 @@ def check_connect_ledger(check):
         check.add_output('Connecting to {HOST!r} as {USER!r} ...', **check.config)
         client.connect(
             hostname=check.config['HOST'],
+            port=int(check.config.get('PORT', 22)),
             username=check.config['USER'],
             password=check.config['PASS'],
             timeout=ssh_config['timeout'],)
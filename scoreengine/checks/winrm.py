@@ -21,7 +21,7 @@ if 'winrm' in config['checks']:
 # /CONFIG
 
 
-@check_function('Establish a WinRM connection and execute a basic command')
+@check_function('Establish a WinRM connection and execute a basic command', port=5986)
 def check_connect(check):
     check.add_output('Connecting to {HOST!r} as {USER!r} and running command...', **check.config)
 
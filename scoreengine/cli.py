@@ -1,14 +1,16 @@
 import logging
 
-from celery.bin.worker import worker as celery_worker
 import click
 from sqlalchemy.sql import func
 
+# Commands import the modules that depend on Celery (and on the checks'
+# dependencies) themselves, so that the other commands start quickly
 from scoreengine import (
-    celery_app,
+    bench as benchmarks,
     config,
     models,
-    runner,
+    persistence,
+    registry,
     utils,
 )
 
@@ -16,16 +18,272 @@ from scoreengine import (
 cli = click.Group()
 
 
+@cli.group()
+def bank():
+    """Payouts to the Bank API."""
+
+
+@bank.command()
+def status():
+    """Show how many payouts are still queued."""
+    from scoreengine import bank as payouts
+
+    queue_status = payouts.get_queue_status()
+    click.echo('Queued: {}'.format(queue_status.pending))
+    click.echo('Given up on: {}'.format(queue_status.failed))
+    if queue_status.oldest is not None:
+        click.echo('Oldest queued: {}'.format(queue_status.oldest))
+
+
+@bank.command()
+@click.option('--retry-failed', is_flag=True,
+              help='Also retry payouts that were given up on.')
+def send(retry_failed):
+    """Send the payouts that are due now."""
+    from scoreengine import bank as payouts
+
+    logging.getLogger('scoreengine').setLevel(config['logging']['level'])
+
+    if retry_failed:
+        with utils.session_scope() as session:
+            (session.query(models.Payout)
+                .filter(models.Payout.sent.is_(None))
+                .update({'attempts': 0, 'next_attempt': None}, synchronize_session=False))
+
+    sender = payouts.PayoutSender()
+    while sender.send_due():
+        pass
+
+
+@cli.group()
+def bench():
+    """Benchmarks of the scoring pipeline."""
+
+
+@bench.command()
+@click.option('--teams', '-t', 'team_counts', type=click.IntRange(min=1),
+              multiple=True, default=(10, 40, 100), show_default=True,
+              help='Number of synthetic teams.')
+@click.option('--services', '-s', 'service_counts', type=click.IntRange(min=1),
+              multiple=True, default=(5, 25), show_default=True,
+              help='Number of synthetic services.')
+@click.option('--data', default=4, type=click.IntRange(min=1), show_default=True,
+              help='Number of team service data rows per team and service.')
+@click.option('--repeat', default=3, type=click.IntRange(min=1), show_default=True,
+              help='Number of runs (the best one is reported).')
+@click.option('--database-url', default='sqlite://', show_default=True,
+              help='Database to populate with synthetic data (will be wiped).')
+def round_setup(team_counts, service_counts, data, repeat, database_url):
+    """Time serializing a round's checks (per pair vs. in bulk)."""
+    click.echo('{:>6} {:>9} {:>12} {:>12} {:>8}'.format(
+        'teams', 'services', 'per-pair (s)', 'bulk (s)', 'speedup'))
+    rows = benchmarks.round_setup(
+        team_counts, service_counts,
+        data_per_service=data, repeat=repeat, database_url=database_url,
+    )
+    for teams, services, per_pair, bulk in rows:
+        click.echo('{:>6} {:>9} {:>12.4f} {:>12.4f} {:>7.1f}x'.format(
+            teams, services, per_pair, bulk, per_pair / bulk))
+
+
+@bench.command()
+@click.option('--checks', '-n', 'number_of_checks', default=2000, type=click.IntRange(min=1),
+              show_default=True, help='Number of checks to perform.')
+@click.option('--concurrency', '-c', default=10, type=click.IntRange(min=1), show_default=True,
+              help='Number of checks performed at once.')
+@click.option('--targets', default=10, type=click.IntRange(min=1), show_default=True,
+              help='Number of stand-in websites (one per team).')
+def http(number_of_checks, concurrency, targets):
+    """Time HTTP checks against local websites (with and without pooling)."""
+    click.echo('{:<8} {:>8} {:>10} {:>10} {:>10} {:>10}'.format(
+        'pooling', 'time (s)', 'checks/s', 'mean (ms)', 'p50 (ms)', 'p95 (ms)'))
+    rows = benchmarks.http_checks(number_of_checks, concurrency, targets)
+    for pooling, elapsed, throughput, mean, median, p95 in rows:
+        click.echo('{:<8} {:>8.2f} {:>10.1f} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+            'on' if pooling else 'off', elapsed, throughput,
+            mean * 1000, median * 1000, p95 * 1000))
+
+
+@bench.command()
+@click.option('--targets', '-n', default=50, type=click.IntRange(min=1), show_default=True,
+              help='Number of stand-in SSH servers (one check each per round).')
+@click.option('--rounds', '-r', default=3, type=click.IntRange(min=1), show_default=True,
+              help='Number of rounds in each mode.')
+@click.option('--concurrency', '-c', default=20, type=click.IntRange(min=1), show_default=True,
+              help='Number of checks performed at once on threads.')
+@click.option('--processes', '-p', type=click.IntRange(min=1),
+              help='Number of processes to perform checks on (default: one per CPU).')
+def ssh(targets, rounds, concurrency, processes):
+    """Time rounds of SSH checks against local servers (on threads vs. processes)."""
+    click.echo('{:<10} {:>10} {:>10}'.format('mode', 'round (s)', 'checks/s'))
+    for mode, round_time, throughput in benchmarks.ssh_checks(
+            targets, rounds, concurrency, processes):
+        click.echo('{:<10} {:>10.3f} {:>10.1f}'.format(mode, round_time, throughput))
+
+
+@bench.command()
+@click.option('--targets', '-n', default=40, type=click.IntRange(min=1), show_default=True,
+              help='Number of stand-in DNS servers (one check each per round).')
+@click.option('--rounds', '-r', default=3, type=click.IntRange(min=1), show_default=True,
+              help='Number of rounds in each mode.')
+@click.option('--concurrency', '-c', default=20, type=click.IntRange(min=1), show_default=True,
+              help='Number of checks performed at once on threads.')
+@click.option('--big-share', default=0.1, type=click.FloatRange(0, 1), show_default=True,
+              help='Proportion of checks whose answer is truncated over UDP.')
+def dns(targets, rounds, concurrency, big_share):
+    """Time rounds of DNS checks against local servers (with and without multiplexing)."""
+    click.echo('{:<8} {:<11} {:>10} {:>10}'.format('engine', 'multiplexed', 'round (s)', 'checks/s'))
+    for engine, multiplex, round_time, throughput in benchmarks.dns_checks(
+            targets, rounds, concurrency, big_share):
+        click.echo('{:<8} {:<11} {:>10.3f} {:>10.1f}'.format(
+            engine, 'yes' if multiplex else 'no', round_time, throughput))
+
+
+@bench.command()
+@click.option('--repeat', default=5, type=click.IntRange(min=1), show_default=True,
+              help='Number of runs (the best one is reported).')
+def import_time(repeat):
+    """Time starting up (importing modules) in a fresh interpreter."""
+    click.echo('{:<26} {:>8}  {}'.format('target', 'time (s)', 'heavy modules loaded'))
+    for name, elapsed, loaded_modules in benchmarks.import_time(repeat=repeat):
+        click.echo('{:<26} {:>8.3f}  {}'.format(name, elapsed, ', '.join(loaded_modules) or '-'))
+
+
+@bench.command()
+@click.option('--teams', '-t', default=10, type=click.IntRange(min=1), show_default=True,
+              help='Number of synthetic teams.')
+@click.option('--services', '-s', default=10, type=click.IntRange(min=1), show_default=True,
+              help='Number of synthetic services.')
+@click.option('--rounds', '-r', default=3, type=click.IntRange(min=1), show_default=True,
+              help='Number of rounds to run in each mode.')
+@click.option('--mode', '-m', 'modes', type=click.Choice(benchmarks.PIPELINE_MODES),
+              multiple=True, default=('threads', 'celery'), show_default=True,
+              help='How checks are performed.')
+@click.option('--latency', default=0.05, type=click.FloatRange(min=0), show_default=True,
+              help='Seconds that each synthetic check takes.')
+@click.option('--max-latency', type=click.FloatRange(min=0),
+              help='If specified, checks take a random time between --latency and this.')
+@click.option('--failure-rate', default=0.1, type=click.FloatRange(0, 1), show_default=True,
+              help='Proportion of synthetic checks that fail.')
+@click.option('--trace-memory/--no-trace-memory', default=True, show_default=True,
+              help='Measure peak memory allocations (slows rounds down).')
+@click.option('--database-url',
+              help='Database to populate with synthetic data (will be wiped; '
+                   'default: a temporary SQLite database).')
+def pipeline(teams, services, rounds, modes, latency, max_latency, failure_rate,
+             trace_memory, database_url):
+    """Run full rounds of synthetic checks and time each stage."""
+    logging.getLogger('scoreengine').setLevel(logging.WARNING)
+    rows = benchmarks.pipeline(
+        teams, services, rounds,
+        modes=modes,
+        latency=latency,
+        max_latency=max_latency,
+        failure_rate=failure_rate,
+        trace_memory=trace_memory,
+        database_url=database_url,
+    )
+    click.echo('{:<8} {:>7} {:>9} {:>9} {:>11} {:>8} {:>8} {:>8} {:>9} {:>9}'.format(
+        'mode', 'checks', 'round (s)', 'setup (s)', 'dispatch/s',
+        'p50 (s)', 'p95 (s)', 'p99 (s)', 'writes/s', 'peak (MB)'))
+    for (mode, number_of_checks, round_time, setup_time, dispatch_rate, latencies,
+         write_rate, peak_memory) in rows:
+        click.echo('{:<8} {:>7} {:>9.3f} {:>9.4f} {:>11.1f} {:>8.3f} {:>8.3f} {:>8.3f} '
+                   '{:>9.1f} {:>9}'.format(
+            mode, number_of_checks, round_time, setup_time, dispatch_rate,
+            latencies.p50, latencies.p95, latencies.p99, write_rate,
+            '-' if peak_memory is None else '{:.1f}'.format(peak_memory / 1e6),
+        ))
+
+
+@bench.command()
+@click.option('--teams', '-t', default=40, type=click.IntRange(min=1), show_default=True,
+              help='Number of synthetic teams.')
+@click.option('--services', '-s', default=25, type=click.IntRange(min=1), show_default=True,
+              help='Number of synthetic services.')
+@click.option('--rounds', '-r', default=1000, type=click.IntRange(min=1), show_default=True,
+              help='Number of synthetic rounds of checks.')
+@click.option('--repeat', default=3, type=click.IntRange(min=1), show_default=True,
+              help='Number of runs (the best one is reported).')
+@click.option('--database-url', default='sqlite://', show_default=True,
+              help='Database to populate with synthetic data (will be wiped).')
+def scoreboard(teams, services, rounds, repeat, database_url):
+    """Time scoreboard queries (without indexes, with indexes, on summaries)."""
+    rows, number_of_checks = benchmarks.scoreboard(
+        teams, services, rounds, repeat=repeat, database_url=database_url)
+    click.echo('{} checks'.format(number_of_checks))
+    click.echo('{:<14} {:>14} {:>12} {:>13}'.format(
+        'query', 'unindexed (s)', 'indexed (s)', 'summary (s)'))
+    for name, unindexed, indexed, summary in rows:
+        click.echo('{:<14} {:>14.4f} {:>12.4f} {:>13}'.format(
+            name, unindexed, indexed, '-' if summary is None else '{:.4f}'.format(summary)))
+
+
 @cli.group()
 def db():
     """Database queries (including initialization)."""
 
 
 @db.command()
-def init():
+@click.option('--sync', is_flag=True,
+              help='Update the existing teams and services instead of re-creating the database.')
+def init(sync):
     """Initialize the database."""
     logging.getLogger('scoreengine').setLevel(config['logging']['level'])
-    utils.init_db_from_config()
+    if registry.load_checks():
+        raise click.ClickException('Some services have unknown checks')
+    utils.init_db_from_config(sync=sync)
+
+
+@db.command()
+def migrate():
+    """Update the schema of an existing database without losing data."""
+    logging.getLogger('scoreengine').setLevel(config['logging']['level'])
+    utils.migrate_db()
+    with utils.session_scope() as session:
+        persistence.rebuild_check_summaries(session)
+
+
+@db.command()
+@click.option('--keep', default=0, type=click.IntRange(min=0), show_default=True,
+              help='Number of most recent rounds to keep the output of.')
+def prune_output(keep):
+    """Drop the output of passed checks from earlier rounds."""
+    with utils.session_scope() as session:
+        max_round = session.query(func.max(models.Check.round)).scalar()
+    if max_round is None or max_round <= keep:
+        return
+
+    count = persistence.drop_passed_output(max_round - keep)
+    click.echo('Dropped the output of {} checks'.format(count))
+
+
+@db.command()
+@click.option('--first-round', type=click.IntRange(min=1),
+              help='First round to consider (default: the first one).')
+@click.option('--last-round', type=click.IntRange(min=1),
+              help='Last round to consider (default: the last one).')
+def timings(first_round, last_round):
+    """Show percentiles of how long checks took and waited, in seconds."""
+    by_service, by_team = persistence.summarize_check_timings(first_round, last_round)
+    for title, summaries in (('service', by_service), ('team', by_team)):
+        click.echo('{:<24} {:>7} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8}'.format(
+            title, 'checks', 'p50', 'p95', 'p99', 'wait p50', 'wait p95', 'wait p99'))
+        for summary in summaries:
+            click.echo('{:<24} {:>7} {} {}'.format(
+                summary.name[:24],
+                summary.checks,
+                _format_percentiles(summary.duration),
+                _format_percentiles(summary.wait),
+            ))
+        click.echo()
+
+
+def _format_percentiles(percentiles: persistence.Percentiles) -> str:
+    return ' '.join(
+        '{:>8}'.format('-' if value is None else '{:.3f}'.format(value))
+        for value in percentiles
+    )
 
 
 @db.command()
@@ -57,6 +315,8 @@ def list_teams():
               help='Round number to start checks at.')
 def run(use_task_queue, reset, resume, start_round):
     """Perform scheduling of round checks for scoring."""
+    from scoreengine import metrics, runner
+
     logging.getLogger('scoreengine').setLevel(config['logging']['level'])
 
     if reset:
@@ -69,14 +329,69 @@ def run(use_task_queue, reset, resume, start_round):
         if max_round is not None:
             start_round = max_round + 1
 
+    registry.load_checks()
+    metrics_config = metrics.get_metrics_config()
+    if metrics_config['enabled']:
+        metrics.start_server(metrics_config['run_port'])
     runner.Runner(start_round).run(use_task_queue=use_task_queue)
 
 
 @cli.command()
-def worker():
-    """Process checks on the Celery task queue."""
+@click.option('--queue', '-Q', 'queues', multiple=True,
+              help='Name of a task queue to consume (default: all of them).')
+def worker(queues):
+    """Process checks on the Celery task queue.
+
+    A worker that only consumes the queue of a pool of checks performs as many
+    of them at once as the pool's size.
+    """
+    from celery.bin.worker import worker as celery_worker
+
+    from scoreengine import celery_app, metrics, runner
+
+    pool_sizes = {
+        runner.get_queue_name(group): size
+        for group, size in runner.runner_config['pools'].items()
+    }
+    if not queues:
+        # The default queue and the queues dedicated to pools of checks
+        queues = [celery_app.conf.task_default_queue] + list(pool_sizes)
+
+    worker_config = dict(config['celery']['worker'], queues=queues)
+    if len(queues) == 1 and queues[0] in pool_sizes:
+        worker_config['concurrency'] = pool_sizes[queues[0]]
+    elif any(queue in pool_sizes for queue in queues):
+        click.secho(
+            'Warning: the sizes of pools are not enforced by a worker that also consumes '
+            'other queues; start a worker per pool with --queue checks.<group>',
+            fg='yellow', err=True,
+        )
+    metrics_config = metrics.get_metrics_config()
+    if metrics_config['enabled']:
+        if worker_config.get('pool', 'prefork') in ('prefork', 'processes'):
+            # Checks are performed (and measured) in the pool's processes
+            metrics.serve_from_worker_processes()
+        else:
+            metrics.start_server(metrics_config['worker_port'])
+
+    registry.load_checks()
     celery_app.autodiscover_tasks(['scoreengine.tasks'])
-    celery_worker(app=celery_app).run(**config['celery']['worker'])
+    celery_worker(app=celery_app).run(**worker_config)
+
+
+@cli.command()
+def list_checks():
+    """List the available checks."""
+    registry.checks.load()
+    for check in registry.checks:
+        click.echo('{:40} {:6} {}'.format(
+            '{}.{}'.format(check.file_name, check.function_name),
+            'async' if check.async_function is not None else '',
+            check.expectation,
+        ))
+    for file_name, error in sorted(registry.checks.unavailable_modules.items()):
+        click.secho('{:40} {:6} {}'.format(
+            '{}.*'.format(file_name), '', 'Unavailable: {}'.format(error)), fg='red')
 
 
 @cli.command()
@@ -86,6 +401,8 @@ def worker():
               help='ID of team to be checked.')
 def check(services, teams):
     """Perform one-time checks as a dry-run (without the task queue)."""
+    from scoreengine import runner
+
     results = runner.perform_round_checks(
         current_round=None,
         use_task_queue=False,
@@ -0,0 +1,91 @@
+"""Compact storage of check output.
+
+Most of the output of a check is the same boilerplate (see
+:func:`checks.check_function`), so it is compressed with zlib using a preset
+dictionary made of that boilerplate. Compressed output starts with the version
+of the dictionary it was compressed with: add a new version instead of
+changing an existing one, or output compressed with it can no longer be read.
+"""
+import zlib
+
+
+# Phrases that are more likely to be found in output come last. They leave
+# out the parts that depend on the configuration (such as the check timeout)
+# or on the teams' hosts (such as the TTL of their replies).
+_PHRASES_V1 = (
+    'Traceback (most recent call last):',
+    'ERROR: timeout: timed out',
+    'ERROR: ConnectionRefusedError: [Errno 111] Connection refused',
+    'ERROR: OSError: [Errno 113] No route to host',
+    'ERROR: ConnectionError: ',
+    'ERROR: ReadTimeout: ',
+    'ERROR: Check did not complete within ',
+    'ERROR: Page returned status code 500',
+    'ERROR: Page returned status code 404',
+    'ERROR: The table count returned is incorrect.',
+    'ERROR: Logged in cookie not set.',
+    'ERROR: Invalid data returned.',
+    'ERROR: DNS Server did not respond with the correct IP',
+    'NOTICE: DNS Server returned ',
+    'EXPECTED: Ability to use the gitlab website',
+    'EXPECTED: Ability to use the Wordpress website',
+    'EXPECTED: Login and query against a Wordpress database',
+    'EXPECTED: Successful login on the MySQL Database',
+    'EXPECTED: Successful and correct query against the AD (LDAP) server',
+    'EXPECTED: Establish a WinRM connection and execute a basic command',
+    'EXPECTED: Establish an SSH connection and execute a basic command',
+    'EXPECTED: Successful connect, upload, and deletion of a file',
+    'EXPECTED: Successful authentication against the email server',
+    'EXPECTED: Successful and correct query against the DNS server',
+    'EXPECTED: Website is online',
+    'EXPECTED: 1 packet received',
+    'Executing command whoami ...',
+    '... command ran successfully!',
+    'Querying for some data from the database...',
+    'Attempting to describe all tables...',
+    'Verifying the data...',
+    'Loading login page',
+    'Loaded!',
+    'Logging in as ',
+    'Attempting to log in as ',
+    'Logged in!',
+    'Authentication successful!',
+    'Uploading file ',
+    'Uploaded!',
+    'File size check passed!',
+    'Deleted!',
+    'Starting check...',
+    '... connected!',
+    'Connected!',
+    'Querying ',
+    'Connecting to http://',
+    'Connecting to ',
+    '1 packets transmitted, 1 received, 0% packet loss',
+    ' bytes from ',
+    ': icmp_seq=1 ttl=',
+    ' ms\n\n--- ',
+    ' ping statistics ---\n',
+    'PING ',
+    ' bytes of data.\n',
+    'OUTPUT:\n',
+    ' Check\nEXPECTED: ',
+    'ScoreEngine: ',
+    '\nCheck successful!',
+)
+
+DICTIONARIES = {
+    1: '\n'.join(_PHRASES_V1).encode('utf-8'),
+}
+CURRENT_VERSION = 1
+
+
+def compress_output(output: str) -> bytes:
+    compressor = zlib.compressobj(level=9, zdict=DICTIONARIES[CURRENT_VERSION])
+    compressed = compressor.compress(output.encode('utf-8')) + compressor.flush()
+    return bytes([CURRENT_VERSION]) + compressed
+
+
+def decompress_output(data: bytes) -> str:
+    decompressor = zlib.decompressobj(zdict=DICTIONARIES[data[0]])
+    output = decompressor.decompress(data[1:]) + decompressor.flush()
+    return output.decode('utf-8')
@@ -0,0 +1,153 @@
+"""Asyncio execution engine for checks.
+
+Checks that have a native asyncio variant (named ``<function_name>_async`` in
+the same module) are run on a single event loop, so thousands of them can be in
+flight at once. Checks without one are run on a :class:`DeadlineExecutor`.
+"""
+import asyncio
+import collections
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+from . import executors, registry, tasks
+from .tasks import CheckData
+
+
+def iter_results(task_descriptions: Iterable[dict], concurrency: int,
+                 thread_concurrency: int, timeout: float,
+                 pool_sizes: Optional[Dict[str, int]] = None,
+                 max_per_host: Optional[int] = None,
+                 pacer=None,
+                 process_pools: Optional[executors.ProcessPools] = None) -> Iterator[dict]:
+    """Perform checks on an event loop, yielding the results as they complete.
+
+    :param task_descriptions: Serialized checks to be performed.
+    :param concurrency: Maximum number of checks in flight at once.
+    :param thread_concurrency: Maximum number of checks without an asyncio
+                               variant that are run at once (on threads).
+    :param timeout: Checks that take longer than this many seconds are
+                    recorded as failed.
+    :param pool_sizes: Maximum number of checks in flight at once for each
+                       group of checks (instead of ``concurrency``).
+    :param max_per_host: Maximum number of checks in flight at once against
+                         each host.
+    :param pacer: If specified, a :class:`runner.DispatchPacer` that schedules
+                  when each check is dispatched.
+    :param process_pools: If specified, checks without an asyncio variant
+                          whose group has a process pool are run there.
+    """
+    task_descriptions = list(task_descriptions)
+    completed = queue.Queue()
+
+    loop_thread = threading.Thread(
+        target=asyncio.run,
+        args=(_perform_checks(
+            task_descriptions, concurrency, thread_concurrency, timeout,
+            pool_sizes or {}, max_per_host, pacer, process_pools, completed.put),),
+        daemon=True,
+    )
+    loop_thread.start()
+
+    for _ in task_descriptions:
+        result, exception = completed.get()
+        if exception is not None:
+            raise exception
+        yield result
+
+    loop_thread.join()
+
+
+async def _perform_checks(task_descriptions, concurrency, thread_concurrency, timeout,
+                          pool_sizes, max_per_host, pacer, process_pools,
+                          on_completed: Callable):
+    pool_semaphores = {
+        pool: asyncio.Semaphore(size)
+        for pool, size in pool_sizes.items()
+    }
+    default_semaphore = asyncio.Semaphore(concurrency)
+    host_semaphores = collections.defaultdict(lambda: asyncio.Semaphore(max_per_host))
+    executor = executors.DeadlineExecutor(
+        max_workers=thread_concurrency, deadline=timeout, pool_sizes=pool_sizes)
+
+    async def perform_check(index, data):
+        pool = data['check']['file_name']
+        host = data['config'].get('HOST')
+
+        if pacer is not None:
+            await asyncio.sleep(pacer.delay(index))
+        data['queued_at'] = time.time()
+
+        # Wait for the host before taking a slot of the pool, so that checks
+        # waiting on a busy host do not hold up checks of other hosts
+        host_semaphore = None
+        if max_per_host and host is not None:
+            host_semaphore = host_semaphores[host]
+            await host_semaphore.acquire()
+        try:
+            async with pool_semaphores.get(pool, default_semaphore):
+                if pacer is not None:
+                    pacer.record_start(index)
+                try:
+                    result = await _perform_check(data, executor, timeout, process_pools)
+                except Exception as e:
+                    on_completed((None, e))
+                else:
+                    on_completed((result, None))
+        finally:
+            if host_semaphore is not None:
+                host_semaphore.release()
+
+    if pacer is not None:
+        pacer.begin()
+
+    try:
+        await asyncio.gather(*(
+            perform_check(index, data)
+            for index, data in enumerate(task_descriptions)
+        ))
+    finally:
+        executor.shutdown(wait=False)
+
+
+async def _perform_check(data, executor: executors.DeadlineExecutor, timeout: float,
+                         process_pools: Optional[executors.ProcessPools]):
+    check_function = _get_async_check_function(**data['check'])
+
+    if check_function is None:
+        # No asyncio variant of this check, so run it on a thread instead (which
+        # waits for a process to run it, if its group has a process pool)
+        pool = data['check']['file_name']
+        attempt_data = tasks.copy_check_data(data)
+        in_process = process_pools is not None and pool in process_pools
+        if in_process:
+            # The process enforces the deadline once it picks the check up
+            args = (tasks.perform_check_in_process, process_pools, attempt_data, timeout)
+        else:
+            args = (
+                _run_check_function, tasks._get_check_function(**data['check']), attempt_data)
+        future = executor.submit(
+            *args,
+            pool=pool,
+            on_timeout=lambda: tasks.timed_out_check(data, timeout),
+            timed=not in_process,
+        )
+        return await asyncio.wrap_future(future)
+
+    try:
+        with tasks.timed_check(data):
+            await asyncio.wait_for(check_function(CheckData(data)), timeout)
+    except asyncio.TimeoutError:
+        return tasks.timed_out_check(data, timeout)
+    return data
+
+
+def _run_check_function(check_function, data):
+    with tasks.timed_check(data):
+        check_function(CheckData(data))
+    return data
+
+
+def _get_async_check_function(file_name, function_name):
+    return registry.checks.get(file_name, function_name).async_function
@@ -0,0 +1,314 @@
+import concurrent.futures
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import collections
+import logging
+import multiprocessing
+import threading
+from typing import Any, Callable, Dict, Optional
+
+
+logger = logging.getLogger(__name__)
+
+# The work item that each worker thread of a DeadlineExecutor is running
+_current = threading.local()
+
+
+def is_abandoned() -> bool:
+    """Whether the call running on this thread was abandoned by its
+    :class:`DeadlineExecutor` (so that its result will be discarded)."""
+    item = getattr(_current, 'item', None)
+    return item is not None and item.expired
+
+
+class _WorkItem:
+    def __init__(self, future: Future, fn: Callable, args: tuple,
+                 pool: Optional[str], host: Optional[str],
+                 on_timeout: Optional[Callable[[], Any]], timed: bool):
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.pool = pool
+        self.host = host
+        self.on_timeout = on_timeout
+        self.timed = timed
+        self.expired = False
+        self.finished = False
+
+
+class DeadlineExecutor:
+    """Thread pool that abandons work running past a deadline.
+
+    Python threads cannot be killed, so a call that is still running when its
+    deadline passes is abandoned: its future is resolved with the result of
+    ``on_timeout`` (or a :class:`TimeoutError`), and a replacement worker is
+    started so that the pool keeps ``max_workers`` threads doing useful work.
+    Whatever the abandoned call eventually returns is discarded.
+
+    Work can be submitted to a named pool, which runs at most as many calls
+    at once as its size in ``pool_sizes`` (work for other pools shares
+    ``max_workers``), and for a host, which has at most ``max_per_host`` calls
+    running at once across all pools. Abandoned calls do not count against
+    either limit. Work submitted with ``timed=False`` is never abandoned (such
+    as waiting for a process, which enforces the deadline itself).
+    """
+
+    def __init__(self, max_workers: int, deadline: float,
+                 pool_sizes: Optional[Dict[str, int]] = None,
+                 max_per_host: Optional[int] = None):
+        self.max_workers = max_workers
+        self.deadline = deadline
+        self.pool_sizes = dict(pool_sizes or {})
+        self.max_per_host = max_per_host
+
+        self._condition = threading.Condition()
+        self._pending = collections.deque()
+        self._pending_per_pool = collections.Counter()
+        self._running_per_pool = collections.Counter()
+        self._running_per_host = collections.Counter()
+        self._workers = 0  # excludes abandoned workers
+        self._idle_workers = 0
+        self._starting_workers = 0  # started, but yet to look for work
+        self._shutdown = False
+
+    @property
+    def total_workers(self) -> int:
+        return self.max_workers + sum(self.pool_sizes.values())
+
+    @property
+    def is_shutdown(self) -> bool:
+        return self._shutdown
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True)
+        return False
+
+    def submit(self, fn: Callable, *args, pool: Optional[str] = None,
+               host: Optional[str] = None,
+               on_timeout: Optional[Callable[[], Any]] = None,
+               timed: bool = True) -> Future:
+        if pool not in self.pool_sizes:
+            pool = None
+
+        future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new work after shutdown')
+
+            self._pending.append(_WorkItem(future, fn, args, pool, host, on_timeout, timed))
+            self._pending_per_pool[pool] += 1
+            self._start_workers()
+            self._condition.notify_all()
+        return future
+
+    def shutdown(self, wait: bool = True):
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+            if wait:
+                # Abandoned workers are not waited for
+                self._condition.wait_for(lambda: self._workers == 0)
+
+    def _start_workers(self):
+        """Start workers for the pending work that no worker is free to take.
+
+        Idle workers that were notified of new work only stop being idle once
+        they wake up, so they are compared against all the pending work (such
+        as a burst of submissions), rather than started only when none is idle.
+        Only work that its pool has room for counts, so that work waiting for
+        a full pool does not keep workers from being started for other pools.
+        """
+        # The caller must hold self._condition
+        while (self._count_runnable() > self._idle_workers + self._starting_workers
+               and self._workers < self.total_workers):
+            self._workers += 1
+            self._starting_workers += 1
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+
+    def _count_runnable(self) -> int:
+        # The caller must hold self._condition
+        return sum(
+            min(pending, self.pool_sizes.get(pool, self.max_workers) - self._running_per_pool[pool])
+            for pool, pending in self._pending_per_pool.items()
+            if pending
+        )
+
+    def _next_item(self) -> Optional[_WorkItem]:
+        # The caller must hold self._condition
+        for item in self._pending:
+            pool_size = self.pool_sizes.get(item.pool, self.max_workers)
+            if self._running_per_pool[item.pool] >= pool_size:
+                continue
+            if (self.max_per_host and item.host is not None
+                    and self._running_per_host[item.host] >= self.max_per_host):
+                continue
+
+            self._pending.remove(item)
+            self._pending_per_pool[item.pool] -= 1
+            self._running_per_pool[item.pool] += 1
+            if item.host is not None:
+                self._running_per_host[item.host] += 1
+            return item
+        return None
+
+    def _release(self, item: _WorkItem):
+        # The caller must hold self._condition
+        self._running_per_pool[item.pool] -= 1
+        if item.host is not None:
+            self._running_per_host[item.host] -= 1
+        self._condition.notify_all()
+
+    def _work(self):
+        starting = True
+        while True:
+            with self._condition:
+                if starting:
+                    self._starting_workers -= 1
+                    starting = False
+                item = self._next_item()
+                while item is None and not (self._shutdown and not self._pending):
+                    self._idle_workers += 1
+                    self._condition.wait()
+                    self._idle_workers -= 1
+                    item = self._next_item()
+
+                if item is None:
+                    self._workers -= 1
+                    self._condition.notify_all()
+                    return
+
+            if not item.future.set_running_or_notify_cancel():
+                with self._condition:
+                    self._release(item)
+                continue
+
+            timer = None
+            if item.timed:
+                timer = threading.Timer(self.deadline, self._expire, args=(item,))
+                timer.daemon = True
+                timer.start()
+
+            result = exception = None
+            _current.item = item
+            try:
+                result = item.fn(*item.args)
+            except BaseException as e:
+                exception = e
+            finally:
+                _current.item = None
+                if timer is not None:
+                    timer.cancel()
+
+            with self._condition:
+                if item.expired:
+                    # A replacement worker has taken over our slot
+                    return
+                item.finished = True
+                self._release(item)
+
+            if exception is None:
+                item.future.set_result(result)
+            else:
+                item.future.set_exception(exception)
+
+    def _expire(self, item: _WorkItem):
+        with self._condition:
+            if item.finished:
+                return
+            item.expired = True
+            self._release(item)
+
+            self._workers -= 1
+            self._start_workers()
+
+        logger.warning('Abandoning work that ran past its %s second deadline', self.deadline)
+
+        if item.on_timeout is None:
+            item.future.set_exception(
+                TimeoutError('Deadline of {} seconds exceeded'.format(self.deadline)))
+            return
+
+        try:
+            item.future.set_result(item.on_timeout())
+        except BaseException as e:
+            item.future.set_exception(e)
+
+
+class ProcessPools:
+    """Process pools for groups of checks that are CPU-bound.
+
+    Threads of a single interpreter only run Python code one at a time, so
+    checks that spend much of their time on computations (such as the key
+    exchange of SSH) are better run in other processes. Each group gets a pool
+    of ``sizes[group]`` processes, started when first used and then reused.
+    The processes are spawned (rather than forked from a process that has
+    threads and database connections of its own).
+
+    A call with a ``timeout`` is given up on by its process once it has run
+    for that long there (not counting the time it waited for a process), so
+    that a hung call does not hold up the calls queued behind it.
+    """
+
+    def __init__(self, sizes: Dict[str, int]):
+        self.sizes = dict(sizes)
+        self._pools: Dict[str, ProcessPoolExecutor] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, group: str) -> bool:
+        return group in self.sizes
+
+    def run(self, group: str, fn: Callable, *args, timeout: Optional[float] = None):
+        """Call ``fn(*args)`` in a process of the group's pool, and wait for it.
+
+        :raises TimeoutError: If the call ran for more than ``timeout`` seconds.
+        """
+        pool = self._get_pool(group)
+        try:
+            if timeout is None:
+                return pool.submit(fn, *args).result()
+            return pool.submit(_call_with_timeout, fn, args, timeout).result()
+        except BrokenProcessPool:
+            # A process died, so start a new pool for the next call
+            with self._lock:
+                if self._pools.get(group) is pool:
+                    del self._pools[group]
+            raise
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.shutdown(wait=wait)
+
+    def _get_pool(self, group: str) -> ProcessPoolExecutor:
+        with self._lock:
+            if group not in self._pools:
+                logger.info('Starting %d processes for %s checks', self.sizes[group], group)
+                self._pools[group] = ProcessPoolExecutor(
+                    max_workers=self.sizes[group],
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            return self._pools[group]
+
+
+def _call_with_timeout(fn: Callable, args: tuple, timeout: float):
+    """Call ``fn(*args)`` on a thread of this process, and give up on it
+    after ``timeout`` seconds (leaving it running, as threads cannot be killed)."""
+    future = Future()
+
+    def call():
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=call, daemon=True).start()
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        raise TimeoutError('Deadline of {} seconds exceeded'.format(timeout)) from None
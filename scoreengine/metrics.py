@@ -0,0 +1,328 @@
+"""Metrics about scoring, exposed in the Prometheus text format over HTTP.
+
+``scoreengine2 run`` and ``scoreengine2 worker`` serve the metrics of their
+process at ``http://<host>:<port>/metrics`` when enabled. Worker processes of
+the prefork pool each serve their own, on consecutive ports.
+"""
+import bisect
+from contextlib import contextmanager
+import functools
+import http.server
+import logging
+import math
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from . import config, executors
+
+
+# DEFAULTS
+_default_metrics_config = {
+    'enabled': False,
+    'host': '127.0.0.1',
+    'run_port': 9100,
+    'worker_port': 9101,
+}
+# /DEFAULTS
+
+
+@functools.lru_cache()
+def get_metrics_config() -> dict:
+    """Read the configuration only when needed, as most modules import this one."""
+    metrics_config = dict(_default_metrics_config)
+    # CONFIG
+    if 'metrics' in config:
+        metrics_config.update(config['metrics'])
+    # /CONFIG
+    return metrics_config
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60,
+)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def labels(self, **labels) -> '_BoundMetric':
+        if set(labels) != set(self.labelnames):
+            raise ValueError('Expected labels {}, got {}'.format(
+                sorted(self.labelnames), sorted(labels)))
+        return _BoundMetric(self, tuple(str(labels[name]) for name in self.labelnames))
+
+    def render(self) -> List[str]:
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} {}'.format(self.name, self.type_name),
+        ]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key: tuple, value) -> List[str]:
+        return ['{}{} {}'.format(self.name, self._format_labels(key), _format_number(value))]
+
+    def _format_labels(self, key: tuple, extra: Iterable[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{{{}}}'.format(','.join(
+            '{}="{}"'.format(name, _escape_label_value(value))
+            for name, value in pairs
+        ))
+
+
+class _BoundMetric:
+    """A metric with values for all of its labels."""
+
+    def __init__(self, metric: _Metric, key: tuple):
+        self._metric = metric
+        self._key = key
+
+    def __getattr__(self, name):
+        method = getattr(self._metric, name)
+        return lambda *args, **kwargs: method(*args, _key=self._key, **kwargs)
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def inc(self, amount: float = 1, _key: tuple = ()):
+        with self._lock:
+            self._values[_key] = self._values.get(_key, 0) + amount
+
+    def value(self, _key: tuple = ()) -> float:
+        with self._lock:
+            return self._values.get(_key, 0)
+
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def inc(self, amount: float = 1, _key: tuple = ()):
+        with self._lock:
+            self._values[_key] = self._values.get(_key, 0) + amount
+
+    def dec(self, amount: float = 1, _key: tuple = ()):
+        self.inc(-amount, _key=_key)
+
+    def set(self, value: float, _key: tuple = ()):
+        with self._lock:
+            self._values[_key] = value
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, _key: tuple = ()):
+        with self._lock:
+            counts, total = self._values.get(_key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[_key] = (counts, total + value)
+
+    def totals(self, _key: tuple = ()) -> Tuple[int, float]:
+        """Count and sum of the observed values."""
+        with self._lock:
+            counts, total = self._values.get(_key, ((), 0.0))
+            return sum(counts), total
+
+    @contextmanager
+    def time(self, _key: tuple = ()):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, _key=_key)
+
+    def _render_value(self, key: tuple, value) -> List[str]:
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            lines.append('{}_bucket{} {}'.format(
+                self.name,
+                self._format_labels(key, [('le', _format_number(bound))]),
+                cumulative,
+            ))
+        labels = self._format_labels(key)
+        lines.append('{}_sum{} {}'.format(self.name, labels, _format_number(total)))
+        lines.append('{}_count{} {}'.format(self.name, labels, cumulative))
+        return lines
+
+
+def _format_number(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Checks
+CHECK_DURATION = Histogram(
+    'scoreengine_check_duration_seconds',
+    'Time taken to perform checks.',
+    ['service', 'check'],
+)
+CHECKS = Counter(
+    'scoreengine_checks_total',
+    'Checks performed, by result.',
+    ['service', 'check', 'result'],
+)
+CHECKS_IN_FLIGHT = Gauge(
+    'scoreengine_checks_in_flight',
+    'Checks being performed in this process.',
+)
+CHECK_TIMEOUTS = Counter(
+    'scoreengine_check_timeouts_total',
+    'Checks abandoned for running past their timeout.',
+    ['service', 'check'],
+)
+
+# Rounds
+ROUND_PHASE_DURATION = Histogram(
+    'scoreengine_round_phase_duration_seconds',
+    'Time taken by each phase of rounds (setup, checks, persist and total).',
+    ['round_type', 'phase'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60, 120),
+)
+CHECKS_AWAITED = Gauge(
+    'scoreengine_checks_awaited',
+    'Checks of rounds in flight whose result has not been received yet.',
+    ['round_type'],
+)
+
+# Database
+DB_WRITE_DURATION = Histogram(
+    'scoreengine_db_write_duration_seconds',
+    'Time taken to write batches of checks to the database.',
+)
+CHECKS_WRITTEN = Counter(
+    'scoreengine_checks_written_total',
+    'Checks written to the database.',
+)
+
+# Bank API
+PAYOUT_DURATION = Histogram(
+    'scoreengine_payout_duration_seconds',
+    'Time taken by requests to the Bank API.',
+)
+PAYOUTS = Counter(
+    'scoreengine_payouts_total',
+    'Payouts attempted, by result.',
+    ['result'],
+)
+PAYOUT_QUEUE_DEPTH = Gauge(
+    'scoreengine_payout_queue_depth',
+    'Payouts still to be sent.',
+)
+
+
+def _check_labels(data: dict) -> Dict[str, str]:
+    return dict(
+        service=data['service_name'],
+        check='{file_name}.{function_name}'.format(**data['check']),
+    )
+
+
+@contextmanager
+def track_check(data: dict):
+    """Measure performing a check (whose result is in ``data`` once done).
+
+    Checks that are cancelled or abandoned past their deadline are not
+    recorded, as they are recorded as timeouts (see :func:`record_check_timeout`).
+    """
+    CHECKS_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    completed = False
+    try:
+        yield
+        completed = True
+    finally:
+        CHECKS_IN_FLIGHT.dec()
+        if completed and not executors.is_abandoned():
+            record_check(data, time.perf_counter() - start)
+
+
+def record_check(data: dict, duration: float):
+    """Record a check that was performed (in this process or another one)."""
+    labels = _check_labels(data)
+    CHECK_DURATION.labels(**labels).observe(duration)
+    CHECKS.labels(result='passed' if data['passed'] else 'failed', **labels).inc()
+
+
+def record_check_timeout(data: dict):
+    CHECK_TIMEOUTS.labels(**_check_labels(data)).inc()
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port: int, host: Optional[str] = None) -> http.server.HTTPServer:
+    """Serve the metrics of this process from a background thread."""
+    server = http.server.ThreadingHTTPServer(
+        (host or get_metrics_config()['host'], port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info('Serving metrics on http://%s:%d/metrics', *server.server_address[:2])
+    return server
+
+
+def serve_from_worker_processes():
+    """Serve metrics from each prefork worker process, on consecutive ports."""
+    from celery.signals import worker_process_init
+
+    @worker_process_init.connect(weak=False)
+    def start_worker_process_server(**kwargs):
+        from billiard.process import current_process
+
+        index = getattr(current_process(), 'index', 0) or 0
+        start_server(get_metrics_config()['worker_port'] + index)
@@ -1,11 +1,49 @@
+from datetime import datetime
+
 import sqlalchemy as db
+from sqlalchemy import event
+from sqlalchemy.dialects.mysql import DATETIME, LONGTEXT
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from sqlalchemy.sql.functions import FunctionElement
+
+from scoreengine import compression
 
 
 Base = declarative_base()
 
+# Keep fractions of seconds (which MySQL drops by default)
+PreciseDateTime = db.DateTime().with_variant(DATETIME(fsp=6), 'mysql')
+
+
+class precise_now(FunctionElement):
+    """The database server's current time, with fractions of seconds.
+
+    ``modified`` columns are always set from this (rather than from Python's
+    clock), so that the Score Engine's changes and MySQL's ``ON UPDATE``
+    changes (see :func:`track_modifications`) are timed by the same clock.
+    """
+    type = db.DateTime()
+    name = 'precise_now'
+
+
+@compiles(precise_now)
+def _compile_precise_now(element, compiler, **kwargs):
+    return 'CURRENT_TIMESTAMP'
+
+
+@compiles(precise_now, 'mysql')
+def _compile_precise_now_mysql(element, compiler, **kwargs):
+    return 'CURRENT_TIMESTAMP(6)'
+
+
+@compiles(precise_now, 'sqlite')
+def _compile_precise_now_sqlite(element, compiler, **kwargs):
+    # In the format that SQLAlchemy stores (and reads) datetimes in
+    return "(STRFTIME('%Y-%m-%d %H:%M:%f000', 'now'))"
+
 
 class Round(Base):
     __tablename__ = 'rounds'
@@ -15,6 +53,8 @@ class Round(Base):
     completed = db.Column(db.Boolean, default=False)
     start = db.Column(db.DateTime, server_default=func.current_timestamp())
     finish = db.Column(db.DateTime)
+    # The config snapshot that the round's tasks refer to, if any
+    snapshot_version = db.Column(db.String(64))
 
     def __init__(self, number):
         self.number = number
@@ -27,6 +67,7 @@ class Team(Base):
     name = db.Column(db.String(191), unique=True)
     enabled = db.Column(db.Boolean, default=True)
     check_team = db.Column(db.Boolean, default=False)
+    modified = db.Column(PreciseDateTime, server_default=precise_now(), onupdate=precise_now())
 
     def __init__(self, name, check_team=None):
         self.name = name
@@ -47,6 +88,7 @@ class Service(Base):
     group = db.Column(db.String(191))
     check = db.Column(db.String(191))
     enabled = db.Column(db.Boolean, default=True)
+    modified = db.Column(PreciseDateTime, server_default=precise_now(), onupdate=precise_now())
 
     def __init__(self, name, group, check):
         self.name = name
@@ -70,6 +112,7 @@ class TeamService(Base):
     edit = db.Column(db.Boolean, default=False)
     hidden = db.Column(db.Boolean, default=False)
     order = db.Column(db.Integer, default=0)
+    modified = db.Column(PreciseDateTime, server_default=precise_now(), onupdate=precise_now())
 
     team = relationship('Team', lazy='joined')
     service = relationship('Service', lazy='joined')
@@ -87,16 +130,119 @@ class TeamService(Base):
             self.order = order
 
 
+def track_modifications(table: db.Table, connection):
+    """Have MySQL update the ``modified`` column of a table on every change.
+
+    Other databases only have it updated by the Score Engine itself, while
+    MySQL also catches changes made by other applications (such as teams
+    editing their data through the Inject Engine).
+    """
+    if connection.dialect.name != 'mysql':
+        return
+    connection.execute(
+        'ALTER TABLE {} MODIFY {} DATETIME(6) '
+        'DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)'.format(
+            connection.dialect.identifier_preparer.quote(table.name),
+            connection.dialect.identifier_preparer.quote('modified'),
+        )
+    )
+
+
+for _table in (Team.__table__, Service.__table__, TeamService.__table__):
+    event.listen(
+        _table, 'after_create',
+        lambda table, connection, **kwargs: track_modifications(table, connection),
+    )
+
+
 class Check(Base):
     __tablename__ = 'checks'
+    __table_args__ = (
+        db.Index('ix_checks_team_id_service_id_round', 'team_id', 'service_id', 'round'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     team_id = db.Column(db.Integer, db.ForeignKey('teams.id'))
     service_id = db.Column(db.Integer, db.ForeignKey('services.id'))
-    round = db.Column(db.Integer)
-    time = db.Column(db.DateTime, server_default=func.now())
+    round = db.Column(db.Integer, index=True)
+    time = db.Column(db.DateTime, server_default=func.now(), index=True)
     passed = db.Column(db.Boolean)
-    output = db.Column(db.Text)
+    raw_output = db.Column('output', db.Text)
+    compressed_output = db.Column(db.LargeBinary)
+    queued_at = db.Column(PreciseDateTime)
+    started_at = db.Column(PreciseDateTime)
+    finished_at = db.Column(PreciseDateTime)
+    duration = db.Column(db.Float)
+    phases = db.Column(db.Text)  # JSON object of phase durations
 
     team = relationship('Team')
     service = relationship('Service')
+
+    @property
+    def output(self):
+        if self.compressed_output is not None:
+            return compression.decompress_output(self.compressed_output)
+        return self.raw_output
+
+    @output.setter
+    def output(self, output):
+        self.raw_output = output
+        self.compressed_output = None
+
+
+class CheckSummary(Base):
+    __tablename__ = 'check_summaries'
+    __table_args__ = (
+        db.UniqueConstraint('team_id', 'service_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    team_id = db.Column(db.Integer, db.ForeignKey('teams.id'))
+    service_id = db.Column(db.Integer, db.ForeignKey('services.id'))
+    passes = db.Column(db.Integer, default=0)
+    failures = db.Column(db.Integer, default=0)
+    last_round = db.Column(db.Integer)
+    last_passed = db.Column(db.Boolean)
+
+    team = relationship('Team')
+    service = relationship('Service')
+
+
+class Overrun(Base):
+    __tablename__ = 'overruns'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(16))
+    round = db.Column(db.Integer)
+    time = db.Column(db.DateTime, server_default=func.now())
+    in_flight = db.Column(db.Integer)
+    action = db.Column(db.String(16))
+    delay = db.Column(db.Float, default=0)
+
+
+class ConfigSnapshot(Base):
+    __tablename__ = 'config_snapshots'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.String(64), unique=True)
+    data = db.Column(db.Text().with_variant(LONGTEXT(), 'mysql'))
+    created = db.Column(db.DateTime, server_default=func.now())
+
+    def __init__(self, version, data):
+        self.version = version
+        self.data = data
+
+
+class Payout(Base):
+    __tablename__ = 'payouts'
+
+    id = db.Column(db.Integer, primary_key=True)
+    team_id = db.Column(db.Integer, db.ForeignKey('teams.id'))
+    round = db.Column(db.Integer)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+    sent = db.Column(db.DateTime, index=True)
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+    team = relationship('Team')
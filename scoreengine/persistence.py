@@ -0,0 +1,360 @@
+from datetime import datetime
+import json
+import logging
+import math
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import and_, case, or_
+from sqlalchemy.sql import func
+
+from . import compression, config, metrics, models, utils
+
+
+logger = logging.getLogger(__name__)
+
+
+class CheckWriter:
+    """Persist check results in micro-batches as they are completed.
+
+    At most ``batch_size`` results are held in memory at a time. The round is
+    only marked as completed once the last batch has been written by
+    :meth:`close`. Each batch also updates the :class:`models.CheckSummary`
+    of its teams and services and, when the Bank API is enabled, queues a
+    :class:`models.Payout` for every passed check, in the same transaction.
+    """
+
+    def __init__(self, round_number: Optional[int], batch_size: int = 50,
+                 compress_output: bool = False):
+        self.round_number = round_number
+        self.batch_size = batch_size
+        self.compress_output = compress_output
+        self._batch = []
+        self._payouts = []
+
+    def add(self, result: dict):
+        if not result['official']:
+            return
+
+        check = dict(
+            team_id=result['team_id'],
+            service_id=result['service_id'],
+            round=result['round_number'],
+            passed=result['passed'],
+            **_get_timing(result)
+        )
+        output = '\n'.join(result['output'])
+        if self.compress_output:
+            check['compressed_output'] = compression.compress_output(output)
+        else:
+            check['raw_output'] = output
+        self._batch.append(check)
+        if result['passed'] and config['bank']['enabled']:
+            self._payouts.append(
+                dict(
+                    team_id=result['team_id'],
+                    round=result['round_number'],
+                    created=datetime.utcnow(),
+                )
+            )
+
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._batch:
+            return
+
+        logger.debug('Writing %d checks for round %s', len(self._batch), self.round_number)
+        with metrics.DB_WRITE_DURATION.time(), utils.session_scope() as session:
+            session.bulk_insert_mappings(models.Check, self._batch)
+            session.bulk_insert_mappings(models.Payout, self._payouts)
+            update_check_summaries(session, self._batch)
+        metrics.CHECKS_WRITTEN.inc(len(self._batch))
+        self._batch = []
+        self._payouts = []
+
+    def close(self):
+        self.flush()
+
+        if self.round_number is not None:
+            complete_round(self.round_number)
+
+
+def _get_timing(result: dict) -> dict:
+    """Convert the timing of a check's result (UNIX timestamps) for the database."""
+    timing = {
+        key: datetime.utcfromtimestamp(result[key]) if result.get(key) is not None else None
+        for key in ('queued_at', 'started_at', 'finished_at')
+    }
+    timing['duration'] = None
+    if result.get('started_at') is not None and result.get('finished_at') is not None:
+        timing['duration'] = result['finished_at'] - result['started_at']
+    timing['phases'] = json.dumps(result['phases']) if result.get('phases') else None
+    return timing
+
+
+class BackgroundCheckWriter(CheckWriter):
+    """Persist check results from many threads in batches.
+
+    Used by workers to write the results of the checks they perform
+    themselves. A batch is written once it has ``batch_size`` results, or at
+    the latest ``flush_interval`` seconds after the previous one.
+    """
+
+    def __init__(self, batch_size: int = 50, flush_interval: float = 1,
+                 compress_output: bool = False):
+        super().__init__(None, batch_size=batch_size, compress_output=compress_output)
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+
+        flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        flusher.start()
+
+    def add(self, result: dict):
+        with self._lock:
+            super().add(result)
+
+    def flush(self):
+        with self._lock:
+            super().flush()
+
+    def close(self):
+        self._closed.set()
+        self.flush()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Unable to write checks')
+
+
+def complete_round(round_number: int):
+    with utils.session_scope() as session:
+        round_obj = (session.query(models.Round)
+            .filter_by(number=round_number)
+            .first()
+        )
+        round_obj.completed = True
+        round_obj.finish = datetime.utcnow()
+
+
+def count_checks(round_number: int) -> int:
+    with utils.session_scope() as session:
+        return session.query(models.Check).filter_by(round=round_number).count()
+
+
+def drop_passed_output(last_round: int):
+    """Drop the output of passed checks up to (and including) a round."""
+    with utils.session_scope() as session:
+        query = (session.query(models.Check)
+            .filter(models.Check.round <= last_round)
+            .filter(models.Check.passed == True)  # noqa: E712
+            # Leave checks whose output was already dropped alone
+            .filter(or_(
+                models.Check.raw_output.isnot(None),
+                models.Check.compressed_output.isnot(None),
+            ))
+        )
+        return query.update(
+            {models.Check.raw_output: None, models.Check.compressed_output: None},
+            synchronize_session=False,
+        )
+
+
+def update_check_summaries(session, checks: Iterable[dict]):
+    """Add newly written checks to the summaries of their teams and services."""
+    summaries = {}
+    for check in checks:
+        summary = summaries.setdefault(
+            (check['team_id'], check['service_id']),
+            dict(passes=0, failures=0, last_round=None, last_passed=None),
+        )
+        summary['passes' if check['passed'] else 'failures'] += 1
+        if summary['last_round'] is None or check['round'] >= summary['last_round']:
+            summary['last_round'] = check['round']
+            summary['last_passed'] = check['passed']
+
+    table = models.CheckSummary.__table__
+    dialect_name = session.get_bind().dialect.name
+    for (team_id, service_id), summary in summaries.items():
+        # Rounds may overlap, so the last status is only replaced by a later
+        # one (MySQL assigns in order, so last_passed goes before last_round)
+        is_later = or_(
+            table.c.last_round.is_(None),
+            table.c.last_round <= summary['last_round'],
+        )
+        updates = [
+            ('passes', table.c.passes + summary['passes']),
+            ('failures', table.c.failures + summary['failures']),
+            ('last_passed', case(
+                [(is_later, summary['last_passed'])],
+                else_=table.c.last_passed,
+            )),
+            ('last_round', case(
+                [(is_later, summary['last_round'])],
+                else_=table.c.last_round,
+            )),
+        ]
+        values = dict(team_id=team_id, service_id=service_id, **summary)
+
+        if dialect_name in ('mysql', 'postgresql'):
+            # Writers may add the first checks of a team and service at once
+            session.execute(_upsert_check_summary(dialect_name, table, values, updates))
+            continue
+
+        # Elsewhere (SQLite), writers take turns, so the summary is still missing
+        # when it is inserted
+        result = session.execute(table
+            .update()
+            .where(and_(table.c.team_id == team_id, table.c.service_id == service_id))
+            .values(dict(updates))
+        )
+        if result.rowcount == 0:
+            session.execute(table.insert().values(**values))
+
+
+def _upsert_check_summary(dialect_name: str, table, values: dict, updates: list):
+    if dialect_name == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+
+        return insert(table).values(**values).on_duplicate_key_update(updates)
+
+    from sqlalchemy.dialects.postgresql import insert
+
+    return insert(table).values(**values).on_conflict_do_update(
+        index_elements=[table.c.team_id, table.c.service_id],
+        set_=dict(updates),
+    )
+
+
+def rebuild_check_summaries(session):
+    """Recompute the summaries of all teams and services from their checks."""
+    counts = (session
+        .query(
+            models.Check.team_id,
+            models.Check.service_id,
+            func.sum(case([(models.Check.passed, 1)], else_=0)),
+            func.sum(case([(models.Check.passed, 0)], else_=1)),
+        )
+        .group_by(models.Check.team_id, models.Check.service_id)
+    )
+    summaries = {
+        (team_id, service_id): dict(
+            team_id=team_id,
+            service_id=service_id,
+            passes=passes,
+            failures=failures,
+        )
+        for team_id, service_id, passes, failures in counts
+    }
+
+    last_rounds = (session
+        .query(
+            models.Check.team_id,
+            models.Check.service_id,
+            func.max(models.Check.round).label('round'),
+        )
+        .group_by(models.Check.team_id, models.Check.service_id)
+        .subquery()
+    )
+    last_checks = (session
+        .query(
+            models.Check.team_id,
+            models.Check.service_id,
+            models.Check.round,
+            models.Check.passed,
+        )
+        .join(last_rounds, and_(
+            models.Check.team_id == last_rounds.c.team_id,
+            models.Check.service_id == last_rounds.c.service_id,
+            models.Check.round == last_rounds.c.round,
+        ))
+        .order_by(models.Check.id)
+    )
+    for team_id, service_id, round_number, passed in last_checks:
+        summaries[team_id, service_id].update(last_round=round_number, last_passed=passed)
+
+    session.query(models.CheckSummary).delete()
+    session.bulk_insert_mappings(models.CheckSummary, list(summaries.values()))
+
+
+class Percentiles(NamedTuple):
+    p50: Optional[float]
+    p95: Optional[float]
+    p99: Optional[float]
+
+
+class TimingSummary(NamedTuple):
+    name: str
+    checks: int
+    duration: Percentiles
+    wait: Percentiles
+
+
+def summarize_check_timings(first_round: Optional[int] = None,
+                            last_round: Optional[int] = None,
+                            ) -> Tuple[List[TimingSummary], List[TimingSummary]]:
+    """Summarize how long checks took, per service and per team.
+
+    Both the duration of checks and the time they waited to be performed (for
+    a worker, or behind other checks) are summarized. Checks written before
+    timings were recorded are left out.
+
+    :return: The summaries per service, and those per team.
+    """
+    with utils.session_scope() as session:
+        query = (session
+            .query(
+                models.Service.name,
+                models.Team.name,
+                models.Check.duration,
+                models.Check.queued_at,
+                models.Check.started_at,
+            )
+            .join(models.Check.service)
+            .join(models.Check.team)
+            .filter(models.Check.duration.isnot(None))
+        )
+        if first_round is not None:
+            query = query.filter(models.Check.round >= first_round)
+        if last_round is not None:
+            query = query.filter(models.Check.round <= last_round)
+        rows = query.all()
+
+    by_service: Dict[str, tuple] = {}
+    by_team: Dict[str, tuple] = {}
+    for service_name, team_name, duration, queued_at, started_at in rows:
+        wait = None
+        if queued_at is not None and started_at is not None:
+            wait = max((started_at - queued_at).total_seconds(), 0)
+        for groups, name in ((by_service, service_name), (by_team, team_name)):
+            durations, waits = groups.setdefault(name, ([], []))
+            durations.append(duration)
+            if wait is not None:
+                waits.append(wait)
+
+    return _summarize_timings(by_service), _summarize_timings(by_team)
+
+
+def _summarize_timings(groups: Dict[str, tuple]) -> List[TimingSummary]:
+    return [
+        TimingSummary(name, len(durations), _percentiles(durations), _percentiles(waits))
+        for name, (durations, waits) in sorted(groups.items())
+    ]
+
+
+def _percentiles(values: List[float]) -> Percentiles:
+    if not values:
+        return Percentiles(None, None, None)
+
+    values = sorted(values)
+
+    def percentile(percent):
+        # Nearest-rank percentile
+        return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+    return Percentiles(percentile(50), percentile(95), percentile(99))
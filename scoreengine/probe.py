@@ -0,0 +1,82 @@
+"""Fast TCP reachability probes of the targets of a round.
+
+When a team's host is down or a service is stopped, its checks would each wait
+for their full timeout. Probing every target of the round at once, with a short
+timeout, lets the checks of targets that refuse connections (or that are
+reported unreachable) fail right away. Targets that do not answer the probe in
+time (filtered or slow) are left to their checks, which keep their own timeout.
+"""
+import asyncio
+import errno
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+
+from . import registry
+
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the target cannot be connected to at all
+UNREACHABLE_ERRNOS = frozenset((
+    errno.ECONNREFUSED,
+    errno.EHOSTUNREACH,
+    errno.ENETUNREACH,
+    errno.EHOSTDOWN,
+))
+
+Target = Tuple[str, int]
+
+
+def get_target(data: dict) -> Optional[Target]:
+    """Get the host and TCP port that a check connects to, if known."""
+    host = data['config'].get('HOST')
+    if not host:
+        return None
+
+    try:
+        check = registry.checks.get(**data['check'])
+    except (AttributeError, ImportError):
+        return None
+    if check.port is None:
+        return None
+    if not check.port_configurable:
+        # The check ignores any PORT in its config
+        return host, check.port
+
+    try:
+        return host, int(data['config'].get('PORT', check.port))
+    except ValueError:
+        return None
+
+
+def probe_targets(targets: Iterable[Target], timeout: float,
+                  concurrency: int = 1000) -> Dict[Target, OSError]:
+    """Try to connect to every target at once.
+
+    :return: The error of each target that could not be connected to.
+    """
+    targets = list(set(targets))
+    if not targets:
+        return {}
+    errors = asyncio.run(_probe_targets(targets, timeout, concurrency))
+    return {target: error for target, error in zip(targets, errors) if error is not None}
+
+
+async def _probe_targets(targets, timeout, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def probe(host, port) -> Optional[OSError]:
+        async with semaphore:
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+            except asyncio.TimeoutError:
+                return None
+            except OSError as e:
+                if e.errno in UNREACHABLE_ERRNOS:
+                    return e
+                # Such as a failure to resolve the host: up to the check
+                return None
+            writer.close()
+            return None
+
+    return await asyncio.gather(*(probe(host, port) for host, port in targets))
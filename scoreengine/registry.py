@@ -0,0 +1,170 @@
+"""Registry of the checks in :mod:`scoreengine.checks`."""
+import collections
+import importlib
+import inspect
+import logging
+import pkgutil
+import threading
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from scoreengine import config
+
+
+logger = logging.getLogger(__name__)
+
+CHECKS_PACKAGE = 'scoreengine.checks'
+
+
+class RegisteredCheck(NamedTuple):
+    file_name: str
+    function_name: str
+    function: Callable
+    async_function: Optional[Callable]
+    expectation: str
+    port: Optional[int]
+    port_configurable: bool
+
+
+class CheckRegistry:
+    """Map ``(file_name, function_name)`` to the check functions.
+
+    Every function decorated with :func:`checks.check_function` in a check
+    module is registered (along with its asyncio variant, if any) when the
+    module is first loaded, so looking up a check does not import anything.
+    Modules whose dependencies are missing are remembered as unavailable.
+
+    A check module may also define ``prepare_checks(task_descriptions)``,
+    which is given the checks of the module for a round before they are
+    performed in this process (see :meth:`prepare`).
+    """
+
+    def __init__(self):
+        self._checks: Dict[tuple, RegisteredCheck] = {}
+        self._prepare_functions: Dict[str, Callable] = {}
+        self._loaded_modules = set()
+        self._unknown_modules = set()
+        self._unavailable_modules: Dict[str, ImportError] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def unavailable_modules(self) -> Dict[str, ImportError]:
+        return dict(self._unavailable_modules)
+
+    def __iter__(self):
+        return iter(sorted(self._checks.values(), key=lambda check: check[:2]))
+
+    def load(self):
+        """Load every check module."""
+        package = importlib.import_module(CHECKS_PACKAGE)
+        for module_info in pkgutil.iter_modules(package.__path__):
+            self._load_module(module_info.name)
+
+    def get(self, file_name: str, function_name: str) -> RegisteredCheck:
+        try:
+            return self._checks[file_name, function_name]
+        except KeyError:
+            pass
+
+        # The module may not have been loaded yet
+        self._load_module(file_name)
+        try:
+            return self._checks[file_name, function_name]
+        except KeyError:
+            pass
+
+        if file_name in self._unavailable_modules:
+            raise self._unavailable_modules[file_name]
+        if file_name in self._unknown_modules:
+            raise ImportError('No check module named {!r}'.format(file_name))
+        raise AttributeError('Check module {!r} has no check named {!r}'.format(
+            file_name, function_name))
+
+    def prepare(self, task_descriptions: Iterable[dict]):
+        """Let the check modules prepare for the checks of a round, all at once."""
+        task_descriptions_by_module = collections.defaultdict(list)
+        for data in task_descriptions:
+            task_descriptions_by_module[data['check']['file_name']].append(data)
+
+        for file_name, module_task_descriptions in task_descriptions_by_module.items():
+            self._load_module(file_name)
+            prepare_checks = self._prepare_functions.get(file_name)
+            if prepare_checks is None:
+                continue
+            try:
+                prepare_checks(module_task_descriptions)
+            except Exception:
+                # The checks are still performed, without preparation
+                logger.exception('Unable to prepare %s checks', file_name)
+
+    def validate(self, services: Iterable[dict]) -> List[str]:
+        """Find the services (as configured) whose check does not exist.
+
+        Services whose check module is unavailable are not reported, as that
+        module may be available where the checks are performed.
+        """
+        problems = []
+        for service in services:
+            file_name, _, function_name = service['check'].partition('.')
+            try:
+                self.get(file_name, function_name)
+            except ImportError:
+                if file_name in self._unavailable_modules:
+                    continue
+                problems.append('Service {!r} has an unknown check module: {!r}'.format(
+                    service['name'], service['check']))
+            except AttributeError:
+                problems.append('Service {!r} has an unknown check: {!r}'.format(
+                    service['name'], service['check']))
+        return problems
+
+    def _load_module(self, file_name: str):
+        with self._lock:
+            if file_name in self._loaded_modules:
+                return
+            self._loaded_modules.add(file_name)
+
+            module_name = '{}.{}'.format(CHECKS_PACKAGE, file_name)
+            try:
+                module = importlib.import_module(module_name)
+            except ImportError as e:
+                if e.name == module_name:
+                    self._unknown_modules.add(file_name)
+                else:
+                    logger.warning('Checks in %r are unavailable: %s', file_name, e)
+                    self._unavailable_modules[file_name] = e
+                return
+
+            prepare_checks = getattr(module, 'prepare_checks', None)
+            if callable(prepare_checks):
+                self._prepare_functions[file_name] = prepare_checks
+
+            for name, value in vars(module).items():
+                if not inspect.isfunction(value) or name.endswith('_async'):
+                    continue
+                expectation = getattr(value, 'check_expectation', None)
+                if expectation is None:
+                    continue
+                self._checks[file_name, name] = RegisteredCheck(
+                    file_name,
+                    name,
+                    value,
+                    getattr(module, '{}_async'.format(name), None),
+                    expectation,
+                    getattr(value, 'check_port', None),
+                    getattr(value, 'check_port_configurable', False),
+                )
+
+
+checks = CheckRegistry()
+
+
+def load_checks() -> List[str]:
+    """Load every check, and validate the checks of the configured services.
+
+    :return: The problems with the configured services (which are logged).
+    """
+    checks.load()
+    problems = checks.validate(config['services'])
+    for problem in problems:
+        logger.error(problem)
+    return problems
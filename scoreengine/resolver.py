@@ -0,0 +1,227 @@
+"""Shared, cached resolution of the hosts that checks connect to.
+
+Without it, every check resolves its team's host on its own, so a round
+resolves the same names many times over (and a slow resolver slows every
+check). When enabled, the hosts of a round are resolved up front, all at once,
+and kept for as long as their records' TTL allows. Checks then connect to the
+cached addresses, as :func:`socket.getaddrinfo` (and
+:func:`socket.gethostbyname`) are answered from the cache for those hosts.
+
+The cache is per process: the runner fills it for the local engines, and each
+worker process fills its own. :func:`checks.dns.check_dns` is left out, as it
+must always query the team's server itself.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import ipaddress
+import logging
+import socket
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from dns.exception import DNSException
+from dns.resolver import Resolver
+
+from . import config
+
+
+# DEFAULTS
+dns_cache_config = {
+    'enabled': False,
+    'default_ttl': 60,
+    'max_ttl': 3600,
+    'negative_ttl': 10,
+    'timeout': 5,
+    'concurrency': 20,
+}
+# /DEFAULTS
+
+# CONFIG
+if 'dns_cache' in config:
+    dns_cache_config.update(config['dns_cache'])
+# /CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Groups of checks whose HOST must not be resolved through the cache
+UNCACHED_GROUPS = frozenset(('dns',))
+
+_original_getaddrinfo = socket.getaddrinfo
+_original_gethostbyname = socket.gethostbyname
+
+
+class ResolutionCache:
+    """Addresses of hosts, each kept until the TTL of its records expires.
+
+    Hosts are resolved with dnspython (which tells the TTL), or, failing that
+    (such as for names only in ``/etc/hosts``), with the system resolver and
+    kept for ``default_ttl`` seconds. No TTL is trusted for more than
+    ``max_ttl`` seconds. Hosts that cannot be resolved are remembered as such
+    for ``negative_ttl`` seconds (and lookups of them are not answered from
+    the cache, so checks report the error).
+    """
+
+    def __init__(self, default_ttl: float, max_ttl: float, negative_ttl: float,
+                 timeout: float):
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self._resolver: Optional[Resolver] = None
+        self._entries: Dict[str, Tuple[List[str], float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, host: str) -> Optional[List[str]]:
+        """Get the cached addresses of a host (none if it could not be
+        resolved), unless they have expired."""
+        entry = self._entries.get(host.lower())
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def resolve(self, host: str) -> Optional[List[str]]:
+        """Get the addresses of a host, resolving it if they are not cached."""
+        addresses = self.get(host)
+        if addresses is not None:
+            return addresses
+
+        addresses, ttl = self._lookup(host)
+        if not addresses:
+            ttl = self.negative_ttl
+        with self._lock:
+            self._entries[host.lower()] = addresses, time.monotonic() + min(ttl, self.max_ttl)
+        return addresses
+
+    def resolve_all(self, hosts: Iterable[str], concurrency: int) -> int:
+        """Resolve the hosts that are not cached, all at once.
+
+        :return: The number of hosts that were resolved.
+        """
+        hosts = [host for host in set(hosts) if self.get(host) is None]
+        if not hosts:
+            return 0
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(hosts))) as executor:
+            return sum(bool(addresses) for addresses in executor.map(self.resolve, hosts))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _get_resolver(self) -> Resolver:
+        # Only created when first needed, as creating one reads /etc/resolv.conf
+        with self._lock:
+            if self._resolver is None:
+                resolver = Resolver()
+                resolver.lifetime = self.timeout
+                self._resolver = resolver
+            return self._resolver
+
+    def _lookup(self, host: str) -> Tuple[List[str], float]:
+        try:
+            resolver = self._get_resolver()
+            resolve = getattr(resolver, 'resolve', None)
+            if resolve is not None:
+                answer = resolve(host, 'A', search=True)
+            else:  # dnspython < 2.0
+                answer = resolver.query(host, 'A')
+        except DNSException:
+            # Including a missing (or empty) /etc/resolv.conf
+            pass
+        else:
+            return [record.address for record in answer], answer.expiration - time.time()
+
+        try:
+            results = _original_getaddrinfo(host, None, proto=socket.IPPROTO_TCP)
+        except OSError as e:
+            logger.debug('Unable to resolve %r: %s', host, e)
+            return [], 0
+        addresses = []
+        for _, _, _, _, sockaddr in results:
+            if sockaddr[0] not in addresses:
+                addresses.append(sockaddr[0])
+        return addresses, self.default_ttl
+
+
+cache = ResolutionCache(
+    default_ttl=dns_cache_config['default_ttl'],
+    max_ttl=dns_cache_config['max_ttl'],
+    negative_ttl=dns_cache_config['negative_ttl'],
+    timeout=dns_cache_config['timeout'],
+)
+
+
+def _getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    addresses = cache.get(host) if isinstance(host, str) else None
+    if addresses:
+        results = []
+        for address in addresses:
+            try:
+                results.extend(_original_getaddrinfo(
+                    address, port, family, type, proto, flags | socket.AI_NUMERICHOST))
+            except socket.gaierror:
+                # Such as an IPv6 address when only IPv4 is wanted
+                continue
+        if results:
+            return results
+    return _original_getaddrinfo(host, port, family, type, proto, flags)
+
+
+def _gethostbyname(host):
+    for address in cache.get(host) or ():
+        if ipaddress.ip_address(address).version == 4:
+            return address
+    return _original_gethostbyname(host)
+
+
+_install_lock = threading.Lock()
+
+
+def install():
+    """Answer lookups of cached hosts from the cache, in this process (if enabled)."""
+    if not dns_cache_config['enabled']:
+        return
+    with _install_lock:
+        if socket.getaddrinfo is not _getaddrinfo:
+            socket.getaddrinfo = _getaddrinfo
+            socket.gethostbyname = _gethostbyname
+
+
+def get_host(data: dict) -> Optional[str]:
+    """Get the host name that a check resolves, if it should be cached."""
+    if data['check']['file_name'] in UNCACHED_GROUPS:
+        return None
+
+    host = data['config'].get('HOST')
+    if not host or not isinstance(host, str):
+        return None
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return host.lower()
+    return None
+
+
+def get_hosts(task_descriptions: Iterable[dict]) -> Set[str]:
+    hosts = (get_host(data) for data in task_descriptions)
+    return {host for host in hosts if host is not None}
+
+
+def prepare(task_descriptions: Iterable[dict]):
+    """Resolve the hosts of the checks all at once, and use the cache."""
+    install()
+    hosts = [host for host in get_hosts(task_descriptions) if cache.get(host) is None]
+    if not hosts:
+        return
+
+    start = time.perf_counter()
+    resolved = cache.resolve_all(hosts, dns_cache_config['concurrency'])
+    logger.info('Resolved %d of %d check hosts in %.3f seconds',
+                resolved, len(hosts), time.perf_counter() - start)
+
+
+def prepare_check(data: dict):
+    """Make sure the host of a check is cached (when not prepared with its round)."""
+    host = get_host(data)
+    if host is not None:
+        install()
+        cache.resolve(host)
@@ -1,24 +1,70 @@
 from collections import namedtuple
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future
 from datetime import datetime
+import functools
+import itertools
 import logging
+import queue
 import random
 import signal
+import socket
 import sys
 import threading
 import time
 import typing
 
-import celery
-import requests
-
-from . import config, models, tasks, utils
+from celery import states
+from celery.backends.database import DatabaseBackend
+from celery.exceptions import TimeoutError as ResultTimeoutError
+from celery.result import ResultSet
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import (
+    bank, config, engine, executors, metrics, models, persistence, probe, registry, resolver,
+    tasks, utils,
+)
+
+
+# DEFAULTS
+runner_config = {
+    'batch_size': 50,
+    'check_timeout': 30,
+    'engine': 'threads',
+    'async_concurrency': 1000,
+    'pools': {},
+    'process_pools': {},
+    'host_concurrency': None,
+    'dispatch_window': 0,
+    'dispatch_jitter': False,
+    'max_concurrent_rounds': None,
+    'max_concurrent_traffic': None,
+    'overrun_policy': 'delay',
+    'compact_tasks': False,
+    'worker_persistence': False,
+    'flush_interval': 1,
+    'completion_timeout': 60,
+    'snapshot_cache': True,
+    'snapshot_retention': 10,
+    'compress_output': False,
+    'output_retention': None,
+    'poll_interval': 0.5,
+    'probe_timeout': None,
+}
+# /DEFAULTS
+
+# CONFIG
+if 'runner' in config:
+    runner_config.update(config['runner'])
+# /CONFIG
 
 
 SleepRange = namedtuple('SleepRange', ['minimum', 'maximum'])
 
 logger = logging.getLogger(__name__)
 
+# Processes for CPU-bound groups of checks, which are kept across rounds
+process_pools = executors.ProcessPools(runner_config['process_pools'])
+
 
 class Runner:
 
@@ -30,6 +76,15 @@ class Runner:
             config['round']['duration'] + config['round']['jitter'],
         )
 
+        # Spread dispatching checks over part of the round, while leaving enough
+        # time for the last check to time out before the next round starts
+        self.dispatch_window = max(0, min(
+            runner_config['dispatch_window'] * self.sleep_range.minimum,
+            self.sleep_range.minimum - runner_config['check_timeout'],
+        ))
+        if runner_config['dispatch_window'] and not self.dispatch_window:
+            logger.warning('Rounds are too short to spread dispatching checks over them')
+
         # Gracefully handle Ctrl+C
         self.no_more_rounds = False
         signal.signal(signal.SIGINT, self.shutdown)
@@ -45,6 +100,12 @@ class Runner:
             self.no_more_rounds = True
 
     def run(self, use_task_queue):
+        if use_task_queue and runner_config['host_concurrency']:
+            logger.warning('runner.host_concurrency is not enforced with the task queue')
+
+        if config['bank']['enabled']:
+            bank.PayoutSender().start()
+
         traffic_generator = threading.Thread(
             target=self.generate_traffic,
             args=(use_task_queue,),
@@ -54,34 +115,190 @@ class Runner:
         self.perform_scoring(use_task_queue)
 
     def generate_traffic(self, use_task_queue):
+        limiter = InFlightLimiter(
+            'traffic',
+            runner_config['max_concurrent_traffic'],
+            runner_config['overrun_policy'],
+            should_stop=lambda: self.no_more_rounds,
+        )
+
         while not self.no_more_rounds:
             logger.debug('Starting traffic generation cycle')
 
-            round_thread = threading.Thread(
-                target=perform_round_checks,
-                args=(None, use_task_queue, config['trafficgen']['number']),
+            limiter.start(
+                perform_round_checks,
+                None, use_task_queue, config['trafficgen']['number'],
             )
-            round_thread.start()
 
             logger.debug('Traffic generation cycle complete')
             time.sleep(config['trafficgen']['sleep'])
 
     def perform_scoring(self, use_task_queue):
+        limiter = InFlightLimiter(
+            'round',
+            runner_config['max_concurrent_rounds'],
+            runner_config['overrun_policy'],
+            should_stop=lambda: self.no_more_rounds,
+        )
+
         while not self.no_more_rounds:
             logger.debug('Preparing to start round %d', self.current_round)
 
-            round_thread = threading.Thread(
-                target=perform_round_checks,
-                args=(self.current_round, use_task_queue),
+            started = limiter.start(
+                perform_round_checks,
+                self.current_round, use_task_queue,
+                dispatch_window=self.dispatch_window,
+                round_number=self.current_round,
             )
-            round_thread.start()
 
             sleep_duration = random.randint(
                 self.sleep_range.minimum, self.sleep_range.maximum)
             logger.debug('Sleeping for %d seconds until the next round', sleep_duration)
             time.sleep(sleep_duration)
 
-            self.current_round += 1
+            if started:
+                self.current_round += 1
+
+
+class InFlightLimiter:
+    """Bound the number of rounds (or traffic generation cycles) in flight.
+
+    Starting one while others are still in flight is an overrun, which is
+    logged and recorded as a :class:`models.Overrun`. Once ``maximum`` are in
+    flight, the overrun policy either delays starting another until one
+    finishes (``delay``) or skips it (``skip``). A delayed start is given up
+    once ``should_stop()`` returns true, so that a stuck round cannot keep
+    the runner from shutting down.
+    """
+
+    # How often (in seconds) a delayed start checks whether to stop
+    STOP_INTERVAL = 1.0
+
+    def __init__(self, kind: str, maximum: typing.Optional[int], policy: str,
+                 should_stop: typing.Callable[[], bool] = lambda: False):
+        if policy not in {'delay', 'skip'}:
+            raise ValueError('Unknown overrun policy: {!r}'.format(policy))
+
+        self.kind = kind
+        self.maximum = maximum
+        self.policy = policy
+        self.should_stop = should_stop
+
+        self._condition = threading.Condition()
+        self._in_flight = 0
+
+    def start(self, target: typing.Callable, *args,
+              round_number: typing.Optional[int] = None, **kwargs) -> bool:
+        """Start the target on a new thread, unless the policy skips it.
+
+        :return: Whether the target was started (it is not when skipped, or
+                 when given up on as the runner is stopping).
+        """
+        action = None
+        delay = 0.0
+        with self._condition:
+            in_flight = self._in_flight
+            if in_flight:
+                action = 'concurrent'
+
+            if self.maximum is not None and in_flight >= self.maximum:
+                if self.policy == 'skip':
+                    action = 'skipped'
+                else:
+                    action = 'delayed'
+                    delay_start = time.monotonic()
+                    while self._in_flight >= self.maximum:
+                        if self.should_stop():
+                            return False
+                        self._condition.wait(self.STOP_INTERVAL)
+                    delay = time.monotonic() - delay_start
+
+            if action != 'skipped':
+                self._in_flight += 1
+
+        if action is not None:
+            self._record_overrun(round_number, in_flight, action, delay)
+        if action == 'skipped':
+            return False
+
+        thread = threading.Thread(
+            target=self._run,
+            args=(target,) + args,
+            kwargs=kwargs,
+        )
+        thread.start()
+        return True
+
+    def _run(self, target: typing.Callable, *args, **kwargs):
+        try:
+            target(*args, **kwargs)
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    def _record_overrun(self, round_number, in_flight, action, delay):
+        logger.warning(
+            'Overrun: %s %s%s with %d still in flight (%s%s)',
+            self.kind,
+            '' if round_number is None else '{} '.format(round_number),
+            'started' if action != 'skipped' else 'not started',
+            in_flight,
+            action,
+            ' for {:.1f} seconds'.format(delay) if action == 'delayed' else '',
+        )
+
+        try:
+            with utils.session_scope() as session:
+                session.add(models.Overrun(
+                    kind=self.kind,
+                    round=round_number,
+                    in_flight=in_flight,
+                    action=action,
+                    delay=delay,
+                ))
+        except SQLAlchemyError as e:
+            logger.error('Unable to record the overrun: %s', e)
+
+
+class SnapshotCache:
+    """Keep the snapshot of the teams, services and their data between rounds.
+
+    Teams, services and their data seldom change during a competition, so
+    they are only loaded again when the change marker of the database (see
+    :func:`utils.get_change_marker`) differs from when they were last loaded.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, session, service_ids, team_ids, only_enabled: bool = True,
+            publish: bool = False) -> typing.Tuple[dict, typing.Optional[str]]:
+        """Get the snapshot, and its version if it is to be published."""
+        key = (tuple(sorted(service_ids or ())), tuple(sorted(team_ids or ())), only_enabled)
+        marker = utils.get_change_marker(session)
+
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry['marker'] != marker:
+            logger.debug('Loading teams, services and their data')
+            services = _get_check_services(session, service_ids, only_enabled=only_enabled)
+            teams = _get_check_teams(session, team_ids, only_enabled=only_enabled)
+            entry = dict(
+                marker=marker,
+                snapshot=utils.build_snapshot(session, teams, services),
+                version=None,
+            )
+            with self._lock:
+                self._entries[key] = entry
+
+        if publish and entry['version'] is None:
+            entry['version'] = utils.publish_snapshot(session, entry['snapshot'])
+        return entry['snapshot'], entry['version'] if publish else None
+
+
+snapshot_cache = SnapshotCache()
 
 
 def _get_check_services(session, service_ids, only_enabled=True):
@@ -102,6 +319,296 @@ def _get_check_teams(session, team_ids, only_enabled=True):
     return query.all()
 
 
+def get_queue_name(group: str) -> typing.Optional[str]:
+    """Get the name of the task queue dedicated to a group's pool (if any)."""
+    if group not in runner_config['pools']:
+        return None
+    return 'checks.{}'.format(group)
+
+
+class DispatchPacer:
+    """Spread dispatching checks over a window of time.
+
+    The window is split into one slot per check, and each check is scheduled
+    at the start of its slot (or at a random time within it, with jitter).
+    How far behind schedule checks start is tracked in :attr:`max_lag`.
+    """
+
+    def __init__(self, number_of_checks: int, window: float = 0, jitter: bool = False):
+        self.window = window
+        self.max_lag = 0.0
+        self.start = time.monotonic()
+
+        slot = window / number_of_checks if number_of_checks else 0
+        self._offsets = [
+            (index + (random.random() if jitter else 0)) * slot
+            for index in range(number_of_checks)
+        ]
+
+    def begin(self):
+        self.start = time.monotonic()
+
+    def delay(self, index: int) -> float:
+        """Get the number of seconds until a check should be dispatched."""
+        return max(0.0, self.start + self._offsets[index] - time.monotonic())
+
+    def record_start(self, index: int):
+        lag = time.monotonic() - (self.start + self._offsets[index])
+        self.max_lag = max(self.max_lag, lag)
+
+    def paced(self, items: typing.Iterable):
+        self.begin()
+        for index, item in enumerate(items):
+            time.sleep(self.delay(index))
+            yield index, item
+
+
+def _build_check_tasks(task_descriptions, snapshot_version: typing.Optional[str] = None,
+                       store: bool = False):
+    """Build the Celery tasks that perform the checks.
+
+    Checks of services whose group has a pool configured are sent to that
+    pool's dedicated queue (see :func:`get_queue_name`). With a snapshot
+    version, tasks only refer to the published config snapshot instead of
+    carrying the whole task description. Tasks that store their results have
+    workers write them to the database, instead of returning them.
+    """
+    check_tasks = []
+    for data in task_descriptions:
+        if snapshot_version is None:
+            check_task = (tasks.store_check_task if store else tasks.check_task).s(data)
+        else:
+            check_task = (
+                tasks.store_check_snapshot_task if store else tasks.check_snapshot_task
+            ).s(data['round_number'], data['team_id'], data['service_id'], snapshot_version)
+
+        queue_name = get_queue_name(data['check']['file_name'])
+        if queue_name is not None:
+            check_task.set(queue=queue_name)
+        check_tasks.append(check_task)
+    return check_tasks
+
+
+def _iter_task_queue_results(task_descriptions, pacer: DispatchPacer,
+                             snapshot_version: typing.Optional[str] = None):
+    """Yield the results of checks performed by Celery in order of completion.
+
+    Result backends that can wait for many results at once (such as Redis) are
+    waited on for every pending result together. Others (such as a database)
+    are asked which of the pending results are ready in one query every
+    ``poll_interval`` seconds.
+    """
+    check_tasks = _build_check_tasks(task_descriptions, snapshot_version)
+    backend = tasks.check_task.backend
+
+    dispatched = queue.Queue()
+
+    def dispatch():
+        try:
+            for index, check_task in pacer.paced(check_tasks):
+                pacer.record_start(index)
+                dispatched.put(check_task.apply_async(kwargs=dict(queued_at=time.time())))
+        except Exception as e:
+            dispatched.put(e)
+
+    dispatcher = threading.Thread(target=dispatch, daemon=True)
+    dispatcher.start()
+
+    pending = {}
+    remaining = len(check_tasks)
+    while remaining:
+        # Wait for a check to be dispatched when none are pending
+        while not pending or not dispatched.empty():
+            async_result = dispatched.get()
+            if isinstance(async_result, Exception):
+                raise async_result
+            pending[async_result.id] = async_result
+
+        if backend.supports_native_join:
+            ready = _wait_for_ready_tasks(
+                list(pending.values()), runner_config['poll_interval'])
+        else:
+            ready = _get_ready_task_ids(backend, list(pending.values()))
+        for task_id in ready:
+            remaining -= 1
+            yield pending.pop(task_id).get()
+        if remaining and not backend.supports_native_join:
+            time.sleep(runner_config['poll_interval'])
+
+
+def _wait_for_ready_tasks(async_results, timeout: float) -> typing.Iterator[str]:
+    """Yield the IDs of tasks as their results arrive, for up to ``timeout`` seconds."""
+    try:
+        for task_id, _ in ResultSet(async_results).iter_native(timeout=timeout):
+            yield task_id
+    except (ResultTimeoutError, socket.timeout):
+        return
+
+
+def _get_ready_task_ids(backend, async_results) -> typing.Set[str]:
+    """Get the IDs of the tasks that have a result.
+
+    A database result backend is asked about all of them in one query, and
+    other backends about each task.
+    """
+    if not isinstance(backend, DatabaseBackend):
+        return {async_result.id for async_result in async_results if async_result.ready()}
+
+    task_cls = backend.task_cls
+    session = backend.ResultSession()
+    try:
+        return {
+            task_id
+            for task_id, in (session
+                .query(task_cls.task_id)
+                .filter(task_cls.task_id.in_([async_result.id for async_result in async_results]))
+                .filter(task_cls.status.in_(states.READY_STATES))
+            )
+        }
+    finally:
+        session.close()
+
+
+def _perform_stored_checks(task_descriptions, pacer: DispatchPacer, round_number: int,
+                           snapshot_version: typing.Optional[str] = None):
+    """Have Celery workers perform checks and write their results themselves.
+
+    Completion is tracked by counting the round's checks in the database.
+    """
+    for index, check_task in pacer.paced(
+            _build_check_tasks(task_descriptions, snapshot_version, store=True)):
+        pacer.record_start(index)
+        check_task.apply_async(kwargs=dict(queued_at=time.time()))
+
+    deadline = time.monotonic() + runner_config['completion_timeout']
+    while True:
+        completed = persistence.count_checks(round_number)
+        if completed >= len(task_descriptions):
+            break
+        if time.monotonic() > deadline:
+            logger.warning(
+                'Round %d is missing %d of %d checks',
+                round_number,
+                len(task_descriptions) - completed,
+                len(task_descriptions),
+            )
+            break
+        time.sleep(runner_config['poll_interval'])
+
+
+def _perform_check(data, pacer: DispatchPacer, index: int):
+    pacer.record_start(index)
+    if data['check']['file_name'] in process_pools:
+        return tasks.perform_check_in_process(
+            process_pools, data, runner_config['check_timeout'])
+    return tasks.check_task.apply(args=(data,)).get()
+
+
+def _get_pool_sizes() -> typing.Dict[str, int]:
+    """Get the number of checks of each group that are performed at once.
+
+    Checks that run in a process pool are waited for by as many threads as
+    there are processes, unless the group also has a pool of its own.
+    """
+    return dict(runner_config['process_pools'], **runner_config['pools'])
+
+
+def _iter_thread_pool_results(task_descriptions, pacer: DispatchPacer):
+    """Yield the results of checks performed locally in order of completion.
+
+    Checks that run past ``runner.check_timeout`` are abandoned and reported as
+    failed, so that a hung service cannot hold a worker forever. Checks that
+    run in a process pool are timed from when a process picks them up instead.
+    """
+    # Tasks are bound to the app on first use, which is not thread-safe
+    tasks.check_task.app.finalize(auto=True)
+
+    timeout = runner_config['check_timeout']
+    executor = executors.DeadlineExecutor(
+        max_workers=config['celery']['worker']['concurrency'],
+        deadline=timeout,
+        pool_sizes=_get_pool_sizes(),
+        max_per_host=runner_config['host_concurrency'],
+    )
+    completed = queue.Queue()
+
+    def dispatch():
+        try:
+            for index, data in pacer.paced(task_descriptions):
+                if executor.is_shutdown:
+                    # The round was aborted
+                    return
+                data['queued_at'] = time.time()
+                future = executor.submit(
+                    _perform_check,
+                    tasks.copy_check_data(data),
+                    pacer,
+                    index,
+                    pool=data['check']['file_name'],
+                    host=data['config'].get('HOST'),
+                    on_timeout=functools.partial(tasks.timed_out_check, data, timeout),
+                    timed=data['check']['file_name'] not in process_pools,
+                )
+                future.add_done_callback(completed.put)
+        except Exception as e:
+            # Fail the round, instead of waiting for checks that were never dispatched
+            failed = Future()
+            failed.set_exception(e)
+            completed.put(failed)
+
+    with executor:
+        dispatcher = threading.Thread(target=dispatch, daemon=True)
+        dispatcher.start()
+
+        for _ in task_descriptions:
+            yield completed.get().result()
+
+
+def _skip_unreachable_targets(task_descriptions):
+    """Probe the targets of the checks, and fail those that cannot be connected to.
+
+    :return: The checks still to be performed, and the results of those that
+             were failed.
+    """
+    targets = [probe.get_target(data) for data in task_descriptions]
+    errors = probe.probe_targets(
+        (target for target in targets if target is not None),
+        timeout=runner_config['probe_timeout'],
+        concurrency=runner_config['async_concurrency'],
+    )
+
+    remaining = []
+    unreachable_results = []
+    for data, target in zip(task_descriptions, targets):
+        if target in errors:
+            unreachable_results.append(tasks.unreachable_check(data, *target, errors[target]))
+        else:
+            remaining.append(data)
+
+    if errors:
+        logger.info(
+            'Failing %d checks of %d unreachable targets without performing them',
+            len(unreachable_results),
+            len(errors),
+        )
+    return remaining, unreachable_results
+
+
+def _await_results(results: typing.Iterable[dict], number_of_checks: int,
+                   round_type: str) -> typing.Iterator[dict]:
+    """Track how many results of a round have not been received yet."""
+    awaited = metrics.CHECKS_AWAITED.labels(round_type=round_type)
+    awaited.inc(number_of_checks)
+    remaining = number_of_checks
+    try:
+        for result in results:
+            remaining -= 1
+            awaited.dec()
+            yield result
+    finally:
+        awaited.dec(remaining)
+
+
 def perform_round_checks(
     current_round: typing.Optional[int],
     use_task_queue: bool,
@@ -109,6 +616,7 @@ def perform_round_checks(
     only_enabled: bool = True,
     service_ids: typing.Optional[typing.Tuple] = None,
     team_ids: typing.Optional[typing.Tuple] = None,
+    dispatch_window: float = 0,
 ):
     """Schedule checks for the specified round.
 
@@ -118,93 +626,154 @@ def perform_round_checks(
     :param only_enabled: Only consider enabled services and enabled teams.
     :param service_ids: If specified, limit checks to only the specified services.
     :param team_ids: If specified, limit checks to only the specified teams.
-    :return: The result of the performed checks.
+    :param dispatch_window: Spread dispatching checks over this many seconds.
+    :return: The results of the performed checks, unless this is an official
+             round (whose results are streamed to the database instead).
     """
     is_official_round = current_round is not None
+    round_type = 'official' if is_official_round else 'unofficial'
+    round_start = time.perf_counter()
 
     logger.info('Starting round %s', current_round if is_official_round else '\b')
 
     with utils.session_scope() as session:
         if is_official_round:
-            session.add(models.Round(current_round))
+            round_obj = models.Round(current_round)
+            session.add(round_obj)
             session.commit()
 
-        services = _get_check_services(session, service_ids, only_enabled=only_enabled)
-        teams = _get_check_teams(session, team_ids, only_enabled=only_enabled)
-        check_tasks = [
-            tasks.check_task.s(
-                utils.serialize_check(session, team, service, current_round)
-            )
-            for team in teams
-            for service in services
-        ]
+        publish = use_task_queue and runner_config['compact_tasks']
+        if runner_config['snapshot_cache']:
+            snapshot, snapshot_version = snapshot_cache.get(
+                session, service_ids, team_ids, only_enabled=only_enabled, publish=publish)
+        else:
+            services = _get_check_services(session, service_ids, only_enabled=only_enabled)
+            teams = _get_check_teams(session, team_ids, only_enabled=only_enabled)
+            snapshot = utils.build_snapshot(session, teams, services)
 
-    random.shuffle(check_tasks)
-    if max_checks is not None:
-        check_tasks = check_tasks[:max_checks]
+            snapshot_version = None
+            if publish:
+                snapshot_version = utils.publish_snapshot(session, snapshot)
 
-    if use_task_queue:
-        round_group = celery.group(check_tasks)
-        promise = round_group.apply_async()
-        results = promise.get()
-    else:
-        with ThreadPoolExecutor(max_workers=config['celery']['worker']['concurrency']) as executor:
-            futures = [
-                executor.submit(check_task.apply)
-                for check_task in check_tasks
-            ]
-            results = [
-                future.result().get()
-                for future in futures
-            ]
-
-    for result in results:
-        # TODO: get team and service names instead of IDs
-        logger.debug(
-            'Check %(status)s: round %(round)s, team ID %(team)d, service ID %(service)d',
-            {
-                'status': 'passed' if result['passed'] else 'failed',
-                'round': result['round_number'],
-                'team': result['team_id'],
-                'service': result['service_id'],
-            },
-        )
+        if is_official_round and snapshot_version is not None:
+            round_obj.snapshot_version = snapshot_version
+            session.commit()
 
-    if is_official_round:
-        with utils.session_scope() as session:
-            for result in results:
-                if not result['official']:
-                    continue
-                session.add(
-                    models.Check(
-                        team_id=result['team_id'],
-                        service_id=result['service_id'],
-                        round=result['round_number'],
-                        passed=result['passed'],
-                        output='\n'.join(result['output']),
-                    )
-                )
+            # Snapshots of earlier rounds are kept for workers still performing their checks
+            pruned = utils.prune_snapshots(
+                session, current_round - runner_config['snapshot_retention'], snapshot_version)
+            if pruned:
+                logger.debug('Deleted %d config snapshots that are no longer used', pruned)
+
+    task_descriptions = utils.serialize_checks_from_snapshot(snapshot, current_round)
+    random.shuffle(task_descriptions)
+    if max_checks is not None:
+        task_descriptions = task_descriptions[:max_checks]
+    number_of_checks = len(task_descriptions)
+
+    # Before probing, which connects to the same hosts
+    if resolver.dns_cache_config['enabled']:
+        resolver.prepare(task_descriptions)
+
+    unreachable_results = []
+    if runner_config['probe_timeout']:
+        task_descriptions, unreachable_results = _skip_unreachable_targets(task_descriptions)
+
+    if not use_task_queue and not dispatch_window:
+        # Such as sending all ICMP echo requests at once (which would not help
+        # checks that are spread over the round, or performed in other processes)
+        registry.checks.prepare(
+            data for data in task_descriptions
+            if data['check']['file_name'] not in process_pools
+        )
 
-            round_obj = (session.query(models.Round)
-                .filter_by(number=current_round)
-                .first()
+    writer = persistence.CheckWriter(
+        current_round if is_official_round else None,
+        batch_size=runner_config['batch_size'],
+        compress_output=runner_config['compress_output'],
+    )
+    results = []
+
+    checks_start = time.perf_counter()
+    metrics.ROUND_PHASE_DURATION.labels(round_type=round_type, phase='setup').observe(
+        checks_start - round_start)
+
+    pacer = DispatchPacer(
+        len(task_descriptions), dispatch_window, jitter=runner_config['dispatch_jitter'])
+
+    workers_store_results = (
+        use_task_queue and is_official_round and runner_config['worker_persistence'])
+
+    if workers_store_results:
+        _perform_stored_checks(task_descriptions, pacer, current_round, snapshot_version)
+        completed_results = ()
+    elif use_task_queue:
+        completed_results = _iter_task_queue_results(task_descriptions, pacer, snapshot_version)
+    elif runner_config['engine'] == 'asyncio':
+        completed_results = engine.iter_results(
+            task_descriptions,
+            pacer=pacer,
+            concurrency=runner_config['async_concurrency'],
+            thread_concurrency=config['celery']['worker']['concurrency'],
+            timeout=runner_config['check_timeout'],
+            pool_sizes=_get_pool_sizes(),
+            max_per_host=runner_config['host_concurrency'],
+            process_pools=process_pools,
+        )
+    else:
+        completed_results = _iter_thread_pool_results(task_descriptions, pacer)
+
+    completed_results = _await_results(
+        itertools.chain(unreachable_results, completed_results), number_of_checks, round_type)
+    try:
+        for result in completed_results:
+            # TODO: get team and service names instead of IDs
+            logger.debug(
+                'Check %(status)s: round %(round)s, team ID %(team)d, service ID %(service)d',
+                {
+                    'status': 'passed' if result['passed'] else 'failed',
+                    'round': result['round_number'],
+                    'team': result['team_id'],
+                    'service': result['service_id'],
+                },
             )
-            round_obj.completed = True
-            round_obj.finish = datetime.utcnow()
 
-            session.commit()
+            if is_official_round:
+                writer.add(result)
+            else:
+                results.append(result)
+    finally:
+        # Even if the round failed part way, keep the checks it did perform
+        # (and complete it)
+        if is_official_round:
+            writer.close()
+
+    persist_start = time.perf_counter()
+    metrics.ROUND_PHASE_DURATION.labels(round_type=round_type, phase='checks').observe(
+        persist_start - checks_start)
+
+    if dispatch_window:
+        logger.log(
+            logging.WARNING if pacer.max_lag > 1 else logging.INFO,
+            'Round %s dispatched %d checks over %.1f seconds (up to %.1f seconds behind schedule)',
+            current_round if is_official_round else '\b',
+            len(task_descriptions),
+            dispatch_window,
+            pacer.max_lag,
+        )
 
-        if config['bank']['enabled']:
-            for result in results:
-                if result['passed']:
-                    requests.post(
-                        config['bank']['url'],
-                        data={
-                            'username': config['bank']['username'],
-                            'password': config['bank']['password'],
-                            'team': result['team_id'],
-                        },
-                    )
+    if is_official_round:
+        retention = runner_config['output_retention']
+        if retention is not None and current_round > retention:
+            # Also earlier rounds that were missed, such as those from before
+            # retention was turned on
+            persistence.drop_passed_output(current_round - retention)
+
+    round_end = time.perf_counter()
+    metrics.ROUND_PHASE_DURATION.labels(round_type=round_type, phase='persist').observe(
+        round_end - persist_start)
+    metrics.ROUND_PHASE_DURATION.labels(round_type=round_type, phase='total').observe(
+        round_end - round_start)
 
     logger.info('Completed round %s', current_round if is_official_round else '\b')
 
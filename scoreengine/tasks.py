@@ -1,15 +1,87 @@
-import importlib
+import collections
+from contextlib import contextmanager
+import copy
+import json
 import logging
-from typing import Union
+import os
+import threading
+import time
+from typing import Optional, Union
 
-from . import celery_app
+from celery.signals import worker_process_shutdown, worker_shutdown
+
+from . import celery_app, metrics, models, persistence, registry, resolver, utils
 
 
 logger = logging.getLogger(__name__)
 
 
+# Keys of the result of a check that are returned by check_snapshot_task
+COMPACT_RESULT_KEYS = (
+    'official', 'output', 'passed', 'round_number', 'service_id', 'team_id',
+    'queued_at', 'started_at', 'finished_at', 'phases',
+)
+
+# Number of config snapshots that workers keep in memory
+SNAPSHOT_CACHE_SIZE = 4
+
+
+# Tasks take the time at which they were queued (as a UNIX timestamp), so that
+# the time spent waiting for a worker can be told apart from the check's own
+@celery_app.task(soft_time_limit=30)
+def check_task(data, queued_at: Optional[float] = None):
+    return _perform_check(data, queued_at)
+
+
 @celery_app.task(soft_time_limit=30)
-def check_task(data):
+def check_snapshot_task(round_number, team_id, service_id, snapshot_version,
+                        queued_at: Optional[float] = None):
+    """Perform a check that is described by a published config snapshot.
+
+    Only the compact result (without the check's config) is returned.
+    """
+    snapshot = _get_snapshot(snapshot_version)
+    data = utils.serialize_check_from_snapshot(snapshot, team_id, service_id, round_number)
+    _perform_check(data, queued_at)
+    return {key: data.get(key) for key in COMPACT_RESULT_KEYS}
+
+
+@celery_app.task(soft_time_limit=30, ignore_result=True)
+def store_check_task(data, queued_at: Optional[float] = None):
+    """Perform a check and write its result to the database from the worker.
+
+    A check that could not be performed is written as failed, as the runner
+    waits for every check of the round to be written.
+    """
+    try:
+        result = _perform_check(data, queued_at)
+    except Exception as e:
+        logger.exception('Unable to perform a check of round %s', data['round_number'])
+        result = failed_check(dict(data, queued_at=queued_at), e)
+    _get_worker_writer().add(result)
+
+
+@celery_app.task(soft_time_limit=30, ignore_result=True)
+def store_check_snapshot_task(round_number, team_id, service_id, snapshot_version,
+                              queued_at: Optional[float] = None):
+    """Like :func:`check_snapshot_task`, but write the result from the worker."""
+    try:
+        result = check_snapshot_task(
+            round_number, team_id, service_id, snapshot_version, queued_at=queued_at)
+    except Exception as e:
+        logger.exception('Unable to perform a check of round %s', round_number)
+        result = failed_check(dict(
+            official=round_number is not None,
+            output=[],
+            round_number=round_number,
+            service_id=service_id,
+            team_id=team_id,
+            queued_at=queued_at,
+        ), e)
+    _get_worker_writer().add(result)
+
+
+def _perform_check(data, queued_at: Optional[float] = None):
     try:
         check_function = _get_check_function(**data['check'])
     except (AttributeError, ImportError) as e:
@@ -17,20 +89,139 @@ def check_task(data):
         logger.error('There was en error getting the check function: %r', e)
         raise
 
-    check_function(CheckData(data))
+    if resolver.dns_cache_config['enabled']:
+        resolver.prepare_check(data)
+
+    if queued_at is not None:
+        data['queued_at'] = queued_at
+    with timed_check(data):
+        check_function(CheckData(data))
     return data
 
 
+@contextmanager
+def timed_check(data):
+    """Record when a check started and finished (and its metrics)."""
+    data['started_at'] = time.time()
+    try:
+        with metrics.track_check(data):
+            yield
+    finally:
+        data['finished_at'] = time.time()
+
+
+_worker_writer = None
+_worker_writer_lock = threading.Lock()
+
+
+def _get_worker_writer():
+    global _worker_writer
+
+    with _worker_writer_lock:
+        if _worker_writer is None:
+            from .runner import runner_config
+
+            _worker_writer = persistence.BackgroundCheckWriter(
+                batch_size=runner_config['batch_size'],
+                flush_interval=runner_config['flush_interval'],
+                compress_output=runner_config['compress_output'],
+            )
+        return _worker_writer
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def _close_worker_writer(**kwargs):
+    if _worker_writer is not None:
+        _worker_writer.close()
+
+
+_snapshot_cache = collections.OrderedDict()
+_snapshot_cache_lock = threading.Lock()
+
+
+def _get_snapshot(version):
+    with _snapshot_cache_lock:
+        if version in _snapshot_cache:
+            _snapshot_cache.move_to_end(version)
+            return _snapshot_cache[version]
+
+    logger.info('Loading config snapshot %s', version)
+    with utils.session_scope() as session:
+        snapshot_data, = (session
+            .query(models.ConfigSnapshot.data)
+            .filter_by(version=version)
+            .one()
+        )
+    snapshot = json.loads(snapshot_data)
+    if resolver.dns_cache_config['enabled']:
+        resolver.prepare(utils.serialize_checks_from_snapshot(snapshot))
+
+    with _snapshot_cache_lock:
+        _snapshot_cache[version] = snapshot
+        while len(_snapshot_cache) > SNAPSHOT_CACHE_SIZE:
+            _snapshot_cache.popitem(last=False)
+    return snapshot
+
+
+def perform_check_in_process(process_pools, data, timeout):
+    """Perform a check in the process pool of its group (see :class:`executors.ProcessPools`).
+
+    The check is failed if it runs for more than ``timeout`` seconds once a
+    process has picked it up.
+    """
+    try:
+        result = process_pools.run(
+            data['check']['file_name'], _perform_check, data, timeout=timeout)
+    except TimeoutError:
+        return timed_out_check(data, timeout)
+    metrics.record_check(result, result['finished_at'] - result['started_at'])
+    return result
+
+
+def copy_check_data(data):
+    """Copy the data of a check for an attempt at performing it.
+
+    An attempt that runs past its deadline is abandoned but keeps writing to
+    its data, so it must not share the data that :func:`timed_out_check` copies.
+    """
+    return copy.deepcopy(data)
+
+
+def timed_out_check(data, timeout):
+    """Fail a check that did not complete within ``timeout`` seconds."""
+    metrics.record_check_timeout(data)
+    check = CheckData(dict(copy.deepcopy(data), finished_at=time.time()))
+    check.passed = False
+    check.add_output('ERROR: Check did not complete within {} seconds', timeout)
+    return check.export()
+
+
+def failed_check(data, error: Exception):
+    """Fail a check that could not be performed because of ``error``."""
+    check = CheckData(dict(copy.deepcopy(data), finished_at=time.time()))
+    check.passed = False
+    check.add_output('ERROR: Check could not be performed ({}: {})', type(error).__name__, error)
+    return check.export()
+
+
+def unreachable_check(data, host, port, error):
+    """Fail a check whose target could not be connected to (see :mod:`probe`)."""
+    check = CheckData(copy.deepcopy(data))
+    check.passed = False
+    check.add_output('ERROR: Unable to connect to {}:{} ({}), so the check was not performed',
+                     host, port, os.strerror(error.errno) if error.errno else error)
+    return check.export()
+
+
 def _get_check_function(file_name, function_name):
-    check_module_name = 'scoreengine.checks.{}'.format(file_name)
-    check_module = importlib.import_module(check_module_name)
-    check_function = getattr(check_module, function_name)
-    return check_function
+    return registry.checks.get(file_name, function_name).function
 
 
 class CheckData:
     def __init__(self, data):
         self._data = data
+        self._phase = None
 
     @property
     def config(self):
@@ -53,5 +244,22 @@ class CheckData:
             message = message.decode()
         self._data['output'].append(message.format(*args, **kwargs))
 
+    def start_phase(self, name: str):
+        """Start timing a phase of the check (such as connect, auth or verify).
+
+        The previous phase, if any, ends here. The last phase ends with the
+        check. Phase durations are recorded in seconds.
+        """
+        self.end_phase()
+        self._phase = (name, time.perf_counter())
+
+    def end_phase(self):
+        if self._phase is None:
+            return
+        name, start = self._phase
+        self._phase = None
+        phases = self._data.setdefault('phases', {})
+        phases[name] = phases.get(name, 0) + time.perf_counter() - start
+
     def export(self):
         return self._data
@@ -1,15 +1,17 @@
 import collections
 from contextlib import contextmanager
+import hashlib
+import json
 import logging
 import random
-from typing import Optional
+from typing import List, Optional
 
-from sqlalchemy.exc import SQLAlchemyError
+import sqlalchemy
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
+import scoreengine
 from scoreengine import (
-    Session,
     config,
-    db_engine,
     models,
 )
 
@@ -19,7 +21,7 @@ logger = logging.getLogger(__name__)
 
 @contextmanager
 def session_scope():
-    session = Session()
+    session = scoreengine.Session()
     try:
         yield session
         session.commit()
@@ -38,7 +40,149 @@ def serialize_check(session, team: models.Team, service: models.Service,
         .filter_by(service=service)
         .all()
     )
+    return _build_task_description(
+        team.id, team.name, service.id, service.name, service.group, service.check,
+        team_service_data, round_number)
 
+
+def serialize_checks(session, teams: List[models.Team], services: List[models.Service],
+                     round_number: Optional[int]=None):
+    """Serialize the checks for every team and service pair.
+
+    All of the team service data is fetched with a single query (instead of one
+    query per pair, as with :func:`serialize_check`) and grouped in memory.
+    """
+    snapshot = build_snapshot(session, teams, services)
+    return serialize_checks_from_snapshot(snapshot, round_number)
+
+
+def build_snapshot(session, teams: List[models.Team], services: List[models.Service]):
+    """Collect everything needed to serialize the checks of the teams and services.
+
+    The snapshot consists only of JSON types, so that it can be published for
+    workers to serialize checks themselves (see :func:`snapshot_version`).
+    """
+    snapshot = dict(
+        teams={str(team.id): team.name for team in teams},
+        services={
+            str(service.id): dict(name=service.name, group=service.group, check=service.check)
+            for service in services
+        },
+        data={},
+    )
+    if not teams or not services:
+        return snapshot
+
+    team_service_data = (session
+        .query(
+            models.TeamService.team_id,
+            models.TeamService.service_id,
+            models.TeamService.key,
+            models.TeamService.value,
+        )
+        .filter(models.TeamService.team_id.in_([team.id for team in teams]))
+        .filter(models.TeamService.service_id.in_([service.id for service in services]))
+        .order_by(models.TeamService.id)
+        .all()
+    )
+
+    # Group the key/value pairs by team and service
+    for team_id, service_id, key, value in team_service_data:
+        snapshot['data'].setdefault(_snapshot_key(team_id, service_id), []).append([key, value])
+
+    return snapshot
+
+
+def get_change_marker(session) -> tuple:
+    """Get a marker that changes whenever teams, services or their data do.
+
+    This only takes one query over the ``modified`` columns (and the number of
+    rows, to catch deletions), instead of loading everything.
+    """
+    columns = []
+    for model in (models.Team, models.Service, models.TeamService):
+        columns.append(session.query(sqlalchemy.func.count(model.id)).as_scalar())
+        columns.append(session.query(sqlalchemy.func.max(model.modified)).as_scalar())
+    return tuple(session.query(*columns).one())
+
+
+def snapshot_version(snapshot: dict) -> str:
+    """Get a version identifier that changes whenever the snapshot does."""
+    return hashlib.sha256(json.dumps(snapshot, sort_keys=True).encode()).hexdigest()
+
+
+def publish_snapshot(session, snapshot: dict) -> str:
+    """Store the snapshot (unless it already is) for workers to load.
+
+    :return: The snapshot's version.
+    """
+    version = snapshot_version(snapshot)
+    already_published = (session
+        .query(models.ConfigSnapshot.id)
+        .filter_by(version=version)
+        .first()
+    )
+    if already_published is None:
+        session.add(models.ConfigSnapshot(version, json.dumps(snapshot)))
+        try:
+            session.commit()
+        except IntegrityError:
+            # Published at the same time by another round
+            session.rollback()
+    return version
+
+
+def prune_snapshots(session, first_round: int, current_version: str) -> int:
+    """Delete the snapshots that no round since ``first_round`` refers to,
+    except the current one (which unofficial rounds refer to as well).
+
+    :return: The number of snapshots deleted.
+    """
+    referenced_versions = (session
+        .query(models.Round.snapshot_version)
+        .filter(models.Round.number >= first_round)
+        .filter(models.Round.snapshot_version.isnot(None))
+    )
+    deleted = (session
+        .query(models.ConfigSnapshot)
+        .filter(models.ConfigSnapshot.version != current_version)
+        .filter(models.ConfigSnapshot.version.notin_(referenced_versions.subquery()))
+        .delete(synchronize_session=False)
+    )
+    session.commit()
+    return deleted
+
+
+def serialize_checks_from_snapshot(snapshot: dict, round_number: Optional[int]=None):
+    return [
+        serialize_check_from_snapshot(snapshot, int(team_id), int(service_id), round_number)
+        for team_id in snapshot['teams']
+        for service_id in snapshot['services']
+    ]
+
+
+def serialize_check_from_snapshot(snapshot: dict, team_id: int, service_id: int,
+                                  round_number: Optional[int]=None):
+    service = snapshot['services'][str(service_id)]
+    return _build_task_description(
+        team_id,
+        snapshot['teams'][str(team_id)],
+        service_id,
+        service['name'],
+        service['group'],
+        service['check'],
+        snapshot['data'].get(_snapshot_key(team_id, service_id), []),
+        round_number,
+    )
+
+
+def _snapshot_key(team_id: int, service_id: int) -> str:
+    return '{}:{}'.format(team_id, service_id)
+
+
+def _build_task_description(team_id: int, team_name: str, service_id: int,
+                            service_name: str, check_group: str, check_function: str,
+                            team_service_data, round_number: Optional[int]=None):
     # Collect the config into a key:list-of-values dictionary
     check_config = collections.defaultdict(list)
     for key, value in team_service_data:
@@ -55,62 +199,250 @@ def serialize_check(session, team: models.Team, service: models.Service,
 
     task_description = dict(
         check=dict(
-            file_name=service.group,
-            function_name=service.check,
+            file_name=check_group,
+            function_name=check_function,
         ),
         config=check_config,
         official=round_number is not None,
         output=[],
         passed=False,
         round_number=round_number,
-        service_id=service.id,
-        service_name=service.name,
-        team_id=team.id,
-        team_name=team.name,
+        service_id=service_id,
+        service_name=service_name,
+        team_id=team_id,
+        team_name=team_name,
     )
     return task_description
 
 
-def init_db_from_config():
-    """Initialize the database with teams (including a check team) and services."""
-    with session_scope() as session:
-        logger.debug('Re-creating database tables')
-        models.Base.metadata.drop_all(db_engine)
-        models.Base.metadata.create_all(db_engine)
+def migrate_db():
+    """Bring the schema of an existing database up to date with the models.
 
-        teams = {}
-        assert config['teams']['minimum'] < config['teams']['maximum']
+    Missing tables, columns and indexes are added. Nothing is dropped or
+    altered, so data is preserved.
+    """
+    db_engine = scoreengine.db_engine
+    models.Base.metadata.create_all(db_engine)
 
-        check_teams = config['teams']['check_teams']
-        for team in range(config['teams']['minimum'], config['teams']['maximum'] + 1):
-            is_check_team = team in check_teams
+    inspector = sqlalchemy.inspect(db_engine)
+    quote = db_engine.dialect.identifier_preparer.quote
+    with db_engine.begin() as connection:
+        for table in models.Base.metadata.sorted_tables:
+            column_names = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in column_names:
+                    continue
+                logger.info('Adding column %s.%s', table.name, column.name)
+                connection.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    quote(table.name),
+                    quote(column.name),
+                    column.type.compile(dialect=db_engine.dialect),
+                ))
+                if column.name == 'modified':
+                    models.track_modifications(table, connection)
+
+            index_names = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in index_names:
+                    continue
+                logger.info('Adding index %s', index.name)
+                index.create(connection)
 
-            logger.debug(
-                'Creating team %s%s',
-                team,
-                ' (check team)' if is_check_team else '',
-            )
 
-            teams[team] = models.Team('Team {}'.format(team), check_team=is_check_team)
-            session.add(teams[team])
-
-        for cfg in config['services']:
-            logger.debug('Adding service %r for all teams', cfg['name'])
-
-            check_group, check_function = cfg['check'].split('.', 1)
-            service = models.Service(cfg['name'], check_group, check_function)
-            session.add(service)
-
-            session.add_all(
-                models.TeamService(
-                    team,
-                    service,
-                    datum['key'],
-                    str(datum['value']).format(team=team_num),
-                    datum.get('editable'),
-                    datum.get('hidden'),
-                    order,
+def _teams_from_config() -> dict:
+    assert config['teams']['minimum'] < config['teams']['maximum']
+
+    check_teams = config['teams']['check_teams']
+    return {
+        team_num: dict(name='Team {}'.format(team_num), check_team=team_num in check_teams)
+        for team_num in range(config['teams']['minimum'], config['teams']['maximum'] + 1)
+    }
+
+
+def _services_from_config() -> list:
+    services = []
+    for cfg in config['services']:
+        check_group, check_function = cfg['check'].split('.', 1)
+        services.append(dict(name=cfg['name'], group=check_group, check=check_function))
+    return services
+
+
+def _team_service_from_config(team_ids: dict, service_ids: dict) -> dict:
+    """Map the identity of each configured team service datum (see
+    :func:`_team_service_identities`) to its data."""
+    team_service = {}
+    for cfg in config['services']:
+        for team_num in team_ids:
+            data = [
+                dict(
+                    team_id=team_ids[team_num],
+                    service_id=service_ids[cfg['name']],
+                    key=datum['key'],
+                    value=str(datum['value']).format(team=team_num),
+                    edit=bool(datum.get('editable', False)),
+                    hidden=bool(datum.get('hidden', False)),
+                    order=order,
                 )
-                for team_num, team in teams.items()
                 for order, datum in enumerate(cfg['data'])
+            ]
+            team_service.update(zip(_team_service_identities(data), data))
+    return team_service
+
+
+def _team_service_identities(rows) -> list:
+    """Identify team service data by team, service, key and (as keys such as
+    ``USERPASS`` may repeat) how many data of that key come before it, so
+    that data keep their identity when others are added or removed."""
+    occurrences = collections.Counter()
+    identities = []
+    for row in rows:
+        key = row['team_id'], row['service_id'], row['key']
+        identities.append(key + (occurrences[key],))
+        occurrences[key] += 1
+    return identities
+
+
+def init_db_from_config(sync: bool = False):
+    """Initialize the database with teams (including a check team) and services.
+
+    :param sync: Instead of re-creating the database, update it to match the
+                 configuration: add what is missing, update what changed
+                 (except values that teams may edit), and disable the teams
+                 and services that are no longer configured (but not enable
+                 those that are disabled).
+    """
+    db_engine = scoreengine.db_engine
+    teams = _teams_from_config()
+    services = _services_from_config()
+
+    if sync:
+        models.Base.metadata.create_all(db_engine)
+        with db_engine.begin() as connection:
+            _sync_db(connection, teams, services)
+        return
+
+    logger.debug('Re-creating database tables')
+    models.Base.metadata.drop_all(db_engine)
+    models.Base.metadata.create_all(db_engine)
+
+    teams_table = models.Team.__table__
+    services_table = models.Service.__table__
+    with db_engine.begin() as connection:
+        logger.debug('Creating %d teams', len(teams))
+        connection.execute(teams_table.insert(), list(teams.values()))
+
+        logger.debug('Creating %d services', len(services))
+        connection.execute(services_table.insert(), services)
+
+        team_ids = _get_ids(connection, teams_table)
+        team_ids = {team_num: team_ids[team['name']] for team_num, team in teams.items()}
+        service_ids = _get_ids(connection, services_table)
+
+        team_service = _team_service_from_config(team_ids, service_ids)
+        logger.debug('Creating %d team service data', len(team_service))
+        if team_service:
+            connection.execute(models.TeamService.__table__.insert(), list(team_service.values()))
+
+
+def _get_ids(connection, table) -> dict:
+    return {
+        name: id_
+        for id_, name in connection.execute(sqlalchemy.select([table.c.id, table.c.name]))
+    }
+
+
+def _sync_db(connection, teams: dict, services: list):
+    teams_table = models.Team.__table__
+    services_table = models.Service.__table__
+    team_service_table = models.TeamService.__table__
+
+    team_ids = _sync_rows(connection, teams_table, list(teams.values()), 'teams')
+    team_ids = {team_num: team_ids[team['name']] for team_num, team in teams.items()}
+    service_ids = _sync_rows(connection, services_table, services, 'services')
+
+    rows = connection.execute(team_service_table
+        .select()
+        .order_by(team_service_table.c.order, team_service_table.c.id)
+    ).fetchall()
+    existing = dict(zip(_team_service_identities(rows), rows))
+    configured = _team_service_from_config(team_ids, service_ids)
+
+    added = [datum for identity, datum in configured.items() if identity not in existing]
+    if added:
+        connection.execute(team_service_table.insert(), added)
+
+    changed = 0
+    for identity, datum in configured.items():
+        row = existing.get(identity)
+        if row is None:
+            continue
+        if row.edit:
+            # Teams may have changed the value since
+            datum = dict(datum, value=row.value)
+        if any(row[column] != value for column, value in datum.items()):
+            changed += 1
+            connection.execute(team_service_table
+                .update()
+                .where(team_service_table.c.id == row.id)
+                .values(**datum)
             )
+
+    # The data of disabled teams and services is kept, in case they come back
+    configured_team_ids = set(team_ids.values())
+    configured_service_ids = {service_ids[service['name']] for service in services}
+    removed = [
+        row.id
+        for identity, row in existing.items()
+        if identity not in configured
+        and row.team_id in configured_team_ids
+        and row.service_id in configured_service_ids
+    ]
+    if removed:
+        connection.execute(team_service_table
+            .delete()
+            .where(team_service_table.c.id.in_(removed))
+        )
+
+    logger.info(
+        'Team service data: %d added, %d updated, %d removed',
+        len(added), changed, len(removed),
+    )
+
+
+def _sync_rows(connection, table, configured: list, kind: str) -> dict:
+    """Add, update and disable rows (by name) to match the configuration.
+
+    Rows that are disabled stay so, whether they were disabled by an earlier
+    synchronization or by an operator.
+
+    :return: The IDs of the configured rows by name.
+    """
+    existing = {row.name: row for row in connection.execute(table.select())}
+
+    added = [values for values in configured if values['name'] not in existing]
+    if added:
+        connection.execute(table.insert(), added)
+
+    changed = 0
+    for values in configured:
+        row = existing.get(values['name'])
+        if row is None:
+            continue
+        if any(row[column] != value for column, value in values.items()):
+            changed += 1
+            connection.execute(table.update().where(table.c.id == row.id).values(**values))
+
+    configured_names = {values['name'] for values in configured}
+    disabled = [
+        row.id
+        for name, row in existing.items()
+        if name not in configured_names and row.enabled
+    ]
+    if disabled:
+        connection.execute(table.update().where(table.c.id.in_(disabled)).values(enabled=False))
+
+    logger.info(
+        'Synchronized %s: %d added, %d updated, %d disabled',
+        kind, len(added), changed, len(disabled),
+    )
+    return _get_ids(connection, table)
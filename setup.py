@@ -19,6 +19,13 @@ setup(
         'requests',
         'sqlalchemy',
     ],
+    extras_require={
+        'async': [
+            'aiohttp',
+            'aiomysql',
+            'dnspython>=2.0',
+        ],
+    },
     entry_points='''
         [console_scripts]
         scoreengine2=scoreengine.cli:cli
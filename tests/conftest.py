@@ -0,0 +1,37 @@
+import os
+import tempfile
+
+import pytest
+
+import scoreengine
+
+
+_database_dir = tempfile.mkdtemp(prefix='scoreengine-tests-')
+
+# Instead of config.yml, which the modules under test read when first imported
+scoreengine.config._config = {
+    'logging': {'format': '%(asctime)s [%(levelname)s] %(name)s: %(message)s', 'level': 'INFO'},
+    'database': {'url': 'sqlite:///{}'.format(os.path.join(_database_dir, 'db.sqlite3'))},
+    'celery': {'broker': 'memory://', 'backend': None, 'worker': {'concurrency': 4}},
+    'bank': {
+        'enabled': True,
+        'url': 'http://127.0.0.1:1/',
+        'username': 'bank',
+        'password': 'secret',
+    },
+    'checks': {},
+    'round': {},
+    'runner': {},
+    'services': [],
+    'teams': [],
+}
+
+
+@pytest.fixture
+def db():
+    """An empty database."""
+    from scoreengine import db_engine, models
+
+    models.Base.metadata.create_all(db_engine)
+    yield
+    models.Base.metadata.drop_all(db_engine)
@@ -0,0 +1,156 @@
+from datetime import datetime, timedelta
+import http.server
+import threading
+import time
+import urllib.parse
+
+import pytest
+
+from scoreengine import bank, models, utils
+
+
+class StandInBank(http.server.ThreadingHTTPServer):
+    """A stand-in Bank API, whose responses are given in advance: ``'ok'``
+    (200), ``'error'`` (500) or ``'hang'`` (no response for a while)."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StandInBankHandler)
+        self.responses = []
+        self.requests = []
+        self.release = threading.Event()
+
+    @property
+    def url(self):
+        return 'http://{}:{}/'.format(*self.server_address)
+
+
+class StandInBankHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append(dict(urllib.parse.parse_qsl(body.decode())))
+        response = self.server.responses.pop(0) if self.server.responses else 'ok'
+
+        if response == 'hang':
+            self.server.release.wait(5)
+            return
+        self.send_response(200 if response == 'ok' else 500)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in_bank(monkeypatch):
+    server = StandInBank()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setitem(bank.bank_config, 'url', server.url)
+    monkeypatch.setitem(bank.bank_config, 'timeout', 0.2)
+    monkeypatch.setitem(bank.bank_config, 'retry_delay', 1)
+    monkeypatch.setitem(bank.bank_config, 'max_attempts', 3)
+    yield server
+    server.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def payout_id(db):
+    with utils.session_scope() as session:
+        team = models.Team('Team 1')
+        session.add(team)
+        session.flush()
+        payout = models.Payout(team_id=team.id, round=1)
+        session.add(payout)
+        session.flush()
+        return payout.id
+
+
+def get_payout(payout_id) -> models.Payout:
+    with utils.session_scope() as session:
+        payout = session.query(models.Payout).get(payout_id)
+        session.expunge(payout)
+        return payout
+
+
+def make_due(payout_id):
+    with utils.session_scope() as session:
+        session.query(models.Payout).filter_by(id=payout_id).update(
+            {models.Payout.next_attempt: datetime.utcnow() - timedelta(seconds=1)})
+
+
+def test_sent_payouts_are_marked_as_sent(stand_in_bank, payout_id):
+    assert bank.PayoutSender().send_due() == 1
+
+    payout = get_payout(payout_id)
+    assert payout.sent is not None
+    assert payout.attempts == 1
+    assert payout.last_error is None
+    assert stand_in_bank.requests == [
+        {'username': 'bank', 'password': 'secret', 'team': str(payout.team_id)},
+    ]
+    # Nothing is due anymore
+    assert bank.PayoutSender().send_due() == 0
+
+
+def test_failed_payouts_are_retried_with_backoff(stand_in_bank, payout_id):
+    stand_in_bank.responses = ['error', 'error']
+    sender = bank.PayoutSender()
+
+    before = datetime.utcnow()
+    assert sender.send_due() == 1
+    payout = get_payout(payout_id)
+    assert payout.sent is None
+    assert payout.attempts == 1
+    assert '500' in payout.last_error
+    retry_delay = timedelta(seconds=1)
+    assert before + retry_delay <= payout.next_attempt <= datetime.utcnow() + retry_delay
+    # Not due until the retry delay has passed
+    assert sender.send_due() == 0
+
+    make_due(payout_id)
+    before = datetime.utcnow()
+    assert sender.send_due() == 1
+    payout = get_payout(payout_id)
+    assert payout.sent is None
+    assert payout.attempts == 2
+    assert payout.next_attempt >= before + timedelta(seconds=2)
+
+    make_due(payout_id)
+    assert sender.send_due() == 1
+    payout = get_payout(payout_id)
+    assert payout.sent is not None
+    assert payout.attempts == 3
+    assert payout.last_error is None
+
+
+def test_payouts_are_given_up_on_after_max_attempts(stand_in_bank, payout_id):
+    stand_in_bank.responses = ['error'] * 3
+    sender = bank.PayoutSender()
+
+    for _ in range(3):
+        make_due(payout_id)
+        assert sender.send_due() == 1
+
+    make_due(payout_id)
+    assert sender.send_due() == 0
+    assert get_payout(payout_id).sent is None
+    assert bank.get_queue_status()[:2] == (0, 1)
+
+
+def test_timed_out_payouts_are_retried(stand_in_bank, payout_id):
+    stand_in_bank.responses = ['hang']
+
+    start = time.monotonic()
+    assert bank.PayoutSender().send_due() == 1
+    assert time.monotonic() - start < 2
+
+    payout = get_payout(payout_id)
+    assert payout.sent is None
+    assert payout.attempts == 1
+    assert 'timed out' in payout.last_error.lower()
+    assert bank.get_queue_status()[:2] == (1, 0)
@@ -0,0 +1,189 @@
+import asyncio
+import socket
+import threading
+import time
+
+import dns.flags
+import dns.message
+import dns.query
+import dns.rcode
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+import pytest
+
+from scoreengine import utils
+from scoreengine.checks import dns as dns_checks
+from scoreengine.tasks import CheckData
+
+
+ADDRESS = '192.0.2.1'
+
+
+class StandInDnsServer:
+    """A DNS server, on UDP and TCP, that answers A queries by the first label
+    of the name: ``www`` with ``ADDRESS``, ``wrong`` with another address,
+    ``missing`` with NXDOMAIN, ``broken`` with SERVFAIL and ``big`` with too
+    many records for UDP (so that its responses over UDP are truncated).
+    """
+
+    def __init__(self):
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_socket.bind(('127.0.0.1', 0))
+        self.port = self.udp_socket.getsockname()[1]
+        self.tcp_socket = socket.socket()
+        self.tcp_socket.bind(('127.0.0.1', self.port))
+        self.tcp_socket.listen(16)
+        self.tcp_queries = 0
+        threading.Thread(target=self._serve_udp, daemon=True).start()
+        threading.Thread(target=self._serve_tcp, daemon=True).start()
+
+    def close(self):
+        self.udp_socket.close()
+        self.tcp_socket.close()
+
+    def _respond(self, query, max_size: int = 65535) -> bytes:
+        response = dns.message.make_response(query)
+        question = query.question[0]
+        label = question.name.labels[0]
+        if label == b'missing':
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            return response.to_wire()
+        if label == b'broken':
+            response.set_rcode(dns.rcode.SERVFAIL)
+            return response.to_wire()
+
+        if label == b'wrong':
+            addresses = ['198.51.100.1']
+        elif label == b'big':
+            addresses = ['192.0.2.{}'.format(index) for index in range(1, 100)]
+        else:
+            addresses = [ADDRESS]
+        rrset = response.find_rrset(
+            response.answer, question.name, dns.rdataclass.IN, dns.rdatatype.A, create=True)
+        for address in addresses:
+            rrset.add(dns.rdata.from_text(dns.rdataclass.IN, dns.rdatatype.A, address), 60)
+        try:
+            return response.to_wire(max_size=max_size)
+        except dns.exception.TooBig:
+            response = dns.message.make_response(query)
+            response.flags |= dns.flags.TC
+            return response.to_wire()
+
+    def _serve_udp(self):
+        while True:
+            try:
+                wire, address = self.udp_socket.recvfrom(65535)
+            except OSError:
+                return
+            self.udp_socket.sendto(self._respond(dns.message.from_wire(wire), 512), address)
+
+    def _serve_tcp(self):
+        def handle(sock):
+            with sock:
+                query, _ = dns.query.receive_tcp(sock, time.time() + 10)
+                dns.query.send_tcp(sock, self._respond(query))
+
+        while True:
+            try:
+                sock, _ = self.tcp_socket.accept()
+            except OSError:
+                return
+            self.tcp_queries += 1
+            threading.Thread(target=handle, args=(sock,), daemon=True).start()
+
+
+@pytest.fixture
+def dns_server():
+    server = StandInDnsServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def silent_port():
+    """The port of a UDP socket that never responds."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    yield sock.getsockname()[1]
+    sock.close()
+
+
+@pytest.fixture(params=[
+    pytest.param((False, False), id='resolver'),
+    pytest.param((False, True), id='resolver-async'),
+    pytest.param((True, False), id='multiplexed'),
+    pytest.param((True, True), id='multiplexed-async'),
+])
+def perform_check(request, monkeypatch):
+    """Perform a DNS check on the resolver or multiplexed path, and its
+    blocking or asyncio variant."""
+    multiplex, use_async = request.param
+    if use_async and dns_checks.AsyncResolver is None:
+        pytest.skip('dnspython < 2.0 has no asyncio resolver')
+
+    monkeypatch.setitem(dns_checks.dns_config, 'multiplex', multiplex)
+    monkeypatch.setitem(dns_checks.dns_config, 'timeout', 0.2)
+    monkeypatch.setitem(dns_checks.dns_config, 'lifetime', 0.5)
+    # The resolvers keep the timeouts they were created with
+    dns_checks._get_resolver.cache_clear()
+    if dns_checks.AsyncResolver is not None:
+        dns_checks._get_async_resolver.cache_clear()
+
+    def perform(port, lookup):
+        check = CheckData(utils._build_task_description(
+            1, 'Team', 1, 'DNS', 'dns', 'check_dns', [
+                ('HOST', '127.0.0.1'),
+                ('PORT', port),
+                ('LOOKUP', lookup),
+                ('TYPE', 'A'),
+                ('EXPECTED', ADDRESS),
+            ],
+        ))
+        if use_async:
+            asyncio.run(dns_checks.check_dns_async(check))
+        else:
+            dns_checks.check_dns(check)
+        return check.export()
+
+    return perform
+
+
+def test_correct_answer(dns_server, perform_check):
+    result = perform_check(dns_server.port, 'www.team1.example')
+    assert result['passed']
+
+
+def test_wrong_answer(dns_server, perform_check):
+    result = perform_check(dns_server.port, 'wrong.team1.example')
+    assert not result['passed']
+    assert 'NOTICE: DNS Server returned 198.51.100.1' in result['output']
+    assert 'ERROR: DNS Server did not respond with the correct IP' in result['output']
+
+
+def test_nxdomain(dns_server, perform_check):
+    result = perform_check(dns_server.port, 'missing.team1.example')
+    assert not result['passed']
+    assert result['output'][-1].startswith('ERROR: NXDOMAIN: ')
+
+
+def test_servfail(dns_server, perform_check):
+    result = perform_check(dns_server.port, 'broken.team1.example')
+    assert not result['passed']
+    assert result['output'][-1].startswith('ERROR: NoNameservers: ')
+    assert 'SERVFAIL' in result['output'][-1]
+
+
+def test_truncated_answer_is_retried_over_tcp(dns_server, perform_check):
+    result = perform_check(dns_server.port, 'big.team1.example')
+    assert result['passed']
+    assert dns_server.tcp_queries == 1
+
+
+def test_silent_server(silent_port, perform_check):
+    start = time.monotonic()
+    result = perform_check(silent_port, 'www.team1.example')
+    assert not result['passed']
+    assert 'Timeout' in result['output'][-1]
+    # Given up on once the lifetime ran out
+    assert time.monotonic() - start < 2
@@ -0,0 +1,122 @@
+import functools
+import socket
+import threading
+import time
+
+import pytest
+
+from scoreengine.executors import DeadlineExecutor, ProcessPools
+
+
+@pytest.fixture
+def silent_server():
+    """A TCP server that accepts connections but never responds."""
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(64)
+    yield listener.getsockname()
+    listener.close()
+
+
+def hang(address):
+    with socket.create_connection(address, timeout=10) as sock:
+        return sock.recv(1)
+
+
+def test_hung_calls_are_abandoned_at_the_deadline(silent_server):
+    with DeadlineExecutor(max_workers=2, deadline=0.2) as executor:
+        start = time.monotonic()
+        future = executor.submit(hang, silent_server)
+        with pytest.raises(TimeoutError):
+            future.result(timeout=5)
+        assert 0.2 <= time.monotonic() - start < 1
+
+
+def test_on_timeout_results_are_returned(silent_server):
+    with DeadlineExecutor(max_workers=2, deadline=0.2) as executor:
+        future = executor.submit(hang, silent_server, on_timeout=lambda: 'timed out')
+        assert future.result(timeout=5) == 'timed out'
+
+
+def test_replacement_workers_keep_throughput(silent_server):
+    with DeadlineExecutor(max_workers=2, deadline=0.2) as executor:
+        start = time.monotonic()
+        hung = [executor.submit(hang, silent_server, on_timeout=lambda: None) for _ in range(2)]
+        quick = [executor.submit(time.sleep, 0.01) for _ in range(20)]
+
+        for future in hung + quick:
+            future.result(timeout=5)
+        # The hung calls took both workers until the deadline; replacements
+        # then performed the other calls two at a time
+        assert time.monotonic() - start < 0.2 + 20 * 0.01 / 2 + 0.5
+
+
+def test_abandoned_results_are_discarded():
+    release = threading.Event()
+
+    def wait():
+        release.wait(5)
+        return 'late'
+
+    with DeadlineExecutor(max_workers=1, deadline=0.1) as executor:
+        future = executor.submit(wait, on_timeout=lambda: 'timed out')
+        assert future.result(timeout=5) == 'timed out'
+        release.set()
+        assert executor.submit(lambda: 'next').result(timeout=5) == 'next'
+        assert future.result() == 'timed out'
+
+
+
+@pytest.mark.parametrize('burst', [2, 4, 6])
+def test_bursts_get_as_many_workers_as_allowed(burst):
+    def sleep():
+        time.sleep(0.3)
+        return threading.get_ident()
+
+    with DeadlineExecutor(max_workers=4, deadline=5) as executor:
+        # Leave an idle worker, which is yet to wake up when the burst comes
+        executor.submit(time.sleep, 0).result(timeout=5)
+        time.sleep(0.05)
+
+        start = time.monotonic()
+        futures = [executor.submit(sleep) for _ in range(burst)]
+        workers = {future.result(timeout=5) for future in futures}
+        assert len(workers) == min(burst, 4)
+        assert time.monotonic() - start < 0.3 * -(-burst // 4) + 0.2
+
+
+def test_full_pool_does_not_delay_other_pools():
+    with DeadlineExecutor(max_workers=4, deadline=5, pool_sizes={'ssh': 2}) as executor:
+        ssh = [executor.submit(time.sleep, 1, pool='ssh') for _ in range(6)]
+        time.sleep(0.05)
+        # No workers are started for work that the pool has no room for
+        assert executor._workers == 2
+
+        start = time.monotonic()
+        icmp = [executor.submit(time.sleep, 0.2, pool='icmp') for _ in range(8)]
+        for future in icmp:
+            future.result(timeout=5)
+        # Two at a time on each of the 4 workers shared by other pools
+        assert time.monotonic() - start < 0.4 + 0.3
+
+        for future in ssh:
+            future.result(timeout=5)
+
+def test_processes_move_on_from_hung_calls():
+    process_pools = ProcessPools({'group': 1})
+    try:
+        # Start the process, so that its start-up is not timed
+        assert process_pools.run('group', abs, -1) == 1
+
+        with DeadlineExecutor(max_workers=2, deadline=0.2) as executor:
+            run = functools.partial(process_pools.run, 'group', timeout=0.5)
+            hung = executor.submit(run, time.sleep, 30, timed=False)
+            queued = executor.submit(run, abs, -2, timed=False)
+
+            with pytest.raises(TimeoutError):
+                hung.result(timeout=5)
+            # The queued call is timed from when the process picked it up,
+            # not from when it was submitted
+            assert queued.result(timeout=5) == 2
+    finally:
+        process_pools.shutdown()
@@ -0,0 +1,145 @@
+import time
+
+import pytest
+
+from scoreengine import models, persistence, utils
+
+
+def check(team_id, service_id, round_number, passed) -> dict:
+    return dict(team_id=team_id, service_id=service_id, round=round_number, passed=passed)
+
+
+def write_checks(checks):
+    """Write checks and add them to the summaries, as writers do."""
+    with utils.session_scope() as session:
+        session.bulk_insert_mappings(models.Check, checks)
+        persistence.update_check_summaries(session, checks)
+
+
+def get_summaries() -> dict:
+    with utils.session_scope() as session:
+        return {
+            (summary.team_id, summary.service_id):
+                (summary.passes, summary.failures, summary.last_round, summary.last_passed)
+            for summary in session.query(models.CheckSummary)
+        }
+
+
+def rebuild_summaries():
+    with utils.session_scope() as session:
+        persistence.rebuild_check_summaries(session)
+
+
+def test_summaries_are_updated_with_each_batch(db):
+    write_checks([check(1, 1, 1, True), check(1, 2, 1, False), check(2, 1, 1, True)])
+    write_checks([check(1, 1, 2, False), check(1, 2, 2, False)])
+
+    assert get_summaries() == {
+        (1, 1): (1, 1, 2, False),
+        (1, 2): (0, 2, 2, False),
+        (2, 1): (1, 0, 1, True),
+    }
+
+
+def test_earlier_rounds_do_not_replace_the_last_status(db):
+    # Rounds may overlap, so a round's checks can be written after the next one's
+    write_checks([check(1, 1, 2, True)])
+    write_checks([check(1, 1, 1, False)])
+
+    assert get_summaries() == {(1, 1): (1, 1, 2, True)}
+
+
+def test_rebuilt_summaries_match_updated_summaries(db):
+    write_checks([check(1, 1, 1, True), check(1, 2, 1, False)])
+    write_checks([check(1, 1, 3, False), check(1, 2, 3, True)])
+    write_checks([check(1, 1, 2, True)])
+    updated = get_summaries()
+
+    rebuild_summaries()
+    assert get_summaries() == updated
+    # Rebuilding again changes nothing
+    rebuild_summaries()
+    assert get_summaries() == updated
+
+
+def result(team_id, round_number, passed) -> dict:
+    return dict(
+        official=True,
+        team_id=team_id,
+        service_id=1,
+        round_number=round_number,
+        passed=passed,
+        output=['ScoreEngine: Test Check', 'EXPECTED: Nothing', 'OUTPUT:'],
+    )
+
+
+@pytest.fixture
+def round_number(db):
+    with utils.session_scope() as session:
+        session.add(models.Round(1))
+    return 1
+
+
+def get_round(round_number) -> models.Round:
+    with utils.session_scope() as session:
+        round_obj = session.query(models.Round).filter_by(number=round_number).one()
+        session.expunge(round_obj)
+        return round_obj
+
+
+def test_checks_are_written_once_a_batch_is_full(round_number):
+    writer = persistence.CheckWriter(round_number, batch_size=2)
+
+    writer.add(result(1, round_number, True))
+    assert persistence.count_checks(round_number) == 0
+    writer.add(result(2, round_number, False))
+    assert persistence.count_checks(round_number) == 2
+    assert not get_round(round_number).completed
+
+
+@pytest.mark.parametrize('compress_output', [False, True])
+def test_remaining_checks_are_written_on_close(round_number, compress_output):
+    writer = persistence.CheckWriter(round_number, batch_size=10, compress_output=compress_output)
+    for team_id in (1, 2, 3):
+        writer.add(result(team_id, round_number, team_id != 2))
+    # Unofficial checks are not written
+    writer.add(dict(result(4, None, True), official=False))
+    assert persistence.count_checks(round_number) == 0
+
+    writer.close()
+    assert persistence.count_checks(round_number) == 3
+    assert get_round(round_number).completed
+    with utils.session_scope() as session:
+        checks = session.query(models.Check).order_by(models.Check.team_id).all()
+        assert [check.passed for check in checks] == [True, False, True]
+        assert checks[0].output == 'ScoreEngine: Test Check\nEXPECTED: Nothing\nOUTPUT:'
+        assert (checks[0].compressed_output is not None) == compress_output
+        assert sorted(team_id for team_id, in session.query(models.Payout.team_id)) == [1, 3]
+    assert get_summaries() == {
+        (1, 1): (1, 0, 1, True),
+        (2, 1): (0, 1, 1, False),
+        (3, 1): (1, 0, 1, True),
+    }
+
+
+def test_background_writer_writes_on_close(db):
+    writer = persistence.BackgroundCheckWriter(batch_size=10, flush_interval=60)
+    writer.add(result(1, 1, True))
+    writer.add(result(2, 2, False))
+    assert persistence.count_checks(1) == 0
+
+    writer.close()
+    assert persistence.count_checks(1) == 1
+    assert persistence.count_checks(2) == 1
+
+
+def test_background_writer_writes_periodically(db):
+    writer = persistence.BackgroundCheckWriter(batch_size=10, flush_interval=0.1)
+    try:
+        writer.add(result(1, 1, True))
+        deadline = time.monotonic() + 2
+        while persistence.count_checks(1) == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert persistence.count_checks(1) == 1
+    finally:
+        writer.close()
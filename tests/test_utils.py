@@ -0,0 +1,166 @@
+import pytest
+import sqlalchemy
+
+import scoreengine
+from scoreengine import models, utils
+
+
+SERVICES = [
+    dict(name='ICMP', check='icmp.check_icmp', data=[
+        dict(key='HOST', value='10.{team}.1.1'),
+    ]),
+    dict(name='SSH', check='ssh.check_ssh', data=[
+        dict(key='HOST', value='10.{team}.1.2'),
+        dict(key='USERPASS', value='alice||changeme', editable=True),
+        dict(key='USERPASS', value='bob||changeme', editable=True),
+    ]),
+]
+
+
+@pytest.fixture
+def configure(db, monkeypatch):
+    """Configure the teams (numbered 1 to ``maximum``) and services."""
+    def configure(maximum, services, check_teams=()):
+        monkeypatch.setitem(scoreengine.config._config, 'teams', dict(
+            minimum=1, maximum=maximum, check_teams=list(check_teams)))
+        monkeypatch.setitem(scoreengine.config._config, 'services', services)
+
+    return configure
+
+
+def get_enabled(model) -> dict:
+    with utils.session_scope() as session:
+        return {row.name: row.enabled for row in session.query(model)}
+
+
+def get_data() -> dict:
+    """Get the values of the team service data by team, service and key."""
+    with utils.session_scope() as session:
+        data = {}
+        for datum in (session
+                .query(models.TeamService)
+                .order_by(models.TeamService.order, models.TeamService.id)):
+            data.setdefault((datum.team.name, datum.service.name, datum.key), []).append(
+                datum.value)
+        return data
+
+
+def edit(team_name, service_name, key, old_value, new_value):
+    """Change a value, as teams do."""
+    with utils.session_scope() as session:
+        datum, = (session
+            .query(models.TeamService)
+            .join(models.Team)
+            .join(models.Service)
+            .filter(models.Team.name == team_name)
+            .filter(models.Service.name == service_name)
+            .filter(models.TeamService.key == key)
+            .filter(models.TeamService.value == old_value)
+        )
+        datum.value = new_value
+
+
+def test_init_creates_teams_services_and_data(configure):
+    configure(3, SERVICES, check_teams=[3])
+    utils.init_db_from_config()
+
+    assert get_enabled(models.Team) == {'Team 1': True, 'Team 2': True, 'Team 3': True}
+    assert get_enabled(models.Service) == {'ICMP': True, 'SSH': True}
+    with utils.session_scope() as session:
+        assert [team.name for team in session.query(models.Team).filter_by(check_team=True)] == [
+            'Team 3']
+    data = get_data()
+    assert len(data) == 3 * 3
+    assert data['Team 2', 'ICMP', 'HOST'] == ['10.2.1.1']
+    assert data['Team 2', 'SSH', 'USERPASS'] == ['alice||changeme', 'bob||changeme']
+
+
+def test_sync_adds_updates_and_removes_data(configure):
+    configure(2, SERVICES)
+    utils.init_db_from_config()
+
+    configure(3, [
+        dict(name='ICMP', check='icmp.check_icmp', data=[
+            dict(key='HOST', value='10.{team}.2.1'),
+        ]),
+        dict(name='SSH', check='ssh.check_ssh', data=[
+            dict(key='HOST', value='10.{team}.1.2'),
+            dict(key='USERPASS', value='alice||changeme', editable=True),
+        ]),
+        dict(name='FTP', check='ftp.check_upload_download', data=[
+            dict(key='HOST', value='10.{team}.1.3'),
+        ]),
+    ])
+    utils.init_db_from_config(sync=True)
+
+    assert get_enabled(models.Team) == {'Team 1': True, 'Team 2': True, 'Team 3': True}
+    assert get_enabled(models.Service) == {'ICMP': True, 'SSH': True, 'FTP': True}
+    data = get_data()
+    assert len(data) == 3 * 4
+    assert data['Team 1', 'ICMP', 'HOST'] == ['10.1.2.1']
+    assert data['Team 1', 'SSH', 'USERPASS'] == ['alice||changeme']
+    assert data['Team 3', 'SSH', 'USERPASS'] == ['alice||changeme']
+    assert data['Team 3', 'FTP', 'HOST'] == ['10.3.1.3']
+
+
+def test_sync_keeps_values_that_teams_edited(configure):
+    configure(2, SERVICES)
+    utils.init_db_from_config()
+    edit('Team 1', 'SSH', 'USERPASS', 'bob||changeme', 'bob||secret')
+
+    services = [dict(service, data=list(service['data'])) for service in SERVICES]
+    services[1]['data'][0] = dict(key='HOST', value='10.{team}.1.22')
+    services[1]['data'][2] = dict(key='USERPASS', value='bob||password', editable=True)
+    configure(2, services)
+    utils.init_db_from_config(sync=True)
+
+    data = get_data()
+    assert data['Team 1', 'SSH', 'HOST'] == ['10.1.1.22']
+    assert data['Team 1', 'SSH', 'USERPASS'] == ['alice||changeme', 'bob||secret']
+    assert data['Team 2', 'SSH', 'USERPASS'] == ['alice||changeme', 'bob||changeme']
+
+
+def test_sync_disables_removed_teams_and_services(configure):
+    configure(3, SERVICES)
+    utils.init_db_from_config()
+    with utils.session_scope() as session:
+        session.query(models.Team).filter_by(name='Team 1').update({models.Team.enabled: False})
+
+    configure(2, SERVICES[:1])
+    utils.init_db_from_config(sync=True)
+
+    # Teams disabled by an operator stay disabled
+    assert get_enabled(models.Team) == {'Team 1': False, 'Team 2': True, 'Team 3': False}
+    assert get_enabled(models.Service) == {'ICMP': True, 'SSH': False}
+    # The data of disabled teams and services is kept
+    data = get_data()
+    assert data['Team 3', 'ICMP', 'HOST'] == ['10.3.1.1']
+    assert data['Team 2', 'SSH', 'USERPASS'] == ['alice||changeme', 'bob||changeme']
+
+    configure(3, SERVICES)
+    utils.init_db_from_config(sync=True)
+    assert get_enabled(models.Team) == {'Team 1': False, 'Team 2': True, 'Team 3': False}
+    assert get_enabled(models.Service) == {'ICMP': True, 'SSH': False}
+
+
+def test_migrate_adds_missing_tables_columns_and_indexes(db):
+    db_engine = scoreengine.db_engine
+    with db_engine.begin() as connection:
+        connection.execute('DROP TABLE check_summaries')
+        connection.execute('DROP INDEX ix_checks_team_id_service_id_round')
+        connection.execute('ALTER TABLE checks DROP COLUMN phases')
+        connection.execute('INSERT INTO checks (team_id, service_id, round, passed) '
+                           'VALUES (1, 1, 1, 1)')
+
+    utils.migrate_db()
+
+    inspector = sqlalchemy.inspect(db_engine)
+    assert 'check_summaries' in inspector.get_table_names()
+    assert 'phases' in {column['name'] for column in inspector.get_columns('checks')}
+    assert 'ix_checks_team_id_service_id_round' in {
+        index['name'] for index in inspector.get_indexes('checks')}
+    # The data is kept
+    with utils.session_scope() as session:
+        check, = session.query(models.Check)
+        assert check.passed
+        assert check.phases is None